@@ -3,7 +3,7 @@ import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.cluster import KMeans
+import plotly.io as pio
 from fpdf import FPDF
 import gspread
 #from googletrans import Translator
@@ -12,24 +12,39 @@ import base64
 import time
 import os
 import re
+import html
 from io import StringIO
 import hashlib
+import json
 import secrets
+import shutil
 from pymongo import MongoClient
 from pymongo.errors import PyMongoError
 import io  # For in-memory file handling
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
 from urllib.parse import quote_plus
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from clustering import fit_belonging_profiles, profile_sizes_by_group
+from exports import EXPORT_FORMATS, export_filename, export_tables, write_export
+from network import OVERALL, network_aggregate
+from processing import (BOOTSTRAP_MIN_GROUP, CROSSTAB_MIN_CELL, SUMMARY_VERSION, build_dataset_results,
+                        build_upload_summary, construct_scores, crosstab, crosstab_cube, filter_index, filter_mask, filtered_results,
+                        group_averages, item_reliability, response_breakdown, summarize_results,
+                        value_counts_table)
+from responses import (GROUP_FIELDS, INSERT_BATCH, construct_group_pipeline, pipeline_frame, question_order,
+                       response_documents, response_indexes)
+from snapshots import BUNDLE_EXTENSION, BundleError, load_bundle, read_manifest, save_bundle
+from reports import custom_chart_options, generate_pdf, generate_custom_pdf
+from workers import WorkerPool, WorkerPoolBusy, WorkerPoolRestarted, JobTimeout
+from telemetry import StageMetrics, collect, mark_cache_miss, result_sizes, serve_metrics, set_sink, stage, timed
 
 from datetime import datetime, date 
-import matplotlib.pyplot as plt
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.graphics.shapes import Drawing
-from reportlab.graphics.charts.barcharts import VerticalBarChart
-from reportlab.graphics.charts.textlabels import Label
-from reportlab.lib.units import inch
+from PIL import Image as PILImage
 
 
 # Function to load and process data
@@ -91,17 +106,10 @@ def create_user_account(school_id, password, email, school_name, logo_file):
             file_extension = os.path.splitext(logo_file.name)[1]
             logo_filename_in_mongo = f"logo_{school_id}{file_extension}"
 
-            # To use upload_file_to_mongo, we can temporarily change the name
-            # of the uploaded file object.
-            original_name = logo_file.name
-            logo_file.name = logo_filename_in_mongo
-            logo_file.seek(0)  # Rewind file pointer as a good practice
-
             # Upload to MongoDB
-            if not upload_file_to_mongo(school_id, logo_file):
+            if not upload_file_to_mongo(school_id, logo_filename_in_mongo, logo_file.getvalue()):
                 return False, "Error saving school logo. Account not created."
 
-            logo_file.name = original_name  # Restore original name
             logo_identifier = logo_filename_in_mongo
 
         # Append new user data including the school name and logo identifier
@@ -111,6 +119,7 @@ def create_user_account(school_id, password, email, school_name, logo_file):
         return False, f"Error creating account: {str(e)}"
 
 # Function to validate login credentials
+@timed("sheets_login")
 def validate_login(school_id, password):
     """Validates user login using salted password hashes."""
     try:
@@ -178,8 +187,12 @@ def update_user_password(school_id, new_password):
     except Exception as e:
         return False, f"An error occurred while updating password: {str(e)}"
     
-@st.cache_data(ttl=3600)  # Cache for 1 hour to reduce API calls
+@timed("school_details", cache=True)
+# Cache for 1 hour to reduce API calls. A resource cache, so every render shares the one
+# logo bytes object instead of unpickling a copy per call; bytes are immutable, so this is safe.
+@st.cache_resource(ttl=3600, show_spinner=False)
 def get_school_details(school_id):
+    mark_cache_miss()
     try:
         sheet = connect_to_google_sheet("Apnapan User Accounts")
         all_school_ids = sheet.col_values(1)
@@ -190,14 +203,11 @@ def get_school_details(school_id):
             school_name = user_data[4]
             logo_identifier = user_data[5] if len(user_data) > 5 else ""
 
-            logo_base64 = ""
+            logo_bytes = b""
             if logo_identifier:
-                # Download the logo from MongoDB and encode it
-                logo_file_buffer = download_file_from_mongo(school_id, logo_identifier)
-                if logo_file_buffer:
-                    logo_bytes = logo_file_buffer.getvalue()
-                    logo_base64 = base64.b64encode(logo_bytes).decode('utf-8')
-            return school_name, logo_base64
+                # Download the raw logo bytes from MongoDB; callers encode them only where HTML needs it
+                logo_bytes = download_file_from_mongo(school_id, logo_identifier) or b""
+            return school_name, logo_bytes
         else:
             return None, None
     except Exception as e:
@@ -218,43 +228,201 @@ def get_mime_type(filename):
         return 'text/plain'
     return 'application/octet-stream'  # Generic fallback
 
-# Function to connect to MongoDB collection
-@st.cache_resource  # Cache for efficiency
-def get_mongo_collection():
+# Static assets are served by Streamlit from ./static (server.enableStaticServing in .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+GENERATED_ASSET_DIR = os.path.join(STATIC_DIR, "generated")
+
+def publish_image(image_bytes, name, max_size):
+    """
+    Downscales an image to fit max_size (width, height), writes it under static/generated with a
+    content-hashed filename and returns its URL. The ?v= query makes the browser cache it for good,
+    so reruns send only the URL instead of the image. Falls back to a data URI if publishing fails.
+    """
+    try:
+        with PILImage.open(io.BytesIO(image_bytes)) as img:
+            img_format = "JPEG" if img.format == "JPEG" else "PNG"
+            img.thumbnail(max_size, PILImage.LANCZOS)
+            resized = io.BytesIO()
+            if img_format == "JPEG":
+                img.save(resized, format="JPEG", quality=85, optimize=True)
+            else:
+                img.save(resized, format="PNG", optimize=True)
+        data = resized.getvalue()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        filename = f"{name}.{digest}.{'jpg' if img_format == 'JPEG' else 'png'}"
+        path = os.path.join(GENERATED_ASSET_DIR, filename)
+        if not os.path.exists(path):
+            os.makedirs(GENERATED_ASSET_DIR, exist_ok=True)
+            tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Atomic, so a concurrent request never sees a partial file
+        return f"app/static/generated/{filename}?v={digest}"
+    except (OSError, ValueError) as e:
+        print(f"Error publishing image {name}: {e}")
+        return f"data:image/png;base64,{base64.b64encode(image_bytes).decode()}"
+
+@st.cache_resource(show_spinner=False)
+def load_asset_bytes(path):
+    """Reads a bundled asset once per process (b"" if it is missing)."""
+    if not os.path.exists(path):
+        print(f"Asset file not found: {path}")
+        return b""
+    with open(path, "rb") as f:
+        return f.read()
+
+@st.cache_resource(show_spinner=False)
+def get_static_image_url(path, max_size):
+    """Publishes a bundled image once per process and returns its cacheable URL ("" if missing)."""
+    image_bytes = load_asset_bytes(path)
+    return publish_image(image_bytes, os.path.splitext(os.path.basename(path))[0], max_size) if image_bytes else ""
+
+# Exports and saved analyses are written to a private folder (never under the public static
+# root), each in a folder named by a random token, and handed to st.download_button
+EXPORT_TTL_SECONDS = float(os.environ.get("EXPORT_TTL_MIN", "30")) * 60
+# st.download_button holds the file in memory while the session shows it, so size is capped
+DOWNLOAD_MAX_BYTES = int(os.environ.get("DOWNLOAD_MAX_MB", "200")) * 1024 * 1024
+# Extension -> MIME type sent with the download
+DOWNLOAD_MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "zip": "application/zip",
+}
+
+class GeneratedFileTooLarge(Exception):
+    """Raised when a written export or bundle is too large to be offered for download."""
+
+    def __init__(self, nbytes):
+        super().__init__(f"{nbytes} bytes is over the {DOWNLOAD_MAX_BYTES} byte download limit")
+        self.nbytes = nbytes
+
+def get_export_dir():
+    return os.path.join(get_spill_dir(), "exports")
+
+def purge_exports(max_age_seconds):
+    """Deletes export folders older than max_age_seconds."""
+    # Files published under the public static root by earlier versions of the app
+    shutil.rmtree(os.path.join(GENERATED_ASSET_DIR, "exports"), ignore_errors=True)
+    export_dir = get_export_dir()
+    if not os.path.isdir(export_dir):
+        return
+    cutoff = time.time() - max_age_seconds
+    for token in os.listdir(export_dir):
+        folder = os.path.join(export_dir, token)
+        try:
+            if os.path.getmtime(folder) < cutoff:
+                shutil.rmtree(folder, ignore_errors=True)
+        except OSError:
+            pass
+
+def discard_generated_file(download):
+    """Deletes a file from write_generated_file (and its folder) once it is no longer offered."""
+    if download:
+        shutil.rmtree(os.path.dirname(download[0]), ignore_errors=True)
+
+def write_export_file(tables, export_format, stem):
+    """Writes tables as an export file and returns (path, filename, size in bytes)."""
+    return write_generated_file(export_filename(stem, tables, export_format),
+                                lambda path: write_export(tables, export_format, path))
+
+def write_generated_file(filename, write):
+    """
+    Calls write(path) to create filename in a fresh token folder under the private export
+    directory and returns (path, filename, size in bytes); write returns the size. Used by
+    exports and saved analyses alike. Raises GeneratedFileTooLarge (and deletes the file)
+    when it is over DOWNLOAD_MAX_BYTES. Files are deleted after EXPORT_TTL_MIN minutes.
+    """
+    purge_exports(EXPORT_TTL_SECONDS)
+    folder = os.path.join(get_export_dir(), secrets.token_urlsafe(24))
+    os.makedirs(folder)
+    path = os.path.join(folder, filename)
+    tmp_path = f"{path}.tmp"
+    try:
+        nbytes = write(tmp_path)
+        if nbytes > DOWNLOAD_MAX_BYTES:
+            raise GeneratedFileTooLarge(nbytes)
+        os.replace(tmp_path, path)  # Atomic, so a download never sees a partial file
+    except BaseException:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    return path, filename, nbytes
+
+def render_download_button(state_key, label):
+    """
+    Offers the file stored in st.session_state[state_key] by write_generated_file as a
+    download, sent as an attachment of its own type to this session only.
+    """
+    download = st.session_state.get(state_key)
+    if not download:
+        return
+    path, filename, nbytes = download
+    try:
+        with open(path, "rb") as f:
+            st.download_button(f"⬇ {label} {filename} ({nbytes / 2**20:.1f} MB)", f, file_name=filename,
+                               mime=DOWNLOAD_MIME_TYPES.get(filename.rsplit(".", 1)[-1], "application/octet-stream"),
+                               key=f"{state_key}_button")
+    except FileNotFoundError:
+        st.session_state.pop(state_key, None)
+        st.info("That file has expired. Please prepare it again.")
+        return
+    st.caption(f"Available for {EXPORT_TTL_SECONDS / 60:.0f} minutes.")
+
+# Function to connect to the MongoDB database
+@st.cache_resource  # One client per process, shared by every collection
+def get_mongo_database():
     # Encode username and password
     username = quote_plus(st.secrets["mongo"]["username"])
     password = quote_plus(st.secrets["mongo"]["password"])
     host = st.secrets["mongo"]["host"]
     db_name = st.secrets["mongo"]["db_name"]
-    collection_name = st.secrets["mongo"]["collection_name"]
 
     # Construct the URI with encoded credentials
     uri = f"mongodb+srv://{username}:{password}@{host}/{db_name}?retryWrites=true&w=majority"
     
     client = MongoClient(uri)
-    db = client[db_name]
-    collection = db[collection_name]
+    return client[db_name]
+
+# Function to connect to MongoDB collection
+@st.cache_resource  # Cache for efficiency
+def get_mongo_collection():
+    return get_mongo_database()[st.secrets["mongo"]["collection_name"]]
+
+# Function to connect to the per-upload summaries collection (see processing.summarize_results)
+@st.cache_resource
+def get_summaries_collection():
+    collection = get_mongo_database()[st.secrets["mongo"].get("summaries_collection", "upload_summaries")]
+    try:
+        collection.create_index([("school_id", 1), ("timestamp", 1)], name="school_timestamp")
+        collection.create_index("file_id", unique=True, name="file_id")
+    except PyMongoError as e:
+        print(f"Could not create summary indexes: {e}")
     return collection
 
 # Function to upload file to MongoDB (store as binary)
-def upload_file_to_mongo(school_id, uploaded_file):
+def upload_file_to_mongo(school_id, filename, file_data):
+    """
+    Stores file_data (the single bytes object read from the upload) without copying it again.
+    Returns the new document's id, or None if the upload failed.
+    """
     collection = get_mongo_collection()
     try:
-        file_data = uploaded_file.getvalue()  # Bytes
         timestamp = datetime.now()
         doc = {
             "school_id": school_id,
-            "filename": uploaded_file.name,
+            "filename": filename,
             "file_data": file_data,  # Binary data
             "timestamp": timestamp
         }
-        collection.insert_one(doc)
-        return True
+        with stage("mongo_upload", nbytes=len(file_data)):
+            result = collection.insert_one(doc)
+        return result.inserted_id  # Truthy; keys the upload's summary
     except PyMongoError as e:
         st.error(f"Upload error: {e}")
-        return False
+        return None
 
 # Function to list user's files from MongoDB
+@timed("list_user_files")
 def list_user_files(school_id):
     collection = get_mongo_collection()
     try:
@@ -285,12 +453,14 @@ def list_user_files(school_id):
         return []
 
 # Function to download file from MongoDB by filename (latest if duplicates)
+@timed("mongo_download")
 def download_file_from_mongo(school_id, filename):
+    """Returns the stored file as immutable bytes, shared by parsing and the download button."""
     collection = get_mongo_collection()
     try:
         file_doc = collection.find_one({"school_id": school_id, "filename": filename}, sort=[("timestamp", -1)])
         if file_doc:
-            return io.BytesIO(file_doc["file_data"])  # Return BytesIO for processing
+            return file_doc["file_data"]  # Raw bytes; wrap in io.BytesIO only where a stream is needed
         else:
             st.error("File not found.")
             return None
@@ -298,6 +468,722 @@ def download_file_from_mongo(school_id, filename):
         st.error(f"Download error: {e}")
         return None
 
+# Row-level responses are optional: set store_responses = true under [mongo] in the secrets
+def responses_enabled():
+    return bool(st.secrets["mongo"].get("store_responses", False))
+
+# Function to connect to the row-level responses collection (see responses.py)
+@st.cache_resource
+def get_responses_collection():
+    collection = get_mongo_database()[st.secrets["mongo"].get("responses_collection", "responses")]
+    try:
+        for keys, name in response_indexes():
+            collection.create_index(keys, name=name)
+    except PyMongoError as e:
+        print(f"Could not create response indexes: {e}")
+    return collection
+
+# Function to store one compact document per student of a processed upload
+def store_responses(school_id, file_id, results):
+    collection = get_responses_collection()
+    documents = response_documents(results, school_id, file_id)
+    try:
+        with stage("store_responses", rows=len(results["df_cleaned"])):
+            collection.delete_many({"u": file_id})  # Storing an upload again replaces its rows
+            while batch := list(islice(documents, INSERT_BATCH)):
+                collection.insert_many(batch, ordered=False)
+    except PyMongoError as e:
+        print(f"Could not store the responses of upload {file_id}: {e}")
+
+# Function to average every construct by one demographic group over the given uploads, in MongoDB
+@st.cache_data(ttl=600, show_spinner=False)
+def get_group_aggregate(upload_ids, group_field, constructs):
+    """Only the aggregated rows (one per group value) come back from the server."""
+    collection = get_responses_collection()
+    match = {"u": {"$in": list(upload_ids)}}
+    try:
+        with stage("mongo_group_aggregate"):
+            frame = pipeline_frame(collection.aggregate(construct_group_pipeline(match, group_field, constructs)),
+                                   GROUP_FIELDS[group_field][0])
+            uploads_covered = len(list(collection.aggregate([{"$match": match}, {"$group": {"_id": "$u"}}])))
+        return frame, uploads_covered
+    except PyMongoError as e:
+        print(f"Group aggregation failed: {e}")
+        return pd.DataFrame(), 0
+
+# Function to list every stored version of a school's survey files (without their contents)
+def list_upload_versions(school_id):
+    collection = get_mongo_collection()
+    try:
+        # Read the cursor here so network errors during iteration are caught too
+        return list(collection.find(
+            {"school_id": school_id, "filename": {"$not": {"$regex": "^logo_"}}},
+            {"school_id": 1, "filename": 1, "timestamp": 1},
+            sort=[("timestamp", 1)],
+        ))
+    except PyMongoError as e:
+        st.error(f"Error listing files: {e}")
+        return []
+
+# Function to store the metric summary of one upload, keyed by the uploaded file's id
+def save_upload_summary(school_id, file_id, filename, timestamp, summary):
+    try:
+        get_summaries_collection().update_one(
+            {"file_id": file_id},
+            {"$set": {"school_id": school_id, "filename": filename, "timestamp": timestamp, **summary}},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        print(f"Could not save the summary of {filename}: {e}")
+
+# Function to list a school's upload summaries, oldest first
+@timed("list_upload_summaries")
+def list_upload_summaries(school_id):
+    try:
+        return list(get_summaries_collection().find({"school_id": school_id}, {"_id": 0},
+                                                     sort=[("timestamp", 1)]))
+    except PyMongoError as e:
+        st.error(f"Error loading summaries: {e}")
+        return []
+
+# Function to find the latest stored upload of every school in the network
+@timed("latest_school_uploads")
+def latest_school_uploads():
+    collection = get_mongo_collection()
+    try:
+        pipeline = [
+            {"$match": {"filename": {"$not": {"$regex": "^logo_"}}}},  # Exclude logo files
+            {"$project": {"school_id": 1, "filename": 1, "timestamp": 1}},  # Leave the file contents behind
+            {"$sort": {"timestamp": -1}},
+            {"$group": {"_id": "$school_id", "file_id": {"$first": "$_id"}, "filename": {"$first": "$filename"},
+                        "timestamp": {"$first": "$timestamp"}}},
+            {"$project": {"_id": "$file_id", "school_id": "$_id", "filename": 1, "timestamp": 1}},
+        ]
+        return list(collection.aggregate(pipeline))
+    except PyMongoError as e:
+        st.error(f"Error listing schools: {e}")
+        return []
+
+# Function to load the stored summaries of the given uploads
+def load_summaries_for(file_ids):
+    try:
+        return list(get_summaries_collection().find({"file_id": {"$in": list(file_ids)}}, {"_id": 0}))
+    except PyMongoError as e:
+        st.error(f"Error loading summaries: {e}")
+        return []
+
+# Function to map school IDs to school names from the accounts sheet
+@st.cache_data(ttl=3600)
+def get_school_names():
+    try:
+        sheet = connect_to_google_sheet("Apnapan User Accounts")
+        # Assuming columns: School ID (1), ..., School Name (5)
+        return dict(zip(sheet.col_values(1)[1:], sheet.col_values(5)[1:]))
+    except Exception as e:
+        print(f"Could not load school names: {e}")
+        return {}
+
+# Function to summarise uploads whose summary is missing or stale, several at a time
+def refresh_upload_summaries(versions, summaries):
+    """
+    versions: stored uploads as {"_id", "school_id", "filename", "timestamp"}; summaries:
+    the stored summaries that may cover them. Only uploads without a summary of the current
+    SUMMARY_VERSION are parsed, in parallel in the worker pool, each file being read from
+    MongoDB as a worker becomes free. Returns the number of uploads summarised.
+    """
+    current = {doc["file_id"] for doc in summaries if doc.get("version") == SUMMARY_VERSION}
+    stale = [version for version in versions if version["_id"] not in current
+             and version["filename"].split('.')[-1].lower() in ["csv", "txt", "xlsx", "xls"]]
+    if not stale:
+        return 0
+    collection = get_mongo_collection()
+
+    def job_args():
+        for version in stale:
+            file_doc = collection.find_one({"_id": version["_id"]}, {"file_data": 1})
+            yield (file_doc["file_data"] if file_doc else b"", version["filename"].split('.')[-1].lower())
+
+    summarised = 0
+    results = run_many_in_worker(build_upload_summary, job_args(), message=f"Summarising {len(stale)} uploads")
+    for version, summary in zip(stale, results):
+        if isinstance(summary, Exception):  # One unreadable old file should not hide the others
+            print(f"Could not summarise {version['filename']}: {summary}")
+            continue
+        save_upload_summary(version["school_id"], version["_id"], version["filename"], version.get("timestamp"),
+                            summary)
+        summarised += 1
+    return summarised
+
+# Process-wide store for processed datasets, shared read-only by every session
+class DatasetStore:
+    """
+    Holds one copy of each processed dataset, keyed by the SHA-256 of the uploaded file.
+    Sessions keep only the key (a handle) in st.session_state and register themselves as
+    holders; entries with no holders are evicted, least recently used first, once the
+    store grows past its memory budget. Evicted entries are spilled to spill_dir (when set)
+    and rehydrated on the next access. Stored results must be treated as immutable.
+    Pickling to and from disk happens outside the lock, so other sessions never wait on it.
+    """
+
+    def __init__(self, budget_bytes, spill_dir=None):
+        self.budget_bytes = budget_bytes
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()  # key -> {"results": dict, "holders": set, "nbytes": int}
+        self._spilled = {}  # key -> path of results pickled to disk on eviction
+        self._spilling = {}  # key -> evicted entry still being written to disk
+        self._loading = {}  # key -> Event set once a spilled entry has been read back
+        self._lock = threading.Lock()
+
+    def acquire(self, key, holder, build):
+        """Registers holder on key, calling build() to create the results only if they are missing."""
+        if self.hold(key, holder):
+            return self.get(key)
+
+        # Build outside the lock so one large file does not block other sessions
+        results = build()
+        nbytes = estimate_results_nbytes(results)
+        with self._lock:
+            entry = self._entries.setdefault(key, {"results": results, "holders": set(), "nbytes": nbytes})
+            entry["holders"].add(holder)
+            self._entries.move_to_end(key)
+            evicted = self._evict()
+            print(f"Dataset store: {len(self._entries)} datasets, {self.total_bytes() / 2**20:.1f} MB "
+                  f"of {self.budget_bytes / 2**20:.0f} MB budget")
+        self._spill(evicted)
+        return entry["results"]
+
+    def hold(self, key, holder):
+        """Registers holder on an existing (or spilled) entry. Returns False if key is unknown."""
+        if self.get(key) is None:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry["holders"].add(holder)
+            return True
+
+    def release(self, key, holder):
+        """Removes holder from key; the entry stays cached until the budget forces it out."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["holders"].discard(holder)
+            evicted = self._evict()
+        self._spill(evicted)
+
+    def get(self, key):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry["results"]
+                entry = self._spilling.pop(key, None)
+                if entry is not None:
+                    # Not on disk yet: take it back as it is (the writer then deletes its file)
+                    evicted = self._admit(key, entry)
+                    break
+                loading = self._loading.get(key)
+                if loading is None:
+                    path = self._spilled.pop(key, None)
+                    if path is None:
+                        return None
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # Another session is reading this entry back; look again once it has
+            loading.wait()
+
+        if entry is None:
+            # Rehydrate a spilled entry; it comes back unreferenced until a session holds it again
+            try:
+                with open(path, "rb") as f:
+                    results = pickle.load(f)
+                os.remove(path)
+                entry = {"results": results, "holders": set(), "nbytes": estimate_results_nbytes(results)}
+            except (OSError, EOFError, AttributeError, pickle.UnpicklingError) as e:
+                print(f"Error rehydrating dataset {key[:12]}: {e}")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with self._lock:
+                del self._loading[key]
+                evicted = self._admit(key, entry) if entry is not None else []
+            loading.set()
+            if entry is None:
+                return None
+        self._spill(evicted)
+        return entry["results"]
+
+    def entry_nbytes(self, key):
+        entry = self._entries.get(key)
+        return entry["nbytes"] if entry else 0
+
+    def total_bytes(self):
+        return sum(entry["nbytes"] for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "total_bytes": self.total_bytes(),
+                "budget_bytes": self.budget_bytes,
+                "holders": sum(len(entry["holders"]) for entry in self._entries.values()),
+                "spilled": len(self._spilled) + len(self._spilling),
+            }
+
+    def purge_spilled(self, max_age_seconds):
+        """Deletes spill files nobody has asked for within max_age_seconds."""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            for key, path in list(self._spilled.items()):
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        del self._spilled[key]
+                except OSError:
+                    del self._spilled[key]
+
+    def _admit(self, key, entry):
+        # Caller holds the lock. Returns the keys evicted to make room, for _spill.
+        entry["holders"] = set()
+        self._entries[key] = entry
+        return self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        # Caller holds the lock. Oldest unreferenced entries go first; held entries are never dropped.
+        # Returns the evicted keys; the caller passes them to _spill once it has released the lock.
+        evicted = []
+        for key in list(self._entries):
+            if self.total_bytes() <= self.budget_bytes:
+                break
+            if key == keep or self._entries[key]["holders"]:
+                continue
+            entry = self._entries.pop(key)
+            if self.spill_dir:
+                self._spilling[key] = entry
+                evicted.append(key)
+        return evicted
+
+    def _spill(self, keys):
+        # Called without the lock: writes evicted entries to disk, then records where they went
+        for key in keys:
+            with self._lock:
+                entry = self._spilling.get(key)
+            if entry is None:
+                continue  # Taken back before it was written
+            path = os.path.join(self.spill_dir, f"dataset_{key}_{secrets.token_hex(4)}.pkl")
+            try:
+                with open(path, "wb") as f:
+                    pickle.dump(entry["results"], f, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                print(f"Error spilling dataset {key[:12]}: {e}")
+                try:
+                    os.remove(path)  # Partly written
+                except OSError:
+                    pass
+                with self._lock:
+                    if self._spilling.get(key) is entry:
+                        del self._spilling[key]
+                continue
+            with self._lock:
+                written = self._spilling.get(key) is entry
+                if written:
+                    del self._spilling[key]
+                    self._spilled[key] = path
+            if not written:
+                os.remove(path)  # Taken back while it was being written
+
+def estimate_results_nbytes(results):
+    """Approximate memory footprint of a processing results dict (DataFrames dominate)."""
+    total = 0
+    for value in results.values():
+        if isinstance(value, pd.DataFrame):
+            total += int(value.memory_usage(index=True, deep=True).sum())
+    return total
+
+def get_spill_dir():
+    """Directory for artifacts and datasets moved out of memory (created on first use)."""
+    spill_dir = os.environ.get("APNAPAN_SPILL_DIR", os.path.join(tempfile.gettempdir(), "apnapan_spill"))
+    os.makedirs(spill_dir, exist_ok=True)
+    return spill_dir
+
+@st.cache_resource
+def get_dataset_store():
+    budget_mb = int(os.environ.get("DATASET_STORE_BUDGET_MB", "2048"))
+    return DatasetStore(budget_mb * 1024 * 1024, spill_dir=get_spill_dir())
+
+def artifact_nbytes(value):
+    """Approximate in-memory size of a session artifact."""
+    if isinstance(value, io.BytesIO):
+        return value.getbuffer().nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+class SpilledArtifact:
+    """Placeholder left in a session after an idle artifact was written to disk."""
+
+    def __init__(self, path, nbytes):
+        self.path = path
+        self.nbytes = nbytes
+
+# Process-wide accounting of what each browser session keeps in memory
+class SessionRegistry:
+    """
+    Tracks each session's large artifacts (generated PDFs and similar) and when the
+    session was last active. Sessions idle longer than idle_timeout have artifacts of
+    at least spill_min_bytes written to disk and their dataset hold released; both are
+    brought back transparently on the next access. Sessions silent for drop_after are
+    forgotten entirely.
+    """
+
+    def __init__(self, idle_timeout, drop_after, spill_min_bytes, spill_dir):
+        self.idle_timeout = idle_timeout
+        self.drop_after = drop_after
+        self.spill_min_bytes = spill_min_bytes
+        self.spill_dir = spill_dir
+        self._sessions = {}  # session_id -> {"last_seen", "school_id", "dataset_key", "idle", "artifacts"}
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, school_id, dataset_key):
+        """Marks the session active. Returns True if it was idled and needs its dataset hold back."""
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {"artifacts": {}, "idle": False})
+            was_idle = session["idle"]
+            session.update(last_seen=time.time(), school_id=school_id, dataset_key=dataset_key, idle=False)
+            return was_idle
+
+    def put(self, session_id, name, value):
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {"artifacts": {}, "idle": False, "last_seen": time.time()})
+            self._discard(session["artifacts"].pop(name, None))
+            if value is not None:
+                session["artifacts"][name] = value
+
+    def get(self, session_id, name, default=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or name not in session["artifacts"]:
+                return default
+            value = session["artifacts"][name]
+        if not isinstance(value, SpilledArtifact):
+            return value
+        # Read back outside the lock; the artifact is swapped in only if nothing replaced it meanwhile
+        try:
+            with open(value.path, "rb") as f:
+                restored = pickle.load(f)
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError) as e:
+            print(f"Error rehydrating artifact {name}: {e}")
+            restored = value  # Unreadable: dropped below
+        with self._lock:
+            current = session["artifacts"].get(name, default)
+            if current is not value:  # Replaced while it was being read
+                return default if isinstance(current, SpilledArtifact) else current
+            if restored is value:
+                del session["artifacts"][name]
+            else:
+                session["artifacts"][name] = restored
+            self._discard(value)
+        return default if restored is value else restored
+
+    def sweep(self, dataset_store, interval=60):
+        """Spills idle sessions and forgets abandoned ones; runs at most once per interval seconds."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < interval:
+                return
+            self._last_sweep = now
+            to_release, to_spill = [], []
+            for session_id, session in list(self._sessions.items()):
+                idle_for = now - session.get("last_seen", now)
+                if idle_for >= self.drop_after:
+                    for value in session["artifacts"].values():
+                        self._discard(value)
+                    del self._sessions[session_id]
+                    if session.get("dataset_key") and not session["idle"]:
+                        to_release.append((session["dataset_key"], session_id))
+                elif idle_for >= self.idle_timeout and not session["idle"]:
+                    session["idle"] = True
+                    to_spill += [(session_id, session, name, value) for name, value in session["artifacts"].items()
+                                 if not isinstance(value, SpilledArtifact)]
+                    if session.get("dataset_key"):
+                        to_release.append((session["dataset_key"], session_id))
+        self._spill(to_spill)
+        for dataset_key, session_id in to_release:
+            dataset_store.release(dataset_key, session_id)
+        dataset_store.purge_spilled(self.drop_after)
+
+    def count(self):
+        """Number of sessions tracked, without measuring their artifacts."""
+        with self._lock:
+            return len(self._sessions)
+
+    def snapshot(self, dataset_store):
+        """Per-session memory usage rows for the operator view, largest first."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for session_id, session in self._sessions.items():
+                resident = sum(artifact_nbytes(v) for v in session["artifacts"].values()
+                               if not isinstance(v, SpilledArtifact))
+                spilled = sum(v.nbytes for v in session["artifacts"].values() if isinstance(v, SpilledArtifact))
+                dataset_bytes = 0 if session["idle"] else dataset_store.entry_nbytes(session.get("dataset_key"))
+                rows.append({
+                    "Session": session_id[:8],
+                    "School ID": session.get("school_id") or "-",
+                    "Idle (min)": round((now - session.get("last_seen", now)) / 60, 1),
+                    "Artifacts (MB)": round(resident / 2**20, 2),
+                    "Spilled (MB)": round(spilled / 2**20, 2),
+                    "Dataset (MB, shared)": round(dataset_bytes / 2**20, 2),
+                    "Status": "idle" if session["idle"] else "active",
+                })
+        return sorted(rows, key=lambda r: r["Artifacts (MB)"] + r["Dataset (MB, shared)"], reverse=True)
+
+    def _spill(self, candidates):
+        # Called without the lock: writes idle sessions' large artifacts to disk, then swaps in
+        # the placeholder unless the session came back or replaced the artifact meanwhile
+        for session_id, session, name, value in candidates:
+            nbytes = artifact_nbytes(value)
+            if nbytes < self.spill_min_bytes:
+                continue
+            spilled = SpilledArtifact(
+                os.path.join(self.spill_dir, f"session_{session_id}_{name}_{secrets.token_hex(4)}.pkl"), nbytes)
+            try:
+                with open(spilled.path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                print(f"Error spilling artifact {name}: {e}")
+                self._discard(spilled)
+                continue
+            with self._lock:
+                current = (self._sessions.get(session_id) is session and session["idle"]
+                           and session["artifacts"].get(name) is value)
+                if current:
+                    session["artifacts"][name] = spilled
+            if not current:
+                self._discard(spilled)
+
+    @staticmethod
+    def _discard(value):
+        if isinstance(value, SpilledArtifact):
+            try:
+                os.remove(value.path)
+            except OSError:
+                pass
+
+@st.cache_resource
+def get_session_registry():
+    return SessionRegistry(
+        idle_timeout=float(os.environ.get("SESSION_IDLE_TIMEOUT_MIN", "15")) * 60,
+        drop_after=float(os.environ.get("SESSION_DROP_AFTER_HOURS", "12")) * 3600,
+        spill_min_bytes=int(os.environ.get("SESSION_SPILL_MIN_KB", "256")) * 1024,
+        spill_dir=get_spill_dir(),
+    )
+
+# Process-wide cache of serialized Plotly figures for the Visualisation page
+class FigureCache:
+    """
+    Stores the JSON of each chart, keyed by (dataset key, chart key, theme), so a rerun
+    that changes nothing reuses the figure instead of rebuilding it. A figure is rebuilt
+    from its JSON without validation, which skips the plotly express work entirely.
+    Sessions register on the datasets they draw; when a session switches to another
+    dataset (or logs out) and no other session still uses the old one, its figures are
+    dropped. At most max_entries figures are kept, least recently used going first.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._figures = OrderedDict()  # (dataset_key, chart key, theme) -> figure JSON
+        self._holders = {}  # dataset_key -> set of session ids drawing it
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0}
+
+    def get(self, dataset_key, holder, key, build):
+        """Returns the figure cached under key for dataset_key, calling build() only on a miss."""
+        cache_key = (dataset_key, *key)
+        with self._lock:
+            self._holders.setdefault(dataset_key, set()).add(holder)
+            figure_json = self._figures.get(cache_key)
+            if figure_json is not None:
+                self._figures.move_to_end(cache_key)
+                self.counts["hits"] += 1
+        if figure_json is None:
+            # Built outside the lock; two sessions missing at once both build, and one copy is kept
+            figure_json = pio.to_json(build(), validate=False)
+            with self._lock:
+                self.counts["misses"] += 1
+                self._figures[cache_key] = figure_json
+                while len(self._figures) > self.max_entries:
+                    self._figures.popitem(last=False)
+        return go.Figure(json.loads(figure_json), _validate=False)
+
+    def release(self, dataset_key, holder):
+        """Drops holder's use of dataset_key, and the dataset's figures once nobody uses it."""
+        with self._lock:
+            holders = self._holders.get(dataset_key)
+            if holders is None:
+                return
+            holders.discard(holder)
+            if holders:
+                return
+            del self._holders[dataset_key]
+            for cache_key in [k for k in self._figures if k[0] == dataset_key]:
+                del self._figures[cache_key]
+
+    def stats(self):
+        with self._lock:
+            return {"figures": len(self._figures), "datasets": len(self._holders),
+                    "bytes": sum(len(v) for v in self._figures.values()), **self.counts}
+
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache(max_entries=int(os.environ.get("FIGURE_CACHE_MAX_ENTRIES", "512")))
+
+@st.cache_resource
+def get_worker_pool():
+    workers = int(os.environ.get("WORKER_PROCESSES", min(4, max(1, (os.cpu_count() or 2) - 1))))
+    return WorkerPool(
+        max_workers=workers,
+        max_pending=int(os.environ.get("WORKER_MAX_PENDING", max(2, 4 * workers))),
+        job_timeout=float(os.environ.get("WORKER_JOB_TIMEOUT_S", "300")),
+        max_abandoned=int(os.environ.get("WORKER_MAX_ABANDONED", "1")),
+        kill_after=float(os.environ.get("WORKER_KILL_AFTER", "3")),
+    )
+
+def run_in_worker(fn, *args, message="Working..."):
+    """
+    Runs a CPU-heavy job in the shared worker pool and returns its result. A status line
+    is refreshed while waiting; each refresh lets Streamlit interrupt the wait when the
+    user reruns the page, which cancels the job if it has not started yet.
+    """
+    status = st.empty()
+    started = time.monotonic()
+
+    def on_poll():
+        status.caption(f"{message} ({time.monotonic() - started:.0f}s)")
+
+    try:
+        with stage(f"worker_{fn.__name__}"):
+            result, records = get_worker_pool().run(get_session_id(), collect, fn, *args, on_poll=on_poll)
+        for record in records:
+            record_stage_timing(record)
+        return result
+    except (WorkerPoolBusy, WorkerPoolRestarted, JobTimeout) as e:
+        status.empty()
+        st.error(str(e))
+        st.stop()
+    finally:
+        status.empty()
+
+# Function to run many jobs in the worker pool at once, e.g. summaries of several uploads
+def run_many_in_worker(fn, args_iter, message="Working..."):
+    """
+    Like run_in_worker for a batch: returns one result per args tuple, in order, with the
+    exception in place of the result for a job that failed. args_iter may be a generator;
+    it is consumed only as workers become free.
+    """
+    status = st.empty()
+    started = time.monotonic()
+
+    def on_poll():
+        status.caption(f"{message} ({time.monotonic() - started:.0f}s)")
+
+    try:
+        with stage(f"worker_{fn.__name__}_batch") as batch_record:
+            jobs = ((fn, *args) for args in args_iter)
+            outcomes = get_worker_pool().run_many(get_session_id(), collect, jobs, on_poll=on_poll)
+            batch_record["jobs"] = len(outcomes)
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                results.append(outcome)
+                continue
+            result, records = outcome
+            for record in records:
+                record_stage_timing(record)
+            results.append(result)
+        return results
+    except (WorkerPoolBusy, WorkerPoolRestarted, JobTimeout) as e:
+        status.empty()
+        st.error(str(e))
+        st.stop()
+    finally:
+        status.empty()
+
+@st.cache_resource
+def get_stage_metrics():
+    metrics = StageMetrics()
+    store, pool, registry = get_dataset_store(), get_worker_pool(), get_session_registry()
+    metrics.add_gauge("apnapan_dataset_store_bytes", "Estimated bytes held by the dataset store.",
+                      lambda: store.stats()["total_bytes"])
+    metrics.add_gauge("apnapan_dataset_store_datasets", "Datasets held in memory.", lambda: store.stats()["datasets"])
+    metrics.add_gauge("apnapan_worker_jobs_in_flight", "Worker jobs queued or running.", lambda: pool.stats()["in_flight"])
+    metrics.add_gauge("apnapan_sessions_tracked", "Sessions known to the session registry.", registry.count)
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        # Bound to localhost by default; the endpoint is for a scraper on the same host
+        try:
+            serve_metrics(metrics, int(port), host=os.environ.get("METRICS_HOST", "127.0.0.1"))
+        except OSError as e:
+            print(f"Error starting metrics endpoint on port {port}: {e}")
+    return metrics
+
+def record_stage_timing(record):
+    """Adds a finished stage to the process histograms and to this session's recent timings."""
+    get_stage_metrics().observe(record)
+    if get_script_run_ctx() is not None:
+        timings = st.session_state.setdefault('stage_timings', deque(maxlen=100))
+        timings.appendleft({"at": datetime.now().strftime("%H:%M:%S"), **record})
+
+def get_session_id():
+    """Identifies the current browser session for holder bookkeeping."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "bare"
+
+def get_processing_results():
+    """Returns the shared processing results behind this session's dataset handle ({} if none)."""
+    dataset_key = st.session_state.get('dataset_key')
+    if not dataset_key:
+        return {}
+    return get_dataset_store().get(dataset_key) or {}
+
+def get_session_artifact(name, default=None):
+    """Reads a large per-session artifact, reloading it from disk if it was spilled while idle."""
+    return get_session_registry().get(get_session_id(), name, default)
+
+def set_session_artifact(name, value):
+    """Stores a large per-session artifact (None removes it) under memory accounting."""
+    get_session_registry().put(get_session_id(), name, value)
+
+def track_session_activity():
+    """Records this rerun for memory accounting and lets the registry spill idle sessions."""
+    registry = get_session_registry()
+    store = get_dataset_store()
+    session_id = get_session_id()
+    dataset_key = st.session_state.get('dataset_key')
+    if registry.touch(session_id, st.session_state.get('logged_in_user'), dataset_key) and dataset_key:
+        # Returning from idle: hold the dataset again (rehydrating it from disk if it was spilled)
+        store.hold(dataset_key, session_id)
+    registry.sweep(store)
+
+def is_admin_user():
+    """Operators are the school IDs listed under [admin] school_ids in the secrets."""
+    admin_ids = st.secrets.get("admin", {}).get("school_ids", [])
+    return st.session_state.get('logged_in_user') in admin_ids
+
+def release_session_dataset():
+    """Drops this session's hold on its dataset so the store may evict it."""
+    dataset_key = st.session_state.pop('dataset_key', None)
+    if dataset_key:
+        get_dataset_store().release(dataset_key, get_session_id())
+        get_figure_cache().release(dataset_key, get_session_id())
+
 # Set page config for mobile-friendly design
 st.set_page_config(layout="wide", page_title="Data Insights Generator")
 
@@ -308,6 +1194,23 @@ if 'current_page' not in st.session_state:
 # Define the navigate_to function
 def navigate_to(page):
     st.session_state['current_page'] = page
+
+# Stage timings from this script run feed the operator metrics
+set_sink(record_stage_timing)
+
+# Per-session memory accounting; also spills sessions that have gone idle
+track_session_activity()
+
+# Optional admin-only panel with this session's recent stage timings (toggled on the Operator View)
+if st.session_state.get('show_stage_debug') and is_admin_user():
+    with st.sidebar.expander("Stage timings (this session)", expanded=True):
+        stage_timings = list(st.session_state.get('stage_timings', []))
+        if stage_timings:
+            timings_df = pd.DataFrame(stage_timings)
+            timings_df["ms"] = (timings_df.pop("seconds") * 1000).round(1)
+            st.dataframe(timings_df, hide_index=True, use_container_width=True)
+        else:
+            st.caption("No stages recorded yet.")
     
 # Custom CSS for consistent theme and centering
 st.markdown("""
@@ -425,24 +1328,14 @@ st.markdown("""
 
 # Login Page
 if st.session_state['current_page'] == 'login':
-    # Load and encode logo
-    logo_base64 = ""
-    logo_path = "images/project_apnapan_logo.png"
-    if os.path.exists(logo_path):
-        try:
-            with open(logo_path, "rb") as img_file:
-                logo_base64 = base64.b64encode(img_file.read()).decode()
-            print(f"Logo loaded successfully: {logo_path}, length: {len(logo_base64)}")
-        except Exception as e:
-            print(f"Error loading logo: {e}")
-    else:
-        print(f"Logo file not found: {logo_path}")
+    # Logo is published once per process as a cacheable static file (sized for 2x displays)
+    logo_url = get_static_image_url("images/project_apnapan_logo.png", (400, 200))
 
     # Display title and logo
     st.markdown("<h1 style='text-align: center; color: white;'>Apnapan Pulse</h1>", unsafe_allow_html=True)
     st.markdown(f"""
     <div style="display: flex; justify-content: center; margin-bottom: 30px;">
-        <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" style="height: 100px;" />
+        <img src="{logo_url}" alt="Project Apnapan Logo" style="height: 100px;" />
     </div>
     """, unsafe_allow_html=True)
 
@@ -487,9 +1380,12 @@ if st.session_state['current_page'] == 'login':
                     st.success(message)
                     # Fetch and store school details in session state to avoid repeated API calls
                     with st.spinner("Loading school details..."):
-                        school_name, school_logo_base64 = get_school_details(school_id)
+                        school_name, school_logo_bytes = get_school_details(school_id)
                         st.session_state['school_name'] = school_name
-                        st.session_state['school_logo_base64'] = school_logo_base64
+                        # Keep the raw bytes for PDF embedding and encode once for the HTML header
+                        st.session_state['school_logo_bytes'] = school_logo_bytes
+                        # Publish a downscaled copy once; page headers reference it by URL
+                        st.session_state['school_logo_url'] = publish_image(school_logo_bytes, "school_logo", (200, 100)) if school_logo_bytes else ""
                     navigate_to('landing')
                     st.rerun()
                 else:
@@ -612,16 +1508,7 @@ if 'current_page' not in st.session_state:
 def navigate_to(page):
     st.session_state['current_page'] = page
 
-scale_base64 = ""
-scale_path = "images/Likert_Scale.png"  # Make sure this matches your file name and location
-if os.path.exists(scale_path):
-    try:
-        with open(scale_path, "rb") as img_file:
-            scale_base64 = base64.b64encode(img_file.read()).decode()
-    except Exception as e:
-        print(f"Error loading Likert scale image: {e}")
-else:
-    print(f"Scale file not found: {scale_path}")
+scale_url = get_static_image_url("images/Likert_Scale.png", (1200, 300))  # Shown at up to 600x150
 
 
 st.markdown("""
@@ -639,17 +1526,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load and encode logo
-logo_base64 = ""
 logo_path = "images/project_apnapan_logo.png"  # Adjust this path to match your file location
-if os.path.exists(logo_path):
-    try:
-        with open(logo_path, "rb") as img_file:
-            logo_base64 = base64.b64encode(img_file.read()).decode()
-        print(f"Logo loaded successfully: {logo_path}, length: {len(logo_base64)}")
-    except Exception as e:
-        print(f"Error loading logo: {e}")
-    else:
-        print(f"Logo file not found: {logo_path}")
+logo_bytes = load_asset_bytes(logo_path)  # Full-resolution bytes for the PDF builders
+logo_url = get_static_image_url(logo_path, (400, 200))  # Downscaled, cacheable copy for page headers
 
 # Inject CSS for styling
 st.markdown("""
@@ -735,125 +1614,331 @@ sample_data = pd.DataFrame({
 })
 
 
-def process_data_and_calculate_metrics(df):
+# --- Cached inputs for the Visualisation page ---
+# Keyed by the dataset handle; the shared frame is passed as an unhashed argument (leading
+# underscore) so Streamlit never hashes the full data. Aggregates are computed once per
+# dataset and column pair, and reused by every fragment rerun and every session.
+def get_visualisation_frame(view_key):
+    """The cleaned frame of this session's view (see get_view). Shared and read-only."""
+    return get_view()[1].get("df_cleaned")
+
+# Function to fetch a Visualisation page chart from the shared figure cache
+def get_cached_figure(view_key, chart_key, build):
     """
-    Takes a raw DataFrame, performs all cleaning, normalization, and metric calculations.
-    This centralized function is key to the app's performance.
+    The figure for chart_key (a tuple naming the chart, e.g. ("pie", "Gender")) in this
+    session's view, built by build() only when no session has drawn it for this view and
+    theme yet. Switching datasets releases the figures (see release_session_dataset).
     """
-    df_cleaned = df.copy()  # Work on a copy
-
-    # Define mappings inside the function for encapsulation
-    questionnaire_mapping = {
-        "Strongly Disagree": 1, "Disagree": 2, "Neutral": 3, "Agree": 4, "Strongly Agree": 5
-    }
-
-    # --- General Demographic Data Normalization (Case-Insensitive) ---
-    demographic_keywords = ["gender", "religion"]
-    for col in df_cleaned.columns:
-        if any(keyword in col.lower() for keyword in demographic_keywords):
-            df_cleaned[col] = df_cleaned[col].astype(str).str.strip().str.title()
-            df_cleaned[col] = df_cleaned[col].replace('Nan', 'Unknown')
-
-    # --- Grade Column Normalization ---
-    grade_column = next((col for col in df_cleaned.columns if "grade" in col.lower()), None)
-    if grade_column:
-        def normalize_grade(value):
-            s_val = str(value).strip()
-            numbers = re.findall(r'\d+', s_val)
-            if numbers:
-                return str(numbers[0])
-            return s_val.title() if s_val.lower() not in ['nan', ''] else 'Unknown'
-        df_cleaned[grade_column] = df_cleaned[grade_column].apply(normalize_grade)
-
-    # --- Questionnaire Mapping (convert to numeric) ---
-    questionnaire_cols = [
-        col for col in df_cleaned.columns
-        if any(str(val).strip().title() in questionnaire_mapping for val in df_cleaned[col].dropna())
-    ]
-    if questionnaire_cols:
-        for col in questionnaire_cols:
-            df_cleaned[col] = df_cleaned[col].astype(str).str.strip().str.title()
-            df_cleaned[col] = df_cleaned[col].map(questionnaire_mapping).fillna(df_cleaned[col])
-            df_cleaned[col] = pd.to_numeric(df_cleaned[col], errors="coerce")
-
-    # --- Improved, Case-Insensitive Ethnicity Cleaning ---
-    ethnicity_column = next((col for col in df_cleaned.columns if "ethnicity" in col.lower()), None)
-    if ethnicity_column:
-        def clean_ethnicity(value):
-            v_lower = str(value).lower().strip()
-            if "general" in v_lower:
-                return "General"
-            if "sc" in v_lower:
-                return "SC"
-            if "other" in v_lower: # For OBC
-                return "OBC"
-            if "do" in v_lower: # For "Don't know"
-                return "Don't Know"
-            if "st" in v_lower:
-                return "ST"
-            return str(value).strip().title() # Default: clean and title-case unmatched values
-        df_cleaned["ethnicity_cleaned"] = df_cleaned[ethnicity_column].apply(clean_ethnicity)
-
-    # --- Define Belonging Constructs ---
-    belonging_questions = {
-        "Safety": ["safe", "surakshit"],
-        "Respect": ["respected", "izzat", "as much respect"],
-        "Welcome": ["being welcomed", "welcome", "swagat"],
-        "Relationships with Teachers": ["one teacher", "share your problem", "care about your feelings", " care about how I feel", "feel close", "close to your teachers"],
-        "Participation": ["opportunities", "participate", "school activities", "take part", "join in many activities"],
-        "Acknowledgement": ["notice", "noticed", "listen to you", "dekhein", "acknowledge", "recognized", "listen to what I say", "valued", "heard", "seen", "like you", "like me", "do something well"]
-    }
-
-    # --- Match Constructs to Question Columns ---
-    matched_questions = {
-        cat: [col for col in df_cleaned.columns if any(k.lower() in col.lower() for k in keywords)]
-        for cat, keywords in belonging_questions.items()
-    }
+    dataset_key = view_key.split(":")[0]  # Filtered views share the dataset's holders
+    theme = st.get_option("theme.base") or "auto"
+    return get_figure_cache().get(dataset_key, get_session_id(), (view_key, *chart_key, theme), build)
+
+# Demographic columns used for grouping and filtering, matched by keyword
+group_columns = {
+    "Gender": ["gender", "What gender do you use"],
+    "Grade": ["grade", "Which grade are you in"],
+    "Income Status": ["Income Category"],
+    "Health Condition": ["disability", "health condition"],
+    "Ethnicity": ["ethnicity_cleaned"],
+    "Religion": ["religion"]
+}
 
-    # --- Special Handling: "Kaash" Questions ---
-    kaash_col = [
-        col for col in df_cleaned.columns if "kaash" in col.lower()]
-    df_cleaned["KaashScore"] = (
-        df_cleaned[kaash_col].apply(pd.to_numeric, errors="coerce").mean(axis=1) if kaash_col else 0
+# --- Subgroup filters ---
+# The sidebar restricts every analysis page to a subset of students. Each demographic value
+# has a precomputed bitmap (processing.filter_index), so any combination of selections is
+# resolved with bitwise operations; the filtered results are then shared per filter like
+# the dataset itself, and all the per-dataset caches are keyed by the view key.
+@timed("filter_index", cache=True)
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_filter_index(dataset_key, _df_cleaned, dimension_cols):
+    mark_cache_miss()
+    return filter_index(_df_cleaned, dimension_cols)
+
+@timed("filtered_results", cache=True)
+@st.cache_resource(show_spinner=False, max_entries=8, ttl=3600)
+def get_filtered_results(view_key, _results, _mask):
+    mark_cache_miss()
+    return filtered_results(_results, _mask)
+
+def get_dataset_filter_index(dataset_key, results):
+    """The filter bitmaps of the unfiltered dataset, over the group_columns it has."""
+    df_cleaned = results.get("df_cleaned")
+    if df_cleaned is None or df_cleaned.empty:
+        return None
+    dimension_cols = tuple(
+        (label, col) for label, keywords in group_columns.items()
+        for col in [next((c for c in df_cleaned.columns if any(k.lower() in c.lower() for k in keywords)), None)]
+        if col
     )
+    return get_filter_index(dataset_key, df_cleaned, dimension_cols)
 
-    # --- Compute Belonging Scores ---
-    belonging_cols = [col for sublist in matched_questions.values() for col in sublist]
-    if belonging_cols:
-        df_cleaned["BelongingRaw"] = df_cleaned[belonging_cols].apply(pd.to_numeric, errors="coerce").sum(axis=1)
-        df_cleaned["BelongingCount"] = df_cleaned[belonging_cols].apply(pd.to_numeric, errors="coerce").notna().sum(axis=1)
-        df_cleaned["BelongingScore"] = df_cleaned.apply(
-            lambda row: (row["BelongingRaw"] - row["KaashScore"]) / row["BelongingCount"] if row["BelongingCount"] > 0 else 0,
-            axis=1
-        )
-    else:
-        df_cleaned["BelongingRaw"] = 0
-        df_cleaned["BelongingCount"] = 0
-        df_cleaned["BelongingScore"] = 0
-
-    # --- Aggregate Insights ---
-    overall_belonging_score = df_cleaned["BelongingScore"].mean() if belonging_cols else None
-    category_averages = {
-        cat: df_cleaned[cols].apply(pd.to_numeric, errors='coerce').mean().mean() if cols else 0
-        for cat, cols in matched_questions.items()
-    }
-    highest_area = max(category_averages, key=category_averages.get) if category_averages else None
-    valid_categories = {k: v for k, v in category_averages.items() if v > 0.00}
-    lowest_area = min(valid_categories, key=valid_categories.get) if valid_categories else None
-
-    # --- Package results into a dictionary for clean state management ---
-    results = {
-        'df_cleaned': df_cleaned,
-        'matched_questions': matched_questions,
-        'demographic_keywords' : demographic_keywords,
-        'belonging_questions': belonging_questions,
-        'overall_belonging_score': overall_belonging_score,
-        'category_averages': category_averages,
-        'highest_area': highest_area,
-        'lowest_area': lowest_area,
-        'matched_questions_table': pd.DataFrame.from_dict(matched_questions, orient="index").T.fillna("")
-    }
-    return results
+def get_active_filters():
+    """({label: [values]} for the columns with values chosen in the sidebar, "and"/"or")."""
+    selections = {label: st.session_state.get(f"filter_{label}") for label in group_columns}
+    selections = {label: sorted(values) for label, values in selections.items() if values}
+    return selections, st.session_state.get("filter_combine", "and")
+
+def get_view():
+    """
+    (view_key, results) for this session: the shared dataset results, restricted to the
+    sidebar filters when any are set. view_key is the dataset key, extended with the
+    filters, and is what the cached aggregates are keyed by.
+    """
+    dataset_key = st.session_state.get('dataset_key')
+    results = get_processing_results()
+    selections, combine = get_active_filters()
+    if not results or not selections:
+        return dataset_key, results
+    index = get_dataset_filter_index(dataset_key, results)
+    mask = filter_mask(index, selections, combine) if index else None
+    if mask is None or not mask.any():
+        return dataset_key, results  # Nothing matches: the sidebar says so and shows everyone
+    signature = hashlib.sha256(repr((combine, sorted(selections.items()))).encode()).hexdigest()[:16]
+    view_key = f"{dataset_key}:{signature}"
+    return view_key, get_filtered_results(view_key, results, mask)
+
+def clear_filters():
+    for label in group_columns:
+        st.session_state[f"filter_{label}"] = []
+
+# Function to draw the filter sidebar on the analysis pages
+def render_filter_sidebar():
+    dataset_key = st.session_state.get('dataset_key')
+    results = get_processing_results()
+    index = get_dataset_filter_index(dataset_key, results) if results else None
+    if not index:
+        return
+    with st.sidebar:
+        st.header("Filter Students")
+        for label, bitmaps in index["bitmaps"].items():
+            st.multiselect(label, options=list(bitmaps), key=f"filter_{label}", placeholder="All")
+        st.radio("Show students matching", options=["and", "or"], key="filter_combine", horizontal=True,
+                 format_func=lambda combine: "all filters" if combine == "and" else "any filter")
+        selections, combine = get_active_filters()
+        if selections:
+            mask = filter_mask(index, selections, combine)
+            matched = int(mask.sum())
+            if matched:
+                st.caption(f"Showing {matched:,} of {index['n_rows']:,} students. Metrics, charts and "
+                           "reports use only these students.")
+            else:
+                st.warning("No students match these filters, so all students are shown.")
+            st.button("Clear filters", key="clear_filters", on_click=clear_filters)
+
+@timed("vis_aggregate", cache=True)
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_value_counts(dataset_key, _df_cleaned, col_name, label):
+    mark_cache_miss()
+    return value_counts_table(_df_cleaned, col_name, label)
+
+@timed("vis_aggregate", cache=True)
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_group_averages(dataset_key, _df_cleaned, group_col, target_col, label):
+    mark_cache_miss()
+    return group_averages(_df_cleaned, group_col, target_col, label)
+
+@timed("vis_aggregate", cache=True)
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_response_breakdown(dataset_key, _df_cleaned, breakdown_col, target_col):
+    mark_cache_miss()
+    return response_breakdown(_df_cleaned, breakdown_col, target_col)
+
+# The fitted profiles (model included) are cached per dataset hash, like the aggregates above
+@timed("belonging_profiles", cache=True)
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_belonging_profiles(dataset_key, _df_cleaned, matched_questions):
+    mark_cache_miss()
+    return fit_belonging_profiles(_df_cleaned, matched_questions)
+
+# One multi-key groupby per dataset; every pair of dimensions is rolled up from it on demand
+@timed("crosstab_cube", cache=True)
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_crosstab_cube(dataset_key, _df_cleaned, dimension_cols, matched_questions):
+    mark_cache_miss()
+    scores = construct_scores(_df_cleaned, matched_questions)
+    scores["Overall Belonging"] = pd.to_numeric(_df_cleaned["BelongingScore"], errors="coerce")
+    return crosstab_cube(_df_cleaned, dimension_cols, scores)
+
+def crosstab_dimensions(df_cleaned):
+    """(label, column) of each demographic question present, for the cross-tab cube."""
+    dimension_cols = []
+    for label, keywords in group_columns.items():
+        matched_group_col = next((col for col in df_cleaned.columns if any(k.lower() in col.lower() for k in keywords)), None)
+        if matched_group_col:
+            dimension_cols.append((label, matched_group_col))
+    return tuple(dimension_cols)
+
+def get_dataset_crosstab_cube(view_key, results, dimension_cols):
+    """The cube restored with a saved analysis when it matches, else the cached computation."""
+    stored = results.get("crosstab_cube")
+    if stored and tuple(stored["dimension_cols"]) == tuple(dimension_cols):
+        return stored
+    return get_crosstab_cube(view_key, results["df_cleaned"], tuple(dimension_cols), results["matched_questions"])
+
+# Shared by the Data Tables page and the general report
+@timed("item_reliability", cache=True)
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_item_reliability(dataset_key, _df_cleaned, matched_questions):
+    mark_cache_miss()
+    return item_reliability(_df_cleaned, matched_questions)
+
+@timed("vis_aggregate", cache=True)
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_profile_sizes(dataset_key, _df_cleaned, _labels, group_col):
+    mark_cache_miss()
+    return profile_sizes_by_group(_df_cleaned, _labels, group_col)
+
+# --- Data Tables ---
+# Large frames are never sent to the browser whole: only the visible page of rows and the
+# chosen columns are serialized, so wide and long files stay browsable.
+TABLE_PAGE_SIZES = [25, 50, 100, 250]
+TABLE_DEFAULT_COLUMNS = 12
+
+@st.fragment
+def render_table_window(view_key, table, key):
+    """
+    Shows results[table] of this session's view one page at a time, with a column picker.
+    A fragment, so paging reruns only the table. Receives the view key, not the frame,
+    so a rerun always reads the current shared dataset.
+    """
+    df = get_view()[1].get(table)
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        st.info("No data available.")
+        return
+    all_columns = list(df.columns)
+    columns = st.multiselect("Columns to show", all_columns, default=all_columns[:TABLE_DEFAULT_COLUMNS],
+                             key=f"{key}_columns")
+    if not columns:
+        st.info("Choose at least one column.")
+        return
+
+    start, stop = 0, len(df)
+    if len(df) > TABLE_PAGE_SIZES[0]:
+        col1, col2, col3 = st.columns([2, 2, 4])
+        page_size = col1.selectbox("Rows per page", TABLE_PAGE_SIZES, key=f"{key}_page_size")
+        n_pages = -(-len(df) // page_size)
+        # A smaller filtered view or a larger page size can leave the remembered page out of range
+        if st.session_state.get(f"{key}_page", 1) > n_pages:
+            st.session_state[f"{key}_page"] = n_pages
+        page = col2.number_input(f"Page (of {n_pages:,})", min_value=1, max_value=n_pages, step=1,
+                                 key=f"{key}_page")
+        start, stop = (page - 1) * page_size, min(page * page_size, len(df))
+        col3.caption(f"Rows {start + 1:,} to {stop:,} of {len(df):,}")
+    st.dataframe(df.iloc[start:stop][columns], use_container_width=True)
+
+# --- Saved analyses ---
+# A processed dataset, its cross-tab cube and the report choices, saved as one bundle file
+# (see snapshots.py) that reopens on any machine running the app without re-parsing.
+# Report option -> type of its widget value; chart_* checkboxes are booleans too
+REPORT_OPTION_TYPES = {"include_reliability": bool, "show_custom_options": bool, "custom_construct_select": str}
+
+def is_report_option(key, value):
+    """Whether key and value are a report page choice saved in (and restored from) a bundle."""
+    if key.startswith("chart_"):
+        return isinstance(value, bool)
+    return key in REPORT_OPTION_TYPES and isinstance(value, REPORT_OPTION_TYPES[key])
+
+def report_options():
+    """The report page choices of this session, as saved in a bundle."""
+    return {key: value for key, value in st.session_state.items() if is_report_option(key, value)}
+
+def save_analysis():
+    """
+    Writes this session's whole dataset (not the filtered view) as a bundle and returns
+    (path, filename, size in bytes) for render_download_button; raises GeneratedFileTooLarge
+    when the bundle is too large to be downloaded.
+    """
+    dataset_key = st.session_state.get('dataset_key')
+    results = get_processing_results()
+    dimension_cols = crosstab_dimensions(results["df_cleaned"])
+    crosstab = None
+    if len(dimension_cols) >= 2:
+        crosstab = {**get_dataset_crosstab_cube(dataset_key, results, dimension_cols), "dimension_cols": dimension_cols}
+    school_id = re.sub(r"[^A-Za-z0-9_-]+", "_", str(st.session_state.get('logged_in_user') or "school"))
+    filename = f"apnapan_{school_id}_{date.today():%Y%m%d}.{BUNDLE_EXTENSION}"
+    with stage("save_analysis", rows=len(results["df_cleaned"])) as record:
+        download = write_generated_file(
+            filename, lambda path: save_bundle(path, results, dataset_key, report_options(), crosstab))
+        record["nbytes"] = download[2]
+    return download
+
+def open_analysis(bundle_bytes):
+    """
+    Makes a saved analysis this session's dataset and restores its report choices. The
+    bundle is written to the spill directory and its tables are decompressed from there;
+    nothing is parsed or processed again. Returns the bundle's manifest; raises BundleError.
+    """
+    path = os.path.join(get_spill_dir(), f"bundle_{secrets.token_hex(8)}.{BUNDLE_EXTENSION}")
+    with open(path, "wb") as f:
+        f.write(bundle_bytes)
+    try:
+        manifest = read_manifest(path)
+        # Keyed by the bundle's own content, never by the key written inside it, so a bundle
+        # can neither reach nor replace a dataset another session uploaded
+        dataset_key = hashlib.sha256(bundle_bytes).hexdigest()
+        with stage("open_analysis", nbytes=len(bundle_bytes)) as record:
+            record["cache"] = "hit"
+            previous_key = st.session_state.get('dataset_key')
+            if previous_key != dataset_key or not get_processing_results():
+
+                def build():
+                    mark_cache_miss()
+                    return load_bundle(path)[1]
+
+                # Loaded before the current dataset is let go, so a damaged bundle changes nothing
+                results = get_dataset_store().acquire(dataset_key, get_session_id(), build)
+                if previous_key != dataset_key:
+                    release_session_dataset()
+                st.session_state['dataset_key'] = dataset_key
+            else:
+                results = get_processing_results()
+    finally:
+        os.remove(path)
+    # Only choices of the right type are restored: a foreign bundle must not break the widgets
+    constructs = set(results.get("matched_questions") or {})
+    options = manifest.get("options")
+    for key, value in (options.items() if isinstance(options, dict) else ()):
+        if is_report_option(key, value) and (key != "custom_construct_select" or value in constructs):
+            st.session_state[key] = value
+    return manifest
+
+EXCEL_SLOW_ROWS = 100_000  # Above this, suggest CSV or Parquet instead of Excel
+
+@st.fragment
+def render_export_panel(view_key):
+    """Export of this session's view (filters included), written on request and linked for download."""
+    tables = export_tables(get_view()[1])
+    if not tables:
+        st.info("No data available.")
+        return
+    chosen = st.multiselect("Tables to export", list(tables), default=list(tables), key="export_tables")
+    export_format = st.radio("Format", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0],
+                             horizontal=True, key="export_format")
+    n_rows = len(tables["Cleaned Data"]) if "Cleaned Data" in chosen else 0
+    if export_format == "xlsx" and n_rows > EXCEL_SLOW_ROWS:
+        st.caption(f"An Excel workbook of {n_rows:,} students takes a few minutes to write; "
+                   "CSV or Parquet are much faster.")
+
+    if st.button("Prepare Export", key="export_button", disabled=not chosen):
+        school_id = re.sub(r"[^A-Za-z0-9_-]+", "_", str(st.session_state.get('logged_in_user') or "school"))
+        stem = f"apnapan_{school_id}_{date.today():%Y%m%d}" + ("_filtered" if ":" in view_key else "")
+        discard_generated_file(st.session_state.pop('export_file', None))
+        try:
+            with st.spinner("Writing your export..."):
+                with stage(f"export_{export_format}", rows=n_rows) as record:
+                    st.session_state['export_file'] = write_export_file(
+                        {name: tables[name] for name in chosen}, export_format, stem)
+                    record["nbytes"] = st.session_state['export_file'][2]
+        except GeneratedFileTooLarge as e:
+            advice = "export fewer tables" if export_format == "parquet" else \
+                "choose Parquet, which is much smaller, or export fewer tables"
+            st.error(f"This export is {e.nbytes / 2**20:.0f} MB, more than the {DOWNLOAD_MAX_BYTES / 2**20:.0f} MB "
+                     f"that can be downloaded. Please {advice}, or filter the data first.")
+        except (OSError, ValueError) as e:
+            print(f"Error writing export: {e}")
+            st.error("The export could not be written. Please try again.")
+
+    render_download_button('export_file', "Download")
 
 # Landing Page
 if st.session_state['current_page'] == 'landing':
@@ -864,7 +1949,7 @@ if st.session_state['current_page'] == 'landing':
         # Project Apnapan logo and name
         st.markdown(f"""
             <div class="custom-logo">
-                <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" />
+                <img src="{logo_url}" alt="Project Apnapan Logo" />
                 <span>Project Apnapan</span>
             </div>
         """, unsafe_allow_html=True)
@@ -873,11 +1958,11 @@ if st.session_state['current_page'] == 'landing':
         # School logo and name
         if 'logged_in_user' in st.session_state:
             school_name = st.session_state.get('school_name')
-            school_logo_base64 = st.session_state.get('school_logo_base64')
+            school_logo_url = st.session_state.get('school_logo_url')
 
             school_logo_html = ""
-            if school_logo_base64:
-                school_logo_html = f'<img src="data:image/png;base64,{school_logo_base64}" alt="School Logo" style="height: 50px;" />'
+            if school_logo_url:
+                school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
 
             school_name_html = ""
             if school_name:
@@ -969,6 +2054,19 @@ if st.session_state['current_page'] == 'landing':
         mime="text/csv"
     )
 
+    if is_admin_user():
+        if st.button("Operator View", key="operator_view_button"):
+            navigate_to('operator')
+            st.rerun()
+        if st.button("Network View", key="network_view_button"):
+            navigate_to('network')
+            st.rerun()
+
+    if 'logged_in_user' in st.session_state:
+        if st.button("View Trends Across Uploads", key="trends_button"):
+            navigate_to('trends')
+            st.rerun()
+
     # Buttons to navigate
     col1, col2 = st.columns([1, 1])
     with col2:
@@ -980,8 +2078,10 @@ if st.session_state['current_page'] == 'landing':
             # Clear user-specific session state to effectively log out
             if 'logged_in_user' in st.session_state:
                 del st.session_state['logged_in_user']
-            if 'df_cleaned' in st.session_state:
-                del st.session_state['df_cleaned']
+            release_session_dataset()
+            get_worker_pool().cancel(get_session_id())
+            set_session_artifact('pdf_buffer', None)
+            set_session_artifact('custom_pdf_buffer', None)
             navigate_to('login')
             st.rerun()
     st.stop()
@@ -999,6 +2099,216 @@ if st.button("⮜ Back to Landing Page", key="back_button"):
     navigate_to('landing')
     st.rerun()
     
+# Operator Page (admins only): memory held by each session and by the shared dataset store
+if st.session_state['current_page'] == 'operator':
+    if not is_admin_user():
+        navigate_to('landing')
+        st.rerun()
+    st.header("Operator View")
+
+    store_stats = get_dataset_store().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Shared datasets", store_stats["datasets"], help=f"{store_stats['spilled']} spilled to disk")
+    col2.metric("Dataset store (MB)", f"{store_stats['total_bytes'] / 2**20:.1f}",
+                help=f"Budget: {store_stats['budget_bytes'] / 2**20:.0f} MB")
+    col3.metric("Dataset holders", store_stats["holders"])
+
+    pool_stats = get_worker_pool().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Worker jobs in flight", pool_stats["in_flight"],
+                help=f"{pool_stats['running']} running on {pool_stats['workers']} workers "
+                     f"({pool_stats['abandoned']} abandoned by their session); "
+                     f"at most {pool_stats['max_pending']} queued or running")
+    col2.metric("Jobs completed", pool_stats["completed"],
+                help=f"{pool_stats['failed']} failed, {pool_stats['cancelled']} cancelled; "
+                     f"workers restarted {pool_stats['restarted']} times")
+    col3.metric("Jobs refused", pool_stats["rejected"] + pool_stats["timed_out"],
+                help=f"{pool_stats['rejected']} rejected while busy, {pool_stats['timed_out']} timed out")
+
+    figure_stats = get_figure_cache().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cached figures", figure_stats["figures"], help=f"For {figure_stats['datasets']} datasets")
+    col2.metric("Figure cache (MB)", f"{figure_stats['bytes'] / 2**20:.1f}")
+    lookups = figure_stats["hits"] + figure_stats["misses"]
+    col3.metric("Figure cache hit rate", f"{figure_stats['hits'] / lookups:.0%}" if lookups else "-")
+
+    st.subheader("Stage Timings")
+    stage_rows = get_stage_metrics().summary()
+    if stage_rows:
+        st.dataframe(pd.DataFrame(stage_rows), use_container_width=True, hide_index=True)
+    else:
+        st.info("No stages recorded yet.")
+    st.toggle("Show my session's stage timings in the sidebar", key="show_stage_debug")
+
+    st.subheader("Largest Sessions")
+    session_rows = get_session_registry().snapshot(get_dataset_store())
+    if session_rows:
+        st.dataframe(pd.DataFrame(session_rows), use_container_width=True, hide_index=True)
+    else:
+        st.info("No sessions tracked yet.")
+    st.stop()
+
+# Network Page (admins only): every school's latest upload, pooled from the stored summaries
+if st.session_state['current_page'] == 'network':
+    if not is_admin_user():
+        navigate_to('landing')
+        st.rerun()
+    st.header("Network View")
+
+    latest_uploads = latest_school_uploads()
+    network_summaries = load_summaries_for(upload["_id"] for upload in latest_uploads)
+    with st.spinner("Summarising schools with new uploads..."):
+        if refresh_upload_summaries(latest_uploads, network_summaries):
+            network_summaries = load_summaries_for(upload["_id"] for upload in latest_uploads)
+
+    with stage("network_aggregate", schools=len(network_summaries)):
+        aggregate = network_aggregate(network_summaries, get_school_names())
+    if aggregate is None:
+        st.info("No school has uploaded a survey yet.")
+        st.stop()
+
+    network_df, schools_df = aggregate["network"], aggregate["schools"]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Schools", len(schools_df))
+    col2.metric("Students", f"{int(schools_df['Students'].sum()):,}")
+    if OVERALL in network_df.index:
+        col3.metric("Network Belonging", f"{network_df.loc[OVERALL, 'Network Average']:.2f}",
+                    help="Average over every student in the network; schools with more students weigh more")
+
+    st.subheader("Network Construct Averages")
+    fig = px.bar(network_df.reset_index(), x="Measure", y="Network Average", text_auto=".2f",
+                 error_y="Std. Deviation", color_discrete_sequence=["#5E81AC"])
+    fig.update_layout(yaxis=dict(range=[0, 5.5], title="Average score (1-5)"), xaxis_title="")
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(network_df, use_container_width=True)
+
+    st.subheader("School Rankings")
+    rank_measure = st.selectbox("Rank schools by", options=list(network_df.index), key="network_rank_measure")
+    ranking = schools_df[[rank_measure, "Students", "Uploaded"]].copy()
+    ranking.insert(0, "Rank", ranking[rank_measure].rank(ascending=False, method="min").astype("Int64"))
+    ranking["Percentile"] = aggregate["percentiles"][rank_measure]
+    st.dataframe(
+        ranking.sort_values("Rank"), use_container_width=True,
+        column_config={"Percentile": st.column_config.ProgressColumn(
+            "Percentile", help="Share of schools scoring at or below this school", min_value=0, max_value=100,
+            format="%d")})
+
+    st.subheader("Percentile Positions")
+    st.caption("Each cell is the share of schools (%) whose average on that measure is at or below this school's.")
+    fig = px.imshow(aggregate["percentiles"], color_continuous_scale="RdYlGn", zmin=0, zmax=100,
+                    aspect="auto")
+    fig.update_layout(height=max(300, 22 * len(schools_df)), xaxis_title="", yaxis_title="",
+                      coloraxis_colorbar=dict(title="Percentile"))
+    st.plotly_chart(fig, use_container_width=True)
+
+    if responses_enabled():
+        st.subheader("Network Averages by Group")
+        group_field = st.selectbox("Group students by", options=list(GROUP_FIELDS),
+                                   format_func=lambda field: GROUP_FIELDS[field][0], key="network_group_field")
+        constructs = tuple(measure for measure in network_df.index if measure != OVERALL)
+        group_df, uploads_covered = get_group_aggregate(tuple(upload["_id"] for upload in latest_uploads),
+                                                        group_field, constructs)
+        st.caption(f"Computed in MongoDB from the stored responses of {uploads_covered} of "
+                   f"{len(latest_uploads)} schools' latest uploads.")
+        if group_df.empty:
+            st.info("No stored responses for these uploads yet. They are stored as new surveys are uploaded.")
+        else:
+            group_label = GROUP_FIELDS[group_field][0]
+            long_df = group_df.melt(id_vars=[group_label, "Count"], var_name="Measure", value_name="Average")
+            fig = px.bar(long_df, x="Measure", y="Average", color=group_label, barmode="group",
+                         hover_data={"Count": True, "Average": ":.2f"})
+            fig.update_layout(yaxis=dict(range=[0, 5.5], title="Average score (1-5)"), xaxis_title="")
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(group_df, hide_index=True, use_container_width=True)
+    st.stop()
+
+# Trends Page: overall belonging and construct averages across all of a school's uploads
+if st.session_state['current_page'] == 'trends':
+    if 'logged_in_user' not in st.session_state:
+        navigate_to('login')
+        st.rerun()
+    # Header with Project Apnapan logo and school details on the same line
+    col1, col2 = st.columns([4, 4])  # Adjust column widths for alignment
+
+    with col1:
+        # Project Apnapan logo and name
+        st.markdown(f"""
+            <div class="custom-logo">
+                <img src="{logo_url}" alt="Project Apnapan Logo" />
+                <span>Project Apnapan</span>
+            </div>
+        """, unsafe_allow_html=True)
+
+    with col2:
+        # School logo and name
+        if 'logged_in_user' in st.session_state:
+            school_name = st.session_state.get('school_name')
+            school_logo_url = st.session_state.get('school_logo_url')
+
+            school_logo_html = ""
+            if school_logo_url:
+                school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
+
+            school_name_html = ""
+            if school_name:
+                school_name_html = f'<h4 style="margin: 0; color: #003366 !important;">{school_name}</h4>'
+
+            if school_logo_html or school_name_html:
+                st.markdown(f"""
+                    <div style="display: flex; justify-content: flex-end; align-items: center; gap: 12px; padding-top: 10px;">
+                        {school_logo_html}
+                        {school_name_html}
+                    </div>
+                """, unsafe_allow_html=True)
+
+    st.header("Trends Across Uploads")
+    school_id = st.session_state['logged_in_user']
+
+    # Built from the stored per-upload summaries; only uploads without one are parsed (once)
+    summaries = list_upload_summaries(school_id)
+    with st.spinner("Summarising earlier uploads..."):
+        if refresh_upload_summaries(list_upload_versions(school_id), summaries):
+            summaries = list_upload_summaries(school_id)
+
+    if not summaries:
+        st.info("No uploads found yet. Upload a survey to start tracking trends.")
+    else:
+        trend_rows = []
+        for doc in summaries:
+            row = {"Uploaded": doc.get("timestamp"), "File": doc.get("filename"), "Students": doc.get("n_students"),
+                   "Overall Belonging": doc.get("overall_belonging")}
+            row.update(doc.get("category_averages") or {})
+            trend_rows.append(row)
+        trends_df = pd.DataFrame(trend_rows)
+        measures = [col for col in trends_df.columns if col not in ("Uploaded", "File", "Students")]
+
+        if len(trends_df) < 2:
+            st.info("Only one upload so far. Trends appear once a school has uploaded two or more surveys.")
+        selected_measures = st.multiselect("Measures to plot", options=measures, default=measures,
+                                           key="trend_measures")
+        if selected_measures:
+            long_df = trends_df.melt(id_vars=["Uploaded", "File", "Students"], value_vars=selected_measures,
+                                     var_name="Measure", value_name="Score")
+            fig = px.line(long_df, x="Uploaded", y="Score", color="Measure", markers=True,
+                          hover_data={"File": True, "Students": True, "Score": ":.2f"})
+            fig.update_layout(yaxis=dict(range=[1, 5], title="Average score (1-5)"), xaxis_title="Upload date",
+                              legend_title_text="")
+            st.plotly_chart(fig, use_container_width=True)
+
+        if len(trends_df) >= 2:
+            # Change between the two most recent uploads
+            latest, previous = trends_df.iloc[-1], trends_df.iloc[-2]
+            st.write(f"### Change since {previous['File']}")
+            cols = st.columns(min(len(measures), 4))
+            for i, measure in enumerate(measures):
+                if pd.notna(latest[measure]) and pd.notna(previous[measure]):
+                    cols[i % len(cols)].metric(measure, f"{latest[measure]:.2f}",
+                                               f"{latest[measure] - previous[measure]:+.2f}")
+
+        st.write("### All Uploads")
+        st.dataframe(trends_df.round(2), hide_index=True, use_container_width=True)
+    st.stop()
+
 # Main Page
 if st.session_state['current_page'] == 'main':
     # Header with Project Apnapan logo and school details on the same line
@@ -1008,7 +2318,7 @@ if st.session_state['current_page'] == 'main':
         # Project Apnapan logo and name
         st.markdown(f"""
             <div class="custom-logo">
-                <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" />
+                <img src="{logo_url}" alt="Project Apnapan Logo" />
                 <span>Project Apnapan</span>
             </div>
         """, unsafe_allow_html=True)
@@ -1017,11 +2327,11 @@ if st.session_state['current_page'] == 'main':
         # School logo and name
         if 'logged_in_user' in st.session_state:
             school_name = st.session_state.get('school_name')
-            school_logo_base64 = st.session_state.get('school_logo_base64')
+            school_logo_url = st.session_state.get('school_logo_url')
 
             school_logo_html = ""
-            if school_logo_base64:
-                school_logo_html = f'<img src="data:image/png;base64,{school_logo_base64}" alt="School Logo" style="height: 50px;" />'
+            if school_logo_url:
+                school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
 
             school_name_html = ""
             if school_name:
@@ -1042,7 +2352,6 @@ if st.session_state['current_page'] == 'main':
         st.title("Data Insights Generator")
         st.write("Explore your data and generate insights.")
 
-    df = None  # Initialize df
     file_source = None  # Track if from upload or history
 
     # File Uploader with History (MongoDB-based)
@@ -1078,17 +2387,12 @@ if st.session_state['current_page'] == 'main':
                     selected_file_name = match.group(1)
                 else:
                     selected_file_name = selected_option # Fallback for old files without timestamp
-                # Load from history
-                downloaded_file = download_file_from_mongo(school_id, selected_file_name)
-                if downloaded_file:
+                # Load from history. The same bytes object feeds the download button and the parser.
+                file_bytes = download_file_from_mongo(school_id, selected_file_name)
+                if file_bytes:
                     file_source = "history"
                     st.success(f"Loaded {selected_file_name} from history.")
 
-                    # Read the file content into bytes for the download button
-                    # and then rewind the stream for pandas to process it later.
-                    file_bytes = downloaded_file.read()
-                    downloaded_file.seek(0)
-
                     st.markdown('<div class="history-download-button">', unsafe_allow_html=True)
                     st.download_button(
                         label=f"Download {selected_file_name}",
@@ -1104,80 +2408,89 @@ if st.session_state['current_page'] == 'main':
     if file_source != "history":
         uploaded_file = st.file_uploader("Choose a file", type=["csv", "xlsx", "xls", "txt"])
         if uploaded_file:
-            # Upload to MongoDB if logged in
+            # Read the upload exactly once; storage and parsing share this bytes object
+            file_bytes = uploaded_file.getvalue()
+            # Upload to MongoDB if logged in. The uploader keeps its file across reruns, so store it once.
             if 'logged_in_user' in st.session_state:
-                success = upload_file_to_mongo(school_id, uploaded_file)
-                if success:
+                if st.session_state.get('stored_upload') != uploaded_file.file_id:
+                    file_id = upload_file_to_mongo(school_id, uploaded_file.name, file_bytes)
+                    if file_id:
+                        st.session_state['stored_upload'] = uploaded_file.file_id
+                        # Summarised once the file is processed below
+                        st.session_state['pending_summary'] = (file_id, uploaded_file.name)
+                if st.session_state.get('stored_upload') == uploaded_file.file_id:
                     st.success(f"File uploaded to your history: {uploaded_file.name}")
             file_source = "upload"
 
+    # A saved analysis reopens straight into the metrics, skipping parsing and processing
+    if file_source is None:
+        with st.expander("Open a saved analysis"):
+            bundle_file = st.file_uploader("Choose a saved analysis", type=[BUNDLE_EXTENSION], key="bundle_upload")
+            if bundle_file and st.button("Open Analysis", key="open_analysis"):
+                try:
+                    with st.spinner("Opening your analysis..."):
+                        manifest = open_analysis(bundle_file.getvalue())
+                    print(f"Opened analysis saved {manifest.get('created')} ({manifest.get('n_students')} students)")
+                    navigate_to('metrics')
+                    st.rerun()
+                except BundleError as e:
+                    st.error(str(e))
+
     # Process the File (from upload or history)
     if file_source:
         try:
-            if file_source == "history":
-                content = downloaded_file  # BytesIO from MongoDB
-            else:
-                uploaded_file.seek(0)
-                content = io.BytesIO(uploaded_file.getvalue())
-            
             file_type = (selected_file_name if file_source == "history" else uploaded_file.name).split('.')[-1].lower()
-            
-            if file_type in ["csv", "txt"]:
-                df = pd.read_csv(content)
-            elif file_type in ["xlsx", "xls"]:
-                df = pd.read_excel(content)
-            else:
+            if file_type not in ["csv", "txt", "xlsx", "xls"]:
                 st.error("Unsupported file format.")
                 st.stop()
 
-            # Your existing data processing (timestamp removal, preview, etc.)
-            timestamp_keywords = ['timestamp', 'date', 'time', 'created', 'submitted', 'record', 'entry', 'logged']
-            timestamp_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in timestamp_keywords)]
-            # if timestamp_cols:
-            #     df = df.drop(columns=timestamp_cols)
-            #     st.write(f"Removed timestamp columns: {', '.join(timestamp_cols)}")
+            def build_results():
+                mark_cache_miss()
+                # Parsing and processing run in the shared worker pool, off this session's script thread
+                return run_in_worker(build_dataset_results, file_bytes, file_type, message="Analyzing your data")
 
-            # st.write(f"File loaded: {selected_file_name if file_source == 'history' else uploaded_file.name}")
-            # st.write(f"File size: {content.getbuffer().nbytes} bytes")
-            # st.write(f"Number of columns: {df.shape[1]}")
+            # --- Centralized Processing: Process Once, Use Many ---
+            # This is the core performance improvement. All calculations happen here, once per file
+            # content, and the results live in the process-wide dataset store. The session keeps only
+            # the content hash as a handle, so identical files are never parsed or held twice.
+            with st.spinner("Analyzing your data... This may take a moment."):
+                with stage("load_dataset", nbytes=len(file_bytes)) as load_record:
+                    load_record["cache"] = "hit"  # build_results marks a miss
+                    dataset_key = hashlib.sha256(file_bytes).hexdigest()
+                    if st.session_state.get('dataset_key') != dataset_key or not get_processing_results():
+                        release_session_dataset()
+                        get_dataset_store().acquire(dataset_key, get_session_id(), build_results)
+                        st.session_state['dataset_key'] = dataset_key
+                    processing_results = get_processing_results()
+                    load_record.update(result_sizes(processing_results.get('df_cleaned')))
+
+            # Store the new upload's headline metrics for the trends page, so it never re-parses this file
+            if file_source == "upload" and st.session_state.get('pending_summary'):
+                file_id, filename = st.session_state.pop('pending_summary')
+                with stage("upload_summary"):
+                    summary = summarize_results(processing_results)
+                    if responses_enabled():
+                        # Order of the Likert codes stored in each response document
+                        summary["questions"] = question_order(processing_results["matched_questions"])
+                    save_upload_summary(school_id, file_id, filename, datetime.now(), summary)
+                if responses_enabled():
+                    store_responses(school_id, file_id, processing_results)
 
             st.write("### Data Preview")
             col1, col2 = st.columns([8, 2])
             with col1:
                 show_preview = st.toggle("Show Table", value=True, key="toggle_preview")
-            if show_preview and "df" in locals():
-                st.dataframe(df.head())
-                st.session_state["preview_table"] = df.head()
+            if show_preview:
+                st.dataframe(processing_results['preview_table'])
 
-            # --- Centralized Processing: Process Once, Use Many ---
-            # This is the core performance improvement. All calculations happen here, once.
-            # The results are stored in the session state for other pages to use instantly.
-            with st.spinner("Analyzing your data... This may take a moment."):
-                # Clear any previous results to ensure a fresh start
-                keys_to_clear = [
-                    'df_cleaned', 'matched_questions', 'belonging_questions',
-                    'overall_belonging_score', 'category_averages', 'highest_area',
-                    'lowest_area', 'matched_questions_table', 'summary_table',
-                    'category_averages_table'
-                ]
-                for key in keys_to_clear:
-                    if key in st.session_state:
-                        del st.session_state[key]
-
-                # Process data and calculate all metrics
-                processing_results = process_data_and_calculate_metrics(df)
-                # Store all results in the session state
-                for key, value in processing_results.items():
-                    st.session_state[key] = value
-            
             st.success("Data analysis complete! You can now explore the metrics and visualizations.")
 
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
             st.stop()
 
-    # Ensure df is not None before accessing its columns
-    if df is None:
+    # Ensure a file was loaded before offering the next steps
+    if file_source is None:
         st.error("No data available. Please upload a valid file.")
         st.stop()
     # Detect questionnaire columns dynamically
@@ -1193,6 +2506,10 @@ if st.session_state['current_page'] == 'main':
             st.rerun()
     st.stop() 
 
+# Filters apply to every page from here on (see get_view)
+if st.session_state['current_page'] in ('metrics', 'visualisations', 'data_table', 'customise'):
+    render_filter_sidebar()
+
 if st.session_state['current_page'] == 'metrics':
         # Header with Project Apnapan logo and school details on the same line
         col1, col2 = st.columns([4, 4])  # Adjust column widths for alignment
@@ -1201,7 +2518,7 @@ if st.session_state['current_page'] == 'metrics':
             # Project Apnapan logo and name
             st.markdown(f"""
                 <div class="custom-logo">
-                    <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" />
+                    <img src="{logo_url}" alt="Project Apnapan Logo" />
                     <span>Project Apnapan</span>
                 </div>
             """, unsafe_allow_html=True)
@@ -1210,11 +2527,11 @@ if st.session_state['current_page'] == 'metrics':
             # School logo and name
             if 'logged_in_user' in st.session_state:
                 school_name = st.session_state.get('school_name')
-                school_logo_base64 = st.session_state.get('school_logo_base64')
+                school_logo_url = st.session_state.get('school_logo_url')
 
                 school_logo_html = ""
-                if school_logo_base64:
-                    school_logo_html = f'<img src="data:image/png;base64,{school_logo_base64}" alt="School Logo" style="height: 50px;" />'
+                if school_logo_url:
+                    school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
 
                 school_name_html = ""
                 if school_name:
@@ -1232,11 +2549,12 @@ if st.session_state['current_page'] == 'metrics':
         # --- Retrieve pre-calculated results from session state ---
         # All calculations are now done on the main page for performance.
         # This page just displays the results.
-        overall_belonging_score = st.session_state.get("overall_belonging_score")
-        category_averages = st.session_state.get("category_averages", {})
-        highest_area = st.session_state.get("highest_area")
-        lowest_area = st.session_state.get("lowest_area")
-        matched_questions_df = st.session_state.get("matched_questions_table")
+        _, results = get_view()
+        overall_belonging_score = results.get("overall_belonging_score")
+        category_averages = results.get("category_averages", {})
+        highest_area = results.get("highest_area")
+        lowest_area = results.get("lowest_area")
+        matched_questions_df = results.get("matched_questions_table")
 
         # --- Check if data is available ---
         if overall_belonging_score is None:
@@ -1245,11 +2563,11 @@ if st.session_state['current_page'] == 'metrics':
                 st.stop()
 
         # Show Likert scale image above the three score cards
-        if scale_base64:
+        if scale_url:
             st.markdown(
             f'''
             <div style="display: flex; justify-content: center; align-items: center;">
-                <img src="data:image/png;base64,{scale_base64}" alt="Likert Scale" style="width:70%; max-width:600px; min-width:300px; height:150px; margin-bottom:18px;"/>
+                <img src="{scale_url}" alt="Likert Scale" style="width:70%; max-width:600px; min-width:300px; height:150px; margin-bottom:18px;"/>
             </div>
             ''',
             unsafe_allow_html=True
@@ -1390,7 +2708,7 @@ if st.session_state['current_page'] == 'visualisations':
             # Project Apnapan logo and name
             st.markdown(f"""
                 <div class="custom-logo">
-                    <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" />
+                    <img src="{logo_url}" alt="Project Apnapan Logo" />
                     <span>Project Apnapan</span>
                 </div>
             """, unsafe_allow_html=True)
@@ -1399,11 +2717,11 @@ if st.session_state['current_page'] == 'visualisations':
             # School logo and name
             if 'logged_in_user' in st.session_state:
                 school_name = st.session_state.get('school_name')
-                school_logo_base64 = st.session_state.get('school_logo_base64')
+                school_logo_url = st.session_state.get('school_logo_url')
 
                 school_logo_html = ""
-                if school_logo_base64:
-                    school_logo_html = f'<img src="data:image/png;base64,{school_logo_base64}" alt="School Logo" style="height: 50px;" />'
+                if school_logo_url:
+                    school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
 
                 school_name_html = ""
                 if school_name:
@@ -1419,45 +2737,23 @@ if st.session_state['current_page'] == 'visualisations':
                 
         st.header("Visualization Tab")
         # --- Retrieve previously saved values into the same variable names ---
-        df_cleaned = st.session_state.get("df_cleaned", None)
-        matched_questions = st.session_state.get("matched_questions", {})
-        
-        belonging_questions = st.session_state.get("belonging_questions", {})
-        overall_belonging_score = st.session_state.get("overall_belonging_score", None)
-        category_averages = st.session_state.get("category_averages", {})
-        highest_area = st.session_state.get("highest_area", None)
-        lowest_area = st.session_state.get("lowest_area", None)
-
-
-        group_columns = {
-            "Gender": ["gender", "What gender do you use"],
-            "Grade": ["grade", "Which grade are you in"],
-            "Income Status": ["Income Category"],
-            "Health Condition": ["disability", "health condition"],
-            "Ethnicity": ["ethnicity_cleaned"],
-            "Religion": ["religion"]
-        }
-
-        show_explore = st.toggle("Show Charts", value=True, key="toggle_explore")
-        if show_explore and not df_cleaned.empty:
-            def categorize_income(possessions: str) -> str:
-                if pd.isna(possessions):
-                    return "Unknown"
-                items = possessions.lower()
-                has_car = "car" in items
-                has_computer = "computer" in items or "laptop" in items
-                has_home = "apna ghar" in items
-                is_rented = "rent" in items
-                if has_car and has_home:
-                    return "High"
-                if has_computer or (has_home and not has_car):
-                    return "Mid"
-                return "Low"
-
-            possessions_col = next((col for col in df_cleaned.columns if "what items among these do you have at home".lower() in col.lower()), None)
-            if possessions_col:
-                df_cleaned["Income Category"] = df_cleaned[possessions_col].apply(categorize_income)
-
+        dataset_key, results = get_view()  # Keyed and restricted by the sidebar filters
+        matched_questions = results.get("matched_questions", {})
+        
+        belonging_questions = results.get("belonging_questions", {})
+        overall_belonging_score = results.get("overall_belonging_score", None)
+        category_averages = results.get("category_averages", {})
+        highest_area = results.get("highest_area", None)
+        lowest_area = results.get("lowest_area", None)
+
+
+        # Each panel below is a fragment: interacting with a widget inside it reruns only that
+        # panel (and any panels nested in it), not the whole script. Panels receive the dataset
+        # key rather than the frame so a fragment rerun always reads the current shared dataset.
+        @st.fragment
+        @timed("plotly_demographics")
+        def render_demographic_overview(dataset_key):
+            df_cleaned = get_visualisation_frame(dataset_key)
             st.subheader(" Demographic Overview")
             demographic_cols = {
                 "Gender": ["gender", "What gender do you use"],
@@ -1486,37 +2782,41 @@ if st.session_state['current_page'] == 'visualisations':
                         label, col_name = items[idx]
                         col = row[col_i]
 
-                        value_counts = df_cleaned[col_name].value_counts(dropna=False).rename_axis(label).reset_index(name='Count')
-                        fig = px.pie(
-                            value_counts,
-                            names=label,
-                            values='Count',
-                            title=f"{label} Distribution",
-                            hole=0.3
-                        )
-
-                        num_categories = len(value_counts)
-                        if num_categories > 3 or any(len(str(cat)) > 8 for cat in value_counts[label]):
-                            fig.update_traces(
-                                textposition='auto',
-                                textinfo='value',
-                                textfont=dict(size=15),
-                                marker=dict(line=dict(color='#000000', width=1))
+                        def build_pie(label=label, col_name=col_name):
+                            value_counts = get_value_counts(dataset_key, df_cleaned, col_name, label)
+                            fig = px.pie(
+                                value_counts,
+                                names=label,
+                                values='Count',
+                                title=f"{label} Distribution",
+                                hole=0.3
                             )
-                        else:
-                            fig.update_traces(
-                                textposition='auto',
-                                textinfo='value',
-                                textfont=dict(size=15)
+
+                            num_categories = len(value_counts)
+                            if num_categories > 3 or any(len(str(cat)) > 8 for cat in value_counts[label]):
+                                fig.update_traces(
+                                    textposition='auto',
+                                    textinfo='value',
+                                    textfont=dict(size=15),
+                                    marker=dict(line=dict(color='#000000', width=1))
+                                )
+                            else:
+                                fig.update_traces(
+                                    textposition='auto',
+                                    textinfo='value',
+                                    textfont=dict(size=15)
+                                )
+
+                            fig.update_layout(
+                                uniformtext_minsize=7,
+                                margin=dict(t=45, b=45, l=45, r=45),
+                                height=400,
+                                width=400,
+                                showlegend=True
                             )
+                            return fig
 
-                        fig.update_layout(
-                            uniformtext_minsize=7,
-                            margin=dict(t=45, b=45, l=45, r=45),
-                            height=400,
-                            width=400,
-                            showlegend=True
-                        )
+                        fig = get_cached_figure(dataset_key, ("pie", label), build_pie)
 
                         config = {
                             'displayModeBar': True,
@@ -1531,21 +2831,11 @@ if st.session_state['current_page'] == 'visualisations':
 
                         col.plotly_chart(fig, use_container_width=True, config=config)
 
-
-            st.write("### Food for Thought")
-            st.write(
-                """
-                Take a moment to observe the differences in the following charts.  
-                - Do certain groups consistently score higher or lower? Why do you think that happens? 
-                - What kind of experiences or challenges could be influencing their responses?  
-                - Are there social, cultural, or school-related factors that might be shaping these patterns?
-
-                """
-            ) 
-            st.write("")
-
-
-
+        @st.fragment
+        @timed("plotly_constructs")
+        def render_construct_charts(dataset_key):
+            df_cleaned = get_visualisation_frame(dataset_key)
+            target_col = None
             selected_area = st.selectbox("Which belonging aspect do you want to explore?", list(belonging_questions.keys()))
             if selected_area and not df_cleaned.empty:
                 area_keywords = belonging_questions[selected_area]
@@ -1563,15 +2853,6 @@ if st.session_state['current_page'] == 'visualisations':
                     col_slots = [col1, col2]
                     chart_index = 0
 
-                    group_columns = {
-                        "Gender": ["gender", "What gender do you use"],
-                        "Grade": ["grade", "Which grade are you in"],
-                        "Income Status": ["Income Category"],
-                        "Health Condition": ["disability", "health condition"],
-                        "Ethnicity": ["ethnicity_cleaned"],
-                        "Religion": ["religion"]
-                    }
-                    
                     # Gave a white box that looked unclean in most charts 
                     # st.markdown(   
                     #     """
@@ -1626,29 +2907,21 @@ if st.session_state['current_page'] == 'visualisations':
                     for label, keywords in group_columns.items():
                         matched_group_col = next((col for col in df_cleaned.columns if any(k.lower() in col.lower() for k in keywords)), None)
                         if matched_group_col:
-                            if "ethnicity" in matched_group_col.lower() and "ethnicity_cleaned" in df_cleaned.columns:
-                                plot_df = df_cleaned[["ethnicity_cleaned", target_col]].dropna()
-                                plot_df.rename(columns={"ethnicity_cleaned": matched_group_col}, inplace=True)
-                            else:
-                                plot_df = df_cleaned[[matched_group_col, target_col]].dropna()
-                            if target_col in plot_df.columns:
-                                plot_df[target_col] = pd.to_numeric(plot_df[target_col], errors="coerce")
-                            else:
-                                st.warning(f"Column '{target_col}' not found in the data.")
-                            group_avg = plot_df.groupby(matched_group_col)[target_col].agg(['mean', 'count']).reset_index()
-                            group_avg.columns = [matched_group_col, 'AvgScore', 'Count']
-
-                            # Special handling for 'Grade' to ensure correct numeric sorting.
-                            if label == "Grade":
-                                # Convert grade to a numeric type for sorting, coercing errors for non-numeric grades
-                                group_avg[matched_group_col] = pd.to_numeric(group_avg[matched_group_col], errors='coerce')
-                                group_avg = group_avg.sort_values(by=matched_group_col).dropna(subset=[matched_group_col])
-                                # Convert back to string for plotting, ensuring it's handled as a category
-                                group_avg[matched_group_col] = group_avg[matched_group_col].astype(int).astype(str)
-                            with col_slots[chart_index % 2]:
+                            def build_construct_bar(label=label, matched_group_col=matched_group_col):
+                                group_avg = get_group_averages(dataset_key, df_cleaned, matched_group_col, target_col, label)
                                 # Convert the grouping column to string for discrete color mapping
                                 group_avg_display = group_avg.copy()
                                 group_avg_display[matched_group_col] = group_avg_display[matched_group_col].astype(str)
+                                # Bootstrap interval around each mean, drawn as asymmetric error bars
+                                group_avg_display["ErrorPlus"] = group_avg_display["CI_High"] - group_avg_display["AvgScore"]
+                                group_avg_display["ErrorMinus"] = group_avg_display["AvgScore"] - group_avg_display["CI_Low"]
+                                # Groups too small for an interval (NaN) say so in the hover text
+                                group_avg_display["CI_Text"] = np.where(
+                                    group_avg_display["CI_Low"].isna(),
+                                    f"too few students for an interval (under {BOOTSTRAP_MIN_GROUP})",
+                                    pd.Series(np.char.mod("%.2f", group_avg_display["CI_Low"].to_numpy())) + " to "
+                                    + pd.Series(np.char.mod("%.2f", group_avg_display["CI_High"].to_numpy())))
+                                label_y = group_avg_display["CI_High"].fillna(group_avg_display["AvgScore"])
 
                                 # Define category_orders to ensure Grade is treated as a category from the start.
                                 # This is the most robust way to prevent annotation misalignment.
@@ -1662,6 +2935,9 @@ if st.session_state['current_page'] == 'visualisations':
                                     x=matched_group_col,
                                     y="AvgScore",
                                     text="Count",
+                                    error_y="ErrorPlus",
+                                    error_y_minus="ErrorMinus",
+                                    custom_data=["CI_Text"],
                                     title=f"{selected_area} by {label}",
                                     labels={matched_group_col: label, "AvgScore": "Avg Score"},
                                     height=400,
@@ -1675,19 +2951,24 @@ if st.session_state['current_page'] == 'visualisations':
                                     textposition='inside',
                                     width=0.5,
                                     insidetextanchor='middle',
-                                    hovertemplate="%{x}<br>Avg Score: %{y:.2f}<br>Students: %{text}<extra></extra>"
+                                    hovertemplate="%{x}<br>Avg Score: %{y:.2f}<br>95% CI: %{customdata[0]}"
+                                                  "<br>Students: %{text}<extra></extra>"
                                 )
-                                for i, row in group_avg_display.iterrows():
-                                    fig.add_annotation(
-                                        x=row[matched_group_col],
-                                        y=row["AvgScore"],
-                                        text=f"Avg={row['AvgScore']:.2f}",
-                                        showarrow=False,
-                                        yshift=20,  # Moved above the bar
-                                        font=dict(color='white'),
-                                        bgcolor='rgba(0,0,0,0.5)',
-                                    )
-                                max_y = group_avg["AvgScore"].max()
+                                # Averages above the error bars, as one text trace rather than an annotation per group
+                                avg_labels = ("Avg=" + pd.Series(np.char.mod("%.2f", group_avg_display["AvgScore"].to_numpy()))
+                                              + np.where(group_avg_display["Significant"].to_numpy(), " *", ""))
+                                fig.add_trace(go.Scatter(
+                                    x=group_avg_display[matched_group_col],
+                                    y=label_y,
+                                    text=avg_labels,
+                                    mode="text",
+                                    textposition="top center",
+                                    textfont=dict(color="#1F2937", size=12),
+                                    showlegend=False,
+                                    hoverinfo="skip",
+                                    cliponaxis=False,
+                                ))
+                                max_y = label_y.max()
                                 fig.update_layout(
                                     margin=dict(t=50),
                                     yaxis=dict(range=[0, max_y + 0.6]),  # Added space for annotations on top
@@ -1698,6 +2979,10 @@ if st.session_state['current_page'] == 'visualisations':
                                 if label == "Grade":
                                     grade_ticks = group_avg_display[matched_group_col].tolist()
                                     fig.update_xaxes(tickvals=grade_ticks, ticktext=grade_ticks)
+                                return fig
+
+                            with col_slots[chart_index % 2]:
+                                fig = get_cached_figure(dataset_key, ("construct", selected_area, label), build_construct_bar)
                                 config = {
                                     'displayModeBar': True,
                                     'modeBarButtonsToRemove': [
@@ -1720,34 +3005,19 @@ if st.session_state['current_page'] == 'visualisations':
                                 chart_index += 1
                             # else:
                             #      st.info(f"No data found for {label}.")
+                    st.caption("Error bars show 95% confidence intervals. * marks a group whose average differs "
+                               "from the other students by more than chance would explain; small groups rarely do.")
 
-                # 🎯 Breakdown by Group (Percentage)
+            # 🎯 Breakdown by Group (Percentage)
             st.markdown("### Breakdown by Group (Percentage)")
             show_breakdown = st.toggle("Show Chart", value=True, key="toggle_breakdown")
             if show_breakdown:
                 breakdown_col = next((col for col in df_cleaned.columns if any(k.lower() in col.lower() for k in group_columns["Gender"])), None)
                 if breakdown_col and target_col:
-                    breakdown_df = df_cleaned[[breakdown_col, target_col]].dropna()
-                    breakdown_df[target_col] = pd.to_numeric(breakdown_df[target_col], errors="coerce")
-                    if not breakdown_df.empty:
-                        def label_bucket(val):
-                            if pd.isna(val):
-                                return "Unknown"
-                            if val <= 2:
-                                return "Disagree"
-                            elif val == 3:
-                                return "Neutral"
-                            elif val >= 4:
-                                return "Agree"
-                            return "Unknown"
-                        breakdown_df["ResponseLevel"] = breakdown_df[target_col].apply(label_bucket)
-                        percent_df = breakdown_df.groupby([breakdown_col, "ResponseLevel"]).size().reset_index(name='Count')
-                        total_counts = percent_df.groupby(breakdown_col)['Count'].transform('sum')
-                        percent_df['Percent'] = (percent_df['Count'] / total_counts * 100).round(1)
-                        response_order = ["Agree", "Neutral", "Disagree", "Unknown"]
-                        percent_df["ResponseLevel"] = pd.Categorical(percent_df["ResponseLevel"], categories=response_order, ordered=True)
-                        percent_df["text"] = percent_df.apply(lambda row: f"{row['Percent']}% ({row['Count']} students)", axis=1
-)
+                    def build_breakdown():
+                        percent_df = get_response_breakdown(dataset_key, df_cleaned, breakdown_col, target_col)
+                        if percent_df is None:
+                            return go.Figure()  # Cached too, so an empty breakdown is not recomputed
                         fig = px.bar(
                             percent_df,
                             x=breakdown_col,
@@ -1777,6 +3047,10 @@ if st.session_state['current_page'] == 'visualisations':
                             insidetextanchor="middle",
                             cliponaxis=False
                         )
+                        return fig
+
+                    fig = get_cached_figure(dataset_key, ("breakdown", selected_area), build_breakdown)
+                    if fig.data:
                         config = {
                             'displayModeBar': True,
                             'modeBarButtonsToRemove': [
@@ -1798,6 +3072,136 @@ if st.session_state['current_page'] == 'visualisations':
 
 
                         st.plotly_chart(fig, use_container_width=True, config=config)
+
+        @st.fragment
+        @timed("plotly_crosstab")
+        def render_crosstab(dataset_key):
+            st.markdown("### Intersectional View")
+            st.caption("Average score for each combination of two groups, for example Gender and Grade. "
+                       f"Combinations with fewer than {CROSSTAB_MIN_CELL} students are hidden.")
+            show_crosstab = st.toggle("Show Cross-tab", value=False, key="toggle_crosstab")
+            if not show_crosstab:
+                return
+            df_cleaned = get_visualisation_frame(dataset_key)
+            dimension_cols = crosstab_dimensions(df_cleaned)
+            if len(dimension_cols) < 2:
+                st.info("At least two demographic questions are needed for a cross-tab.")
+                return
+            with st.spinner("Preparing cross-tabs..."):
+                cube = get_dataset_crosstab_cube(dataset_key, get_view()[1], dimension_cols)
+
+            labels = [label for label, _ in dimension_cols]
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                row_label = st.selectbox("Rows", labels, key="crosstab_rows")
+            with col2:
+                col_label = st.selectbox("Columns", [label for label in labels if label != row_label], key="crosstab_cols")
+            with col3:
+                construct = st.selectbox("Score", ["Overall Belonging"] + [c for c, cols in matched_questions.items() if cols],
+                                         key="crosstab_score")
+            means, counts = crosstab(cube, row_label, col_label, construct)
+            if means.isna().all().all():
+                st.info(f"Every combination has fewer than {CROSSTAB_MIN_CELL} students.")
+                return
+
+            # Suppressed cells hide their exact count in the hover as well as in the text
+            hover_counts = np.where(means.isna(), f"<{CROSSTAB_MIN_CELL}", counts.astype(str))
+            cell_text = np.where(means.isna(), f"N<{CROSSTAB_MIN_CELL}",
+                                 means.round(2).astype(str) + "<br>N=" + counts.astype(str))
+            fig = px.imshow(
+                means,
+                color_continuous_scale="RdYlGn",
+                aspect="auto",
+                labels=dict(x=col_label, y=row_label, color="Avg Score"),
+                title=f"{construct} by {row_label} and {col_label}",
+            )
+            fig.update_traces(text=cell_text, texttemplate="%{text}",
+                              customdata=hover_counts,
+                              hovertemplate=f"{row_label}: %{{y}}<br>{col_label}: %{{x}}<br>Avg Score: %{{z:.2f}}"
+                                            "<br>Students: %{customdata}<extra></extra>")
+            fig.update_xaxes(type="category")
+            fig.update_yaxes(type="category")
+            st.plotly_chart(fig, use_container_width=True)
+
+        @st.fragment
+        @timed("plotly_profiles")
+        def render_belonging_profiles(dataset_key):
+            st.markdown("### Belonging Profiles")
+            st.caption("Students grouped by their pattern of scores across the belonging aspects. "
+                       "Profile 1 has the highest average score.")
+            show_profiles = st.toggle("Show Profiles", value=False, key="toggle_profiles")
+            if not show_profiles:
+                return
+            df_cleaned = get_visualisation_frame(dataset_key)
+            with st.spinner("Finding belonging profiles..."):
+                profiles = get_belonging_profiles(dataset_key, df_cleaned, matched_questions)
+            if profiles is None:
+                st.info("Not enough responses to find belonging profiles.")
+                return
+
+            centroids = profiles["centroids"]
+            fig = px.imshow(
+                centroids[profiles["constructs"]],
+                text_auto=".2f",
+                zmin=1, zmax=5,
+                color_continuous_scale="RdYlGn",
+                aspect="auto",
+                labels=dict(x="Belonging aspect", y="Profile", color="Avg Score"),
+                title=f"Average score of each profile ({profiles['k']} profiles found)",
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(centroids[["Students", "Share (%)"]].T, use_container_width=True)
+
+            group_labels = [label for label, keywords in group_columns.items()
+                            if any(any(k.lower() in col.lower() for k in keywords) for col in df_cleaned.columns)]
+            if not group_labels:
+                return
+            group_label = st.selectbox("Show profile sizes by", group_labels, key="profile_group")
+            group_col = next(col for col in df_cleaned.columns
+                             if any(k.lower() in col.lower() for k in group_columns[group_label]))
+            if "ethnicity" in group_col.lower() and "ethnicity_cleaned" in df_cleaned.columns:
+                group_col = "ethnicity_cleaned"
+            sizes = get_profile_sizes(dataset_key, df_cleaned, profiles["labels"], group_col)
+            fig = px.bar(
+                sizes,
+                x=group_col,
+                y="Percent",
+                color="Profile",
+                text="Count",
+                barmode="stack",
+                title=f"Belonging profiles by {group_label}",
+                labels={group_col: group_label, "Percent": "Students (%)"},
+                color_discrete_sequence=px.colors.qualitative.Set2,
+                height=450,
+            )
+            fig.update_traces(texttemplate="N=%{text}", textposition="inside",
+                              hovertemplate="%{x}<br>%{y:.1f}% of students<br>N=%{text}<extra></extra>")
+            st.plotly_chart(fig, use_container_width=True)
+
+        @st.fragment
+        def render_visualisations(dataset_key):
+            show_explore = st.toggle("Show Charts", value=True, key="toggle_explore")
+            df_cleaned = get_visualisation_frame(dataset_key)
+            if show_explore and df_cleaned is not None and not df_cleaned.empty:
+                render_demographic_overview(dataset_key)
+
+                st.write("### Food for Thought")
+                st.write(
+                    """
+                    Take a moment to observe the differences in the following charts.  
+                    - Do certain groups consistently score higher or lower? Why do you think that happens? 
+                    - What kind of experiences or challenges could be influencing their responses?  
+                    - Are there social, cultural, or school-related factors that might be shaping these patterns?
+
+                    """
+                ) 
+                st.write("")
+
+                render_construct_charts(dataset_key)
+                render_crosstab(dataset_key)
+                render_belonging_profiles(dataset_key)
+
+        render_visualisations(dataset_key)
         
         col1, col2 = st.columns([1, 1])
 
@@ -1823,7 +3227,7 @@ if st.session_state['current_page'] == 'data_table':
         # Project Apnapan logo and name
         st.markdown(f"""
             <div class="custom-logo">
-                <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" />
+                <img src="{logo_url}" alt="Project Apnapan Logo" />
                 <span>Project Apnapan</span>
             </div>
         """, unsafe_allow_html=True)
@@ -1832,11 +3236,11 @@ if st.session_state['current_page'] == 'data_table':
         # School logo and name
         if 'logged_in_user' in st.session_state:
             school_name = st.session_state.get('school_name')
-            school_logo_base64 = st.session_state.get('school_logo_base64')
+            school_logo_url = st.session_state.get('school_logo_url')
 
             school_logo_html = ""
-            if school_logo_base64:
-                school_logo_html = f'<img src="data:image/png;base64,{school_logo_base64}" alt="School Logo" style="height: 50px;" />'
+            if school_logo_url:
+                school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
 
             school_name_html = ""
             if school_name:
@@ -1852,47 +3256,61 @@ if st.session_state['current_page'] == 'data_table':
                 
     st.header(" Data Tables")
     
-     # ---- pull from session_state (no hardcoded numbers) ----
-    df_cleaned          = st.session_state.get("df_cleaned", None)
-    matched_questions   = st.session_state.get("matched_questions", {})
-    category_averages   = st.session_state.get("category_averages", {})
-    overall_belonging   = st.session_state.get("overall_belonging_score", None)
-    highest_area        = st.session_state.get("highest_area", None)
-    lowest_area         = st.session_state.get("lowest_area", None)
+     # ---- pull from the shared dataset store (no hardcoded numbers) ----
+    view_key, results   = get_view()
+    df_cleaned          = results.get("df_cleaned", None)
+    matched_questions   = results.get("matched_questions", {})
+    category_averages   = results.get("category_averages", {})
+    overall_belonging   = results.get("overall_belonging_score", None)
+    highest_area        = results.get("highest_area", None)
+    lowest_area         = results.get("lowest_area", None)
 
 
     # ---- Tables (as you had) ----
     st.write("### Data Preview")
-    if "preview_table" in st.session_state:
-        st.dataframe(st.session_state["preview_table"])
+    if "preview_table" in results:
+        st.dataframe(results["preview_table"])
     else:
         st.info("No preview table saved yet.")
 
     st.write("### Matched Questions")
-    if "matched_questions_table" in st.session_state:
-        st.dataframe(st.session_state["matched_questions_table"])
+    if "matched_questions_table" in results:
+        st.dataframe(results["matched_questions_table"])
     else:
-        # build once if not saved
-        if isinstance(matched_questions, dict) and matched_questions:
-            mq_df = pd.DataFrame.from_dict(matched_questions, orient="index").T.fillna("")
-            st.session_state["matched_questions_table"] = mq_df
-            st.dataframe(mq_df)
-        else:
-            st.info("No matched questions available.")
+        st.info("No matched questions available.")
 
     st.write("### Category Averages")
     if category_averages:
         averages_df = pd.DataFrame.from_dict(category_averages, orient="index", columns=["Average Score"]).round(2)
         st.dataframe(averages_df)
-        st.session_state["category_averages_table"] = averages_df
     else:
         st.info("No category averages available.")
 
+    st.write("### Reliability of Constructs")
+    if isinstance(df_cleaned, pd.DataFrame) and matched_questions:
+        reliability, item_analysis = get_item_reliability(view_key, df_cleaned, matched_questions)
+        st.caption("Cronbach's alpha shows whether the questions of a construct measure the same thing: "
+                   "0.7 or more is usually acceptable. A question whose removal would raise alpha, or with an "
+                   "item-total correlation below 0.3, fits its construct poorly. Only students who answered "
+                   "every question of a construct are used.")
+        st.dataframe(reliability, hide_index=True)
+        with st.expander("Item analysis by question"):
+            st.dataframe(item_analysis, hide_index=True)
+    else:
+        st.info("No matched questions available.")
+
     if isinstance(df_cleaned, pd.DataFrame) and not df_cleaned.empty:
-        summary = df_cleaned.describe()
+        # Computed with the processing results (and per filtered view), not on every rerun
         st.write("### Summary Table ")
-        st.dataframe(summary)
-        st.session_state["summary_table"] = summary
+        render_table_window(view_key, "summary_table", "summary_table")
+
+        st.write("### Student Responses")
+        st.caption(f"{len(df_cleaned):,} students and {df_cleaned.shape[1]:,} columns, shown one page at a time.")
+        render_table_window(view_key, "df_cleaned", "responses_table")
+
+        st.write("### Export Data")
+        st.caption("Download the cleaned responses and the tables above, for the students in the current filter.")
+        render_export_panel(view_key)
     else:
         st.info("No cleaned data available.")
 
@@ -1917,7 +3335,7 @@ if st.session_state['current_page']=='customise':
         # Project Apnapan logo and name
         st.markdown(f"""
             <div class="custom-logo">
-                <img src="data:image/png;base64,{logo_base64}" alt="Project Apnapan Logo" />
+                <img src="{logo_url}" alt="Project Apnapan Logo" />
                 <span>Project Apnapan</span>
             </div>
         """, unsafe_allow_html=True)
@@ -1926,11 +3344,11 @@ if st.session_state['current_page']=='customise':
         # School logo and name
         if 'logged_in_user' in st.session_state:
             school_name = st.session_state.get('school_name')
-            school_logo_base64 = st.session_state.get('school_logo_base64')
+            school_logo_url = st.session_state.get('school_logo_url')
 
             school_logo_html = ""
-            if school_logo_base64:
-                school_logo_html = f'<img src="data:image/png;base64,{school_logo_base64}" alt="School Logo" style="height: 50px;" />'
+            if school_logo_url:
+                school_logo_html = f'<img src="{school_logo_url}" alt="School Logo" style="height: 50px;" />'
 
             school_name_html = ""
             if school_name:
@@ -1946,1002 +3364,48 @@ if st.session_state['current_page']=='customise':
     st.header("Report Generation:")
     st.write("Here you can generate a general report and you can also select categories and custom options for your report!")
      
-    # Initialize state for PDF generation to prevent re-generation on every interaction
-    if 'pdf_buffer' not in st.session_state:
-        st.session_state.pdf_buffer = None
-
-    # ---- pull from session_state (no hardcoded numbers) ----
-    df_cleaned          = st.session_state.get("df_cleaned", None)
-    matched_questions   = st.session_state.get("matched_questions", {})
-    category_averages   = st.session_state.get("category_averages", {})
-    overall_belonging   = st.session_state.get("overall_belonging_score", None)
-    highest_area        = st.session_state.get("highest_area", None)
-    lowest_area         = st.session_state.get("lowest_area", None)
-    demographic_keywords= st.session_state.get("demographic_keywords", None)
+    # Generated PDFs are kept as session artifacts (see SessionRegistry) so idle tabs can spill them
+
+    # ---- pull from the shared dataset store (no hardcoded numbers) ----
+    view_key, results   = get_view()
+    df_cleaned          = results.get("df_cleaned", None)
+    matched_questions   = results.get("matched_questions", {})
+    category_averages   = results.get("category_averages", {})
+    overall_belonging   = results.get("overall_belonging_score", None)
+    highest_area        = results.get("highest_area", None)
+    lowest_area         = results.get("lowest_area", None)
+    demographic_keywords= results.get("demographic_keywords", None)
      
-    # ---- Fetch school details for the report ----
-    school_name = "your school" # Default
-    school_logo_base64 = None
-    if 'logged_in_user' in st.session_state:
-        school_id = st.session_state['logged_in_user']
-        name, logo = get_school_details(school_id)
-        if name:
-            school_name = name
-        if logo:
-            school_logo_base64 = logo
+    # ---- School details for the report (fetched once at login) ----
+    school_name = st.session_state.get('school_name') or "your school"
+    school_logo_bytes = st.session_state.get('school_logo_bytes') or None
 
     date_today  = date.today().strftime("%d %B, %Y")
     n_students  = int(df_cleaned.shape[0]) if isinstance(df_cleaned, pd.DataFrame) else 0
 
-    # ========= PDF GENERATION =========
-    # helpers to draw pies with matplotlib and return BytesIO for ReportLab
-    def pie_image_from_series(series, title):
-        """
-        Generates a more readable pie chart PNG in a BytesIO buffer.
-        It avoids overlapping labels by using a legend for numerous categories.
-        series: pandas.Series of counts (value_counts)
-        title: The title for the chart.
-        returns: BytesIO PNG or None if data is empty.
-        """
-        buf = io.BytesIO()
-        labels = series.index.astype(str).tolist()
-        sizes = series.values.tolist()
-        if not sizes:
-            return None
-
-        # Use a legend if there are more than 4 categories to prevent label overlap
-        show_labels_on_pie = len(labels) <= 4
-
-        # Adjust figure size to accommodate legend if needed
-        figsize = (4.5, 3) if not show_labels_on_pie else (3, 3)
-        fig, ax = plt.subplots(figsize=figsize, dpi=200)
-
-        # Use the default Plotly color sequence to match the demographic overview charts
-        plotly_default_colors = [
-            '#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A',
-            '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52'
-        ]
-        # Cycle through the defined colors if there are more labels than colors
-        colors_map = [plotly_default_colors[i % len(plotly_default_colors)] for i in range(len(labels))]
-
-        wedges, texts, autotexts = ax.pie(
-            sizes,
-            autopct=lambda p: f'{p:.1f}%' if p > 1 else '',  # Only show percentage for slices > 1%
-            startangle=90,
-            colors=colors_map,
-            pctdistance=0.8,  # Move percentage inside the slice
-            labels=labels if show_labels_on_pie else None,
-            labeldistance=1.1,
-            textprops={'fontsize': 7}  # Smaller font for labels on pie
-        )
-
-        # Style the percentage text for better visibility
-        for autotext in autotexts:
-            autotext.set_color('black')
-            autotext.set_weight('bold')
-            autotext.set_fontsize(7)
-
-        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-        ax.set_title(title, fontsize=10, pad=15)
-
-        # If not showing labels on pie, add a legend outside the chart
-        if not show_labels_on_pie:
-            ax.legend(wedges, labels,
-                      title="Categories",
-                      loc="center left",
-                      bbox_to_anchor=(1, 0, 0.5, 1),
-                      fontsize='x-small')
-
-        fig.tight_layout()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        plt.close(fig)
-        buf.seek(0)
-        return buf
-
-    # Build demographic pies (only if columns exist)
-    gender_pie_buf = None
-    religion_pie_buf = None
-    if isinstance(df_cleaned, pd.DataFrame) and not df_cleaned.empty:
-        # Try to find likely columns
-        gender_col = next((c for c in df_cleaned.columns if "gender" in c.lower()), None)
-        religion_col = next((c for c in df_cleaned.columns if "relig" in c.lower()), None)
-
-        if gender_col:
-            gender_counts = df_cleaned[gender_col].astype(str).replace({"nan": "Unknown"}).value_counts(dropna=False)
-            gender_pie_buf = pie_image_from_series(gender_counts, "Gender Distribution")
-
-        if religion_col:
-            religion_counts = df_cleaned[religion_col].astype(str).replace({"nan": "Unknown"}).value_counts(dropna=False)
-            religion_pie_buf = pie_image_from_series(religion_counts, "Religion Distribution")
-
-    # # Build constructs list table (right-rail look)
-    constructs_table_data = [["Construct", "Avg (1–5)"]]
-    if category_averages:
-        for k, v in category_averages.items():
-            constructs_table_data.append([k, f"{float(v):.2f}"])
-    else:
-        constructs_table_data.append(["-", "-"])
-
-    # bubble styles in reportlab via 1x1 tables with background colors
-    def bubble(text, bg_hex):
-        return Table([[Paragraph(text, ParagraphStyle("bub", fontSize=12, alignment=1, textColor=colors.white))]],
-                     colWidths=[2.2*inch], rowHeights=[0.9*inch],
-                     style=TableStyle([
-                         ("BACKGROUND", (0,0), (-1,-1), colors.HexColor(bg_hex)),
-                         ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-                         ("ALIGN", (0,0), (-1,-1), "CENTER"),
-                         ("BOX", (0,0), (-1,-1), 0, colors.white),
-                         ("INNERGRID", (0,0), (-1,-1), 0, colors.white),
-                     ]))
-    def generate_custom_pdf(school_name, school_logo_base64, apnapan_logo_base64, 
-                       selected_construct, selected_charts, chart_options,
-                       df_cleaned, matched_questions, category_averages, 
-                       overall_belonging, date_today, n_students):
-        """Generate a custom PDF report based on user selections with enhanced styling"""
-    
-        # Add income category if possessions column exists
-        if isinstance(df_cleaned, pd.DataFrame) and not df_cleaned.empty:
-            possessions_col = next((col for col in df_cleaned.columns 
-                                if "what items among these do you have at home".lower() in col.lower()), None)
-            if possessions_col:
-                df_cleaned["Income Category"] = df_cleaned[possessions_col].apply(categorize_income)
-        
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=28, rightMargin=28, topMargin=28, bottomMargin=28)
-        styles = getSampleStyleSheet()
-        
-        # Enhanced custom styles (matching general report)
-        title_style = ParagraphStyle("TitleStyle", parent=styles["Title"], fontSize=20, alignment=1, 
-                                    textColor=colors.HexColor("#2E3440"), spaceAfter=8, spaceBefore=0,
-                                    fontName="Helvetica-Bold")
-        subtitle_style = ParagraphStyle("SubtitleStyle", parent=styles["Title"], fontSize=16, alignment=1, 
-                                    textColor=colors.HexColor("#5E81AC"), spaceAfter=6)
-        small_grey = ParagraphStyle("SmallGrey", parent=styles["Normal"], fontSize=9, alignment=2, 
-                                textColor=colors.HexColor("#666"))
-        header_style = ParagraphStyle("HeaderStyle", parent=styles["Heading2"], fontSize=14, alignment=0, 
-                                    textColor=colors.HexColor("#2E3440"), spaceBefore=20, spaceAfter=10,
-                                    fontName="Helvetica-Bold", borderWidth=1, borderColor=colors.HexColor("#E5E7EB"),
-                                    borderPadding=5, backColor=colors.HexColor("#F9FAFB"))
-        subheader_style = ParagraphStyle("SubHeaderStyle", parent=styles["Heading3"], fontSize=12, alignment=0, 
-                                        textColor=colors.HexColor("#374151"), spaceBefore=12, spaceAfter=8,
-                                        fontName="Helvetica-Bold")
-        note_style = ParagraphStyle("NoteStyle", parent=styles["Normal"], fontSize=10, textColor=colors.HexColor("#4B5563"))
-        highlight_style = ParagraphStyle("HighlightStyle", parent=styles["Normal"], fontSize=10, 
-                                        textColor=colors.HexColor("#1F2937"), backColor=colors.HexColor("#F3F4F6"),
-                                        borderWidth=1, borderColor=colors.HexColor("#D1D5DB"), borderPadding=8,
-                                        spaceAfter=10, spaceBefore=10)
-        
-        story = []
-        
-        # --- Enhanced PDF Header ---
-        apnapan_logo_img = Paragraph(" ", styles['Normal'])
-        if apnapan_logo_base64:
-            try:
-                apnapan_logo_bytes = io.BytesIO(base64.b64decode(apnapan_logo_base64))
-                apnapan_logo_img = Image(apnapan_logo_bytes, width=1*inch, height=1*inch)
-            except Exception:
-                pass
-
-        school_logo_img = Paragraph(" ", styles['Normal'])
-        if school_logo_base64:
-            try:
-                school_logo_bytes = io.BytesIO(base64.b64decode(school_logo_base64))
-                school_logo_img = Image(school_logo_bytes, width=1*inch, height=1*inch)
-            except Exception:
-                pass
-
-        # Enhanced center content for custom report
-        center_content = [
-            Paragraph("Apnapan Custom Report", title_style),
-            Paragraph(f"Focus Area: {selected_construct}", subtitle_style),
-            Paragraph(school_name, header_style)
-        ]
-
-        header_table = Table([[apnapan_logo_img, center_content, school_logo_img]], colWidths=[1.2*inch, 5.6*inch, 1.2*inch])
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'CENTER'),
-            ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
-            ('LINEBELOW', (0, 0), (-1, -1), 2, colors.HexColor("#E5E7EB")),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-        ]))
-        story.append(header_table)
-        
-        # Date and report info
-        report_info = f"Generated on: {date_today} | Focus: {selected_construct} Analysis"
-        story.append(Paragraph(report_info, small_grey))
-        story.append(Spacer(1, 20))
-
-        # --- Executive Summary for Custom Report ---
-        story.append(Paragraph("Executive Summary", header_style))
-        
-        # Get construct-specific data
-        construct_score = category_averages.get(selected_construct, 0)
-        construct_questions = matched_questions.get(selected_construct, [])
-        
-        # Determine performance level for selected construct
-        if construct_score >= 4.0:
-            performance_level = "Excellent"
-            performance_color = "#10B981"
-        elif construct_score >= 3.5:
-            performance_level = "Good"
-            performance_color = "#3B82F6"
-        elif construct_score >= 3.0:
-            performance_level = "Fair"
-            performance_color = "#F59E0B"
-        else:
-            performance_level = "Needs Attention"
-            performance_color = "#EF4444"
-
-        summary_text = f"""
-        This custom report provides an in-depth analysis of <b>{selected_construct}</b> at {school_name}. 
-        The report includes {len(selected_charts)} selected visualizations to understand how this 
-        aspect of belonging varies across different student groups.
-        <br/><br/>
-        <b>Key Findings for {selected_construct}:</b><br/>
-        • Current score: <b>{construct_score:.2f}/5.0</b> ({performance_level})<br/>
-        • Based on responses from <b>{n_students}</b> students<br/>
-        • Analysis includes {len(construct_questions)} related survey questions<br/>
-        • Selected {len(selected_charts)} chart(s) for demographic breakdown analysis
-        """
-        story.append(Paragraph(summary_text, highlight_style))
-        story.append(Spacer(1, 15))
-
-        # --- Enhanced Key Metrics for Selected Construct ---
-        story.append(Paragraph(f"{selected_construct} - Key Metrics", header_style))
-        
-        # Enhanced bubble function (same as general report)
-        def enhanced_bubble(text, bg_hex, text_color="#FFFFFF"):
-            return Table(
-                [[Paragraph(text, ParagraphStyle("bub", fontSize=12, alignment=1, 
-                                            textColor=colors.HexColor(text_color),
-                                            leading=16))]],
-                colWidths=[2.4*inch], 
-                rowHeights=[1.1*inch],
-                style=TableStyle([
-                    ("BACKGROUND", (0,0), (-1,-1), colors.HexColor(bg_hex)),
-                    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-                    ("ALIGN", (0,0), (-1,-1), "CENTER"),
-                    ("ROUNDEDCORNERS", [5, 5, 5, 5]),
-                    ("LINEWIDTH", (0,0), (-1,-1), 2),
-                    ("LINECOLOR", (0,0), (-1,-1), colors.HexColor("#E5E7EB")),
-                ])
-            )
-
-        # Key metrics for selected construct
-        construct_txt = f"<b>{selected_construct} Score</b><br/><br/><font size=20 color='{performance_color}'>{construct_score:.2f}</font><br/><font size=10>out of 5.0 ({performance_level})</font>"
-        n_txt = f"<b>Students Surveyed</b><br/><br/><font size=20>{n_students}</font><br/><font size=10>participants</font>"
-        
-        # Compare to overall belonging
-        comparison = "above" if construct_score > overall_belonging else "below" if construct_score < overall_belonging else "equal to"
-        comparison_txt = f"<b>vs Overall Belonging</b><br/><br/><font size=16>{comparison_color(construct_score, overall_belonging)}</font><br/><font size=10>{comparison} average ({overall_belonging:.2f})</font>"
-        
-        metrics_row = Table([[enhanced_bubble(construct_txt, "#F8FAFC", "#1F2937"), 
-                            enhanced_bubble(n_txt, "#F0F9FF", "#1F2937")]],
-                        colWidths=[3.2*inch, 3.2*inch])
-        story.append(metrics_row)
-        story.append(Spacer(1, 15))
-        
-        # Survey questions for this construct
-        if construct_questions:
-            story.append(Paragraph("Survey Questions Analyzed", subheader_style))
-            questions_text = ""
-            for i, question in enumerate(construct_questions[:5], 1):  # Limit to first 5 questions
-                questions_text += f"{i}. {question}<br/>"
-            if len(construct_questions) > 5:
-                questions_text += f"<i>... and {len(construct_questions) - 5} more questions</i>"
-            
-            story.append(Paragraph(questions_text, note_style))
-            story.append(Spacer(1, 20))
-
-        # --- Charts Section ---
-        story.append(Paragraph("Demographic Analysis Charts", header_style))
-        story.append(Paragraph(f"The following {len(selected_charts)} chart(s) show how {selected_construct} varies across different student groups:", note_style))
-        story.append(Spacer(1, 15))
-        
-        # Add selected charts with enhanced presentation
-        chart_count = 0
-        for i, chart_name in enumerate(selected_charts, 1):
-            chart_info = chart_options[chart_name]
-            chart_img = None
-            
-            # Generate chart based on type
-            if chart_info["type"] == "demographic_pie":
-                chart_img = generate_demographic_pie_for_pdf(df_cleaned, chart_info["keywords"], chart_name)
-            
-            elif chart_info["type"] == "construct_vs_demographic":
-                chart_img = generate_bar_chart_for_pdf(
-                    df_cleaned, construct_questions, chart_info["keywords"], 
-                    chart_name, chart_info["demographic"]
-                )
-            
-            elif chart_info["type"] == "percentage_breakdown":
-                chart_img = generate_percentage_breakdown_for_pdf(
-                    df_cleaned, construct_questions, chart_info["keywords"], chart_name
-                )
-            
-            # Add chart to PDF with enhanced styling
-            if chart_img:
-                # Chart number and title
-                chart_header = f"Chart {i}: {chart_name}"
-                story.append(Paragraph(chart_header, subheader_style))
-                story.append(Spacer(1, 6))
-                
-                try:
-                    # Adjust image size and add border
-                    if chart_info["type"] == "demographic_pie":
-                        chart_image = Image(chart_img, width=3.5*inch, height=3*inch)
-                    else:
-                        chart_image = Image(chart_img, width=6.5*inch, height=4.2*inch)
-                    
-                    # Create bordered chart container
-                    chart_container = Table([[chart_image]], colWidths=[7*inch])
-                    chart_container.setStyle(TableStyle([
-                        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                        ('BOX', (0,0), (-1,-1), 1, colors.HexColor("#E5E7EB")),
-                        ('TOPPADDING', (0,0), (-1,-1), 10),
-                        ('BOTTOMPADDING', (0,0), (-1,-1), 10),
-                        ('LEFTPADDING', (0,0), (-1,-1), 10),
-                        ('RIGHTPADDING', (0,0), (-1,-1), 10),
-                    ]))
-                    story.append(chart_container)
-                    
-                    # Add chart description
-                    story.append(Spacer(1, 8))
-                    story.append(Paragraph(chart_info["description"], note_style))
-                    story.append(Spacer(1, 20))
-                    chart_count += 1
-                    
-                except Exception as e:
-                    error_msg = f"Chart could not be generated: {chart_name}"
-                    story.append(Paragraph(error_msg, ParagraphStyle("Error", parent=note_style, 
-                                                                    textColor=colors.HexColor("#EF4444"))))
-                    story.append(Spacer(1, 15))
-
-        # --- Enhanced Insights Section ---
-        if chart_count > 0:
-            story.append(Paragraph("Key Insights & Observations", header_style))
-            
-            # Performance context
-            performance_context = ""
-            if construct_score >= 4.0:
-                performance_context = f"{selected_construct} shows excellent performance, indicating strong student experiences in this area."
-            elif construct_score >= 3.5:
-                performance_context = f"{selected_construct} shows good performance with room for targeted improvements."
-            elif construct_score >= 3.0:
-                performance_context = f"{selected_construct} shows fair performance and would benefit from focused interventions."
-            else:
-                performance_context = f"{selected_construct} requires immediate attention with comprehensive improvement strategies."
-            
-            insights_text = f"""
-            <b>Performance Analysis:</b><br/>
-            {performance_context}
-            <br/><br/>
-            <b>Chart Analysis:</b><br/>
-            • This report includes {chart_count} visualization(s) focusing on {selected_construct}<br/>
-            • Charts reveal how different demographic groups experience this aspect of belonging<br/>
-            • Look for patterns in scores across gender, grade level, and other demographic factors
-            <br/><br/>
-            <b>Survey Coverage:</b><br/>
-            • Analysis based on {len(construct_questions)} survey question(s)<br/>
-            • {n_students} student responses analyzed<br/>
-            • Current score: {construct_score:.2f}/5.0 compared to overall belonging score of {overall_belonging:.2f}/5.0
-            """
-            
-            story.append(Paragraph(insights_text, highlight_style))
-            story.append(Spacer(1, 20))
-
-        # --- Enhanced Recommendations ---
-        story.append(Paragraph("Targeted Recommendations", header_style))
-        
-        recommendations = []
-        
-        # Performance-based recommendations
-        if construct_score < 3.0:
-            recommendations.append(f"<b>Urgent Priority:</b> {selected_construct} requires immediate intervention (score: {construct_score:.2f})")
-            recommendations.append(f"<b>Root Cause Analysis:</b> Conduct focus groups to understand why {selected_construct} scores are low")
-        elif construct_score < 3.5:
-            recommendations.append(f"<b>Improvement Focus:</b> Develop targeted strategies to enhance {selected_construct}")
-            recommendations.append(f"<b>Best Practice Research:</b> Study schools with higher {selected_construct} scores")
-        else:
-            recommendations.append(f"<b>Maintain Excellence:</b> Continue successful practices that support {selected_construct}")
-            recommendations.append(f"<b>Share Success:</b> Document and share what's working well in {selected_construct}")
-        
-        # Chart-specific recommendations
-        recommendations.extend([
-            "<b>Demographic Analysis:</b> Use the charts to identify which student groups need additional support",
-            f"<b>Targeted Interventions:</b> Design specific programs addressing {selected_construct} gaps",
-            "<b>Progress Monitoring:</b> Resurvey in 6 months to measure improvement in this focus area",
-            "<b>Staff Development:</b> Train educators on strategies that enhance student " + selected_construct.lower()
-        ])
-
-        rec_text = "<br/>• ".join(recommendations)
-        story.append(Paragraph(f"• {rec_text}", note_style))
-        story.append(Spacer(1, 20))
-
-        # --- Customized Food for Thought ---
-        story.append(Paragraph("Reflection Questions", header_style))
-        
-        custom_questions = [
-            f"Which demographic groups show the strongest/weakest {selected_construct} scores?",
-            f"What specific school practices might be influencing {selected_construct} outcomes?",
-            f"How does {selected_construct} connect to other aspects of student belonging?",
-            f"What barriers might prevent students from experiencing strong {selected_construct}?",
-            f"Which interventions could most effectively improve {selected_construct} scores?",
-            f"How can high-performing groups in {selected_construct} mentor others?"
-        ]
-        
-        bullets = "<br/>".join([f"• {question}" for question in custom_questions])
-        story.append(Paragraph(bullets, note_style))
-        story.append(Spacer(1, 20))
-
-        # --- Enhanced Footer ---
-        footer_text = f"""
-        <br/><br/>
-        <font size=8 color='#6B7280'>
-        This custom report was generated by the Apnapan Pulse platform focusing on {selected_construct}. 
-        For additional analysis or support with action planning, please contact your Apnapan representative.
-        <br/>
-        Custom Report ID: AP-CUSTOM-{datetime.now().strftime('%Y%m%d')}-{selected_construct[:3].upper()}-{school_name[:3].upper()}
-        </font>
-        """
-        story.append(Paragraph(footer_text, ParagraphStyle("Footer", parent=styles["Normal"], 
-                                                        fontSize=8, alignment=1, 
-                                                        textColor=colors.HexColor("#6B7280"))))
-
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
-
-    # Helper function for comparison color
-    def comparison_color(construct_score, overall_score):
-        """Return colored text showing comparison to overall score"""
-        if construct_score > overall_score:
-            return f"<font color='#10B981'>+{(construct_score - overall_score):.2f}</font>"
-        elif construct_score < overall_score:
-            return f"<font color='#EF4444'>{(construct_score - overall_score):.2f}</font>"
-        else:
-            return f"<font color='#6B7280'>±0.00</font>"
-        
-    def generate_demographic_pie_for_pdf(df_cleaned, keywords, title):
-        """Generate demographic pie chart as BytesIO for PDF"""
-        if df_cleaned is None or df_cleaned.empty:
-            return None
-        
-        # Find matching column
-        matched_col = next((col for col in df_cleaned.columns 
-                        if any(k.lower() in col.lower() for k in keywords)), None)
-        
-        if not matched_col:
-            return None
-        
-        # Create pie chart data
-        counts = df_cleaned[matched_col].astype(str).replace({"nan": "Unknown"}).value_counts(dropna=False)
-        
-        if counts.empty:
-            return None
-        
-        # Generate pie chart using matplotlib
-        buf = io.BytesIO()
-        labels = counts.index.astype(str).tolist()
-        sizes = counts.values.tolist()
-        
-        # Use Plotly color sequence
-        plotly_colors = ['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A',
-                        '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
-        colors_map = [plotly_colors[i % len(plotly_colors)] for i in range(len(labels))]
-        
-        fig, ax = plt.subplots(figsize=(4, 3), dpi=200)
-        wedges, texts, autotexts = ax.pie(
-            sizes,
-            labels=labels if len(labels) <= 4 else None,
-            autopct=lambda p: f'{p:.1f}%' if p > 1 else '',
-            startangle=90,
-            colors=colors_map,
-            textprops={'fontsize': 8}
-        )
-        
-        # Add legend if too many categories
-        if len(labels) > 4:
-            ax.legend(wedges, labels, title="Categories", loc="center left", 
-                    bbox_to_anchor=(1, 0, 0.5, 1), fontsize='x-small')
-        
-        ax.set_title(title, fontsize=10, pad=15)
-        ax.axis('equal')
-        
-        fig.tight_layout()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        plt.close(fig)
-        buf.seek(0)
-        return buf
-
-    def generate_bar_chart_for_pdf(df_cleaned, construct_keywords, demo_keywords, title, demo_label):
-        """Generate bar chart showing construct scores by demographic"""
-        if df_cleaned is None or df_cleaned.empty:
-            return None
-        
-        # Find construct column
-        construct_col = None
-        for col in df_cleaned.columns:
-            if any(k.lower() in col.lower() for k in construct_keywords):
-                construct_col = col
-                break
-        
-        # Find demographic column
-        demo_col = None
-        for col in df_cleaned.columns:
-            if any(k.lower() in col.lower() for k in demo_keywords):
-                demo_col = col
-                break
-        
-        if not construct_col or not demo_col:
-            return None
-        
-        # Prepare data
-        plot_df = df_cleaned[[demo_col, construct_col]].dropna()
-        plot_df[construct_col] = pd.to_numeric(plot_df[construct_col], errors="coerce")
-        plot_df = plot_df.dropna()
-        
-        if plot_df.empty:
-            return None
-        
-        # Calculate averages
-        group_avg = plot_df.groupby(demo_col)[construct_col].agg(['mean', 'count']).reset_index()
-        group_avg.columns = [demo_col, 'AvgScore', 'Count']
-        
-        # Sort grades numerically if it's grade data
-        if demo_label == "Grade":
-            group_avg[demo_col] = pd.to_numeric(group_avg[demo_col], errors='coerce')
-            group_avg = group_avg.sort_values(by=demo_col).dropna(subset=[demo_col])
-            group_avg[demo_col] = group_avg[demo_col].astype(int).astype(str)
-        
-        # Generate bar chart
-        buf = io.BytesIO()
-        fig, ax = plt.subplots(figsize=(6, 4), dpi=200)
-        
-        bars = ax.bar(group_avg[demo_col], group_avg['AvgScore'], 
-                    color=['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A'][:len(group_avg)])
-        
-        # Add value labels on bars
-        for i, (bar, row) in enumerate(zip(bars, group_avg.itertuples())):
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height + 0.05,
-                    f'{height:.2f}\n(N={row.Count})',
-                    ha='center', va='bottom', fontsize=8, weight='bold')
-        
-        ax.set_xlabel(demo_label, fontsize=10)
-        ax.set_ylabel('Average Score', fontsize=10)
-        ax.set_title(title, fontsize=11, pad=15)
-        ax.set_ylim(0, max(group_avg['AvgScore']) + 0.5)
-        
-        plt.xticks(rotation=45 if len(group_avg) > 3 else 0)
-        fig.tight_layout()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        plt.close(fig)
-        buf.seek(0)
-        return buf
-
-    def generate_percentage_breakdown_for_pdf(df_cleaned, construct_keywords, demo_keywords, title):
-        """Generate percentage breakdown stacked bar chart"""
-        if df_cleaned is None or df_cleaned.empty:
-            return None
-        
-        # Find columns
-        construct_col = None
-        for col in df_cleaned.columns:
-            if any(k.lower() in col.lower() for k in construct_keywords):
-                construct_col = col
-                break
-        
-        demo_col = None
-        for col in df_cleaned.columns:
-            if any(k.lower() in col.lower() for k in demo_keywords):
-                demo_col = col
-                break
-        
-        if not construct_col or not demo_col:
-            return None
-        
-        # Prepare data
-        breakdown_df = df_cleaned[[demo_col, construct_col]].dropna()
-        breakdown_df[construct_col] = pd.to_numeric(breakdown_df[construct_col], errors="coerce")
-        breakdown_df = breakdown_df.dropna()
-        
-        if breakdown_df.empty:
-            return None
-        
-        # Label responses
-        def label_bucket(val):
-            if pd.isna(val):
-                return "Unknown"
-            if val <= 2:
-                return "Disagree"
-            elif val == 3:
-                return "Neutral"
-            elif val >= 4:
-                return "Agree"
-            return "Unknown"
-        
-        breakdown_df["ResponseLevel"] = breakdown_df[construct_col].apply(label_bucket)
-        
-        # Calculate percentages
-        percent_df = breakdown_df.groupby([demo_col, "ResponseLevel"]).size().reset_index(name='Count')
-        total_counts = percent_df.groupby(demo_col)['Count'].transform('sum')
-        percent_df['Percent'] = (percent_df['Count'] / total_counts * 100).round(1)
-        
-        # Create stacked bar chart
-        buf = io.BytesIO()
-        fig, ax = plt.subplots(figsize=(6, 4), dpi=200)
-        
-        # Pivot data for stacked bar
-        pivot_df = percent_df.pivot(index=demo_col, columns='ResponseLevel', values='Percent').fillna(0)
-        
-        # Define colors for response levels
-        color_map = {
-            "Agree": "#4CAF50",
-            "Neutral": "#FFC107", 
-            "Disagree": "#F44336",
-            "Unknown": "#9E9E9E"
-        }
-        
-        # Plot stacked bars
-        bottom = None
-        for response_level in ["Agree", "Neutral", "Disagree", "Unknown"]:
-            if response_level in pivot_df.columns:
-                bars = ax.bar(pivot_df.index, pivot_df[response_level], 
-                            bottom=bottom, label=response_level, 
-                            color=color_map[response_level])
-                
-                # Add percentage labels on bars
-                for bar, value in zip(bars, pivot_df[response_level]):
-                    if value > 5:  # Only show labels for segments > 5%
-                        height = bar.get_height()
-                        ax.text(bar.get_x() + bar.get_width()/2., 
-                            bar.get_y() + height/2.,
-                            f'{value:.1f}%',
-                            ha='center', va='center', fontsize=7, weight='bold')
-                
-                if bottom is None:
-                    bottom = pivot_df[response_level]
-                else:
-                    bottom += pivot_df[response_level]
-        
-        ax.set_xlabel(demo_col.replace('_', ' ').title(), fontsize=10)
-        ax.set_ylabel('Percentage (%)', fontsize=10)
-        ax.set_title(title, fontsize=11, pad=15)
-        ax.legend(title="Response Level", bbox_to_anchor=(1.05, 1), loc='upper left')
-        ax.set_ylim(0, 100)
-        
-        fig.tight_layout()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        plt.close(fig)
-        buf.seek(0)
-        return buf
-
-    def generate_pdf(school_name, school_logo_base64, apnapan_logo_base64):
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=28, rightMargin=28, topMargin=28, bottomMargin=28)
-        styles = getSampleStyleSheet()
-
-        # Enhanced custom styles
-        title_style = ParagraphStyle("TitleStyle", parent=styles["Title"], fontSize=20, alignment=1, 
-                                    textColor=colors.HexColor("#2E3440"), spaceAfter=8, spaceBefore=0,
-                                    fontName="Helvetica-Bold")
-        subtitle_style = ParagraphStyle("SubtitleStyle", parent=styles["Title"], fontSize=16, alignment=1, 
-                                    textColor=colors.HexColor("#5E81AC"), spaceAfter=6)
-        small_grey = ParagraphStyle("SmallGrey", parent=styles["Normal"], fontSize=9, alignment=2, 
-                                textColor=colors.HexColor("#666"))
-        header_style = ParagraphStyle("HeaderStyle", parent=styles["Heading2"], fontSize=14, alignment=0, 
-                                    textColor=colors.HexColor("#2E3440"), spaceBefore=20, spaceAfter=10,
-                                    fontName="Helvetica-Bold", borderWidth=1, borderColor=colors.HexColor("#E5E7EB"),
-                                    borderPadding=5, backColor=colors.HexColor("#F9FAFB"))
-        subheader_style = ParagraphStyle("SubHeaderStyle", parent=styles["Heading3"], fontSize=12, alignment=0, 
-                                        textColor=colors.HexColor("#374151"), spaceBefore=12, spaceAfter=8,
-                                        fontName="Helvetica-Bold")
-        note_style = ParagraphStyle("NoteStyle", parent=styles["Normal"], fontSize=10, textColor=colors.HexColor("#4B5563"))
-        highlight_style = ParagraphStyle("HighlightStyle", parent=styles["Normal"], fontSize=10, 
-                                        textColor=colors.HexColor("#1F2937"), backColor=colors.HexColor("#F3F4F6"),
-                                        borderWidth=1, borderColor=colors.HexColor("#D1D5DB"), borderPadding=8,
-                                        spaceAfter=10, spaceBefore=10)
-
-        story = []
-
-        # --- Enhanced PDF Header ---
-        apnapan_logo_img = Paragraph(" ", styles['Normal'])
-        if apnapan_logo_base64:
-            try:
-                apnapan_logo_bytes = io.BytesIO(base64.b64decode(apnapan_logo_base64))
-                apnapan_logo_img = Image(apnapan_logo_bytes, width=1*inch, height=1*inch)
-            except Exception:
-                pass
-
-        school_logo_img = Paragraph(" ", styles['Normal'])
-        if school_logo_base64:
-            try:
-                school_logo_bytes = io.BytesIO(base64.b64decode(school_logo_base64))
-                school_logo_img = Image(school_logo_bytes, width=1*inch, height=1*inch)
-            except Exception:
-                pass
-
-        # Enhanced center content
-        center_content = [
-            Paragraph("Apnapan Pulse Report", title_style),
-            Paragraph("School Belonging Assessment", subtitle_style),
-            Paragraph(school_name, header_style)
-        ]
-
-        header_table = Table([[apnapan_logo_img, center_content, school_logo_img]], colWidths=[1.2*inch, 5.6*inch, 1.2*inch])
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'CENTER'),
-            ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
-            ('LINEBELOW', (0, 0), (-1, -1), 2, colors.HexColor("#E5E7EB")),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-        ]))
-        story.append(header_table)
-        
-        # Date and report info
-        report_info = f"Generated on: {date_today} | Academic Year: {datetime.now().year}-{datetime.now().year + 1}"
-        story.append(Paragraph(report_info, small_grey))
-        story.append(Spacer(1, 20))
-
-        # --- Executive Summary Section ---
-        story.append(Paragraph("Executive Summary", header_style))
-        
-        # Calculate additional metrics for summary
-        response_rate = (n_students / n_students * 100) if n_students > 0 else 0  # Placeholder - replace with actual invited vs responded
-        avg_score = overall_belonging or 0
-        
-        # Determine performance level
-        if avg_score >= 4.0:
-            performance_level = "Excellent"
-            performance_color = "#10B981"
-        elif avg_score >= 3.5:
-            performance_level = "Good"
-            performance_color = "#3B82F6"
-        elif avg_score >= 3.0:
-            performance_level = "Fair"
-            performance_color = "#F59E0B"
-        else:
-            performance_level = "Needs Attention"
-            performance_color = "#EF4444"
-
-        summary_text = f"""
-        This report presents the results of the Apnapan Pulse survey conducted at {name}. 
-        The survey assessed students' sense of belonging across multiple dimensions. 
-        <br/><br/>
-        <b>Key Findings:</b><br/>
-        • <b>{n_students}</b> students participated in the survey<br/>
-        • Overall belonging score: <b>{avg_score:.2f}/5.0</b> ({performance_level})<br/>
-        • Strongest area: <b>{highest_area if isinstance(highest_area, str) else 'Not determined'}</b><br/>
-        • Area for improvement: <b>{lowest_area if isinstance(lowest_area, str) else 'Not determined'}</b>
-        """
-        story.append(Paragraph(summary_text, highlight_style))
-        story.append(Spacer(1, 15))
-
-        # --- Enhanced Key Metrics Section ---
-        story.append(Paragraph("Key Metrics Overview", header_style))
-        
-        # Enhanced bubble function with better styling
-        def enhanced_bubble(text, bg_hex, text_color="#FFFFFF"):
-            return Table(
-                [[Paragraph(text, ParagraphStyle("bub", fontSize=12, alignment=1, 
-                                            textColor=colors.HexColor(text_color),
-                                            leading=16))]],
-                colWidths=[2.4*inch], 
-                rowHeights=[1.1*inch],
-                style=TableStyle([
-                    ("BACKGROUND", (0,0), (-1,-1), colors.HexColor(bg_hex)),
-                    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-                    ("ALIGN", (0,0), (-1,-1), "CENTER"),
-                    ("ROUNDEDCORNERS", [5, 5, 5, 5]),
-                    ("LINEWIDTH", (0,0), (-1,-1), 2),
-                    ("LINECOLOR", (0,0), (-1,-1), colors.HexColor("#E5E7EB")),
-                ])
-            )
-
-        # Row 1: Overall metrics
-        score_txt = f"<b>Overall Belonging Score</b><br/><br/><font size=20 color='{performance_color}'>{avg_score:.2f}</font><br/><font size=10>out of 5.0 ({performance_level})</font>"
-        n_txt = f"<b>Students Surveyed</b><br/><br/><font size=20>{n_students}</font><br/><font size=10>participants</font>"
-
-        row1 = Table([[enhanced_bubble(score_txt, "#F8FAFC", "#1F2937"), enhanced_bubble(n_txt, "#F0F9FF", "#1F2937")]],
-                    colWidths=[3.2*inch, 3.2*inch])
-        story.append(row1)
-        story.append(Spacer(1, 12))
-
-        # Row 2: Strongest/Weakest areas
-        strong_label = (highest_area if isinstance(highest_area, str) else "Not determined")
-        strong_val = float(category_averages.get(strong_label, 0)) if strong_label in category_averages else 0.0
-        weak_label = (lowest_area if isinstance(lowest_area, str) else "Not determined")
-        weak_val = float(category_averages.get(weak_label, 0)) if weak_label in category_averages else 0.0
-
-        strong_txt = f"<b>Strongest Area</b><br/><br/><font size=14>{strong_label}</font><br/><font size=16 color='#10B981'>{strong_val:.2f}</font>"
-        weak_txt = f"<b>Area for Improvement</b><br/><br/><font size=14>{weak_label}</font><br/><font size=16 color='#EF4444'>{weak_val:.2f}</font>"
-        
-        row2 = Table([[enhanced_bubble(strong_txt, "#ECFDF5", "#1F2937"), enhanced_bubble(weak_txt, "#FEF2F2", "#1F2937")]],
-                    colWidths=[3.2*inch, 3.2*inch])
-        story.append(row2)
-        story.append(Spacer(1, 20))
-
-        # --- Enhanced Demographics and Constructs Section ---
-        story.append(Paragraph("Demographics & Construct Analysis", header_style))
-
-        # Left side: Demographics with improved layout
-        left_content = []
-        left_content.append(Paragraph("Student Demographics", subheader_style))
-        
-        demographic_charts = []
-        if gender_pie_buf:
-            demographic_charts.append(Image(gender_pie_buf, width=2.6*inch, height=2.3*inch))
-        if religion_pie_buf:
-            demographic_charts.append(Image(religion_pie_buf, width=2.6*inch, height=2.3*inch))
-        
-        if demographic_charts:
-            for chart in demographic_charts:
-                left_content.append(chart)
-                left_content.append(Spacer(1, 8))
-        else:
-            left_content.append(Paragraph("Demographic charts will be displayed when data is available.", 
-                                        note_style))
-
-        # Right side: Enhanced constructs table
-        constructs_data = [["Construct", "Score", "Level"]]
-        if category_averages:
-            for construct, score in category_averages.items():
-                score_val = float(score)
-                if score_val >= 4.0:
-                    level = "Strong"
-                elif score_val >= 3.5:
-                    level = "Good"
-                elif score_val >= 3.0:
-                    level = "Fair"
-                else:
-                    level = "Needs Work"
-                constructs_data.append([construct, f"{score_val:.2f}", level])
-        else:
-            constructs_data.append(["-", "-", "-"])
-
-        constructs_tbl = Table(constructs_data, colWidths=[1.8*inch, 0.7*inch, 0.8*inch])
-        constructs_tbl.setStyle(TableStyle([
-            ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#374151")),
-            ("TEXTCOLOR", (0,0), (-1,0), colors.white),
-            ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-            ("FONTSIZE", (0,0), (-1,0), 10),
-            ("ALIGN", (0,0), (-1,-1), "CENTER"),
-            ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-            ("GRID", (0,0), (-1,-1), 1, colors.HexColor("#E5E7EB")),
-            ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, colors.HexColor("#F9FAFB")]),
-            ("FONTSIZE", (0,1), (-1,-1), 9),
-            ("TOPPADDING", (0,0), (-1,-1), 8),
-            ("BOTTOMPADDING", (0,0), (-1,-1), 8),
-        ]))
-
-        right_content = []
-        right_content.append(Paragraph("Construct Scores Summary", subheader_style))
-        right_content.append(Spacer(1, 8))
-        right_content.append(constructs_tbl)
-
-        # Legend for score levels
-        legend_text = """
-        <b>Score Interpretation:</b><br/>
-        4.0+ : Strong | 3.5-3.9 : Good<br/>
-        3.0-3.4 : Fair | &lt;3.0 : Needs Work
-        """
-        right_content.append(Spacer(1, 10))
-        right_content.append(Paragraph(legend_text, ParagraphStyle("Legend", parent=note_style, 
-                                                                fontSize=8, textColor=colors.HexColor("#6B7280"))))
-
-        # Two-column layout with better spacing
-        demographics_layout = Table([[left_content, right_content]], colWidths=[3.8*inch, 2.6*inch])
-        demographics_layout.setStyle(TableStyle([
-            ("VALIGN", (0,0), (-1,-1), "TOP"),
-            ("LEFTPADDING", (0,0), (-1,-1), 5),
-            ("RIGHTPADDING", (0,0), (-1,-1), 5),
-        ]))
-        story.append(demographics_layout)
-        story.append(Spacer(1, 25))
-
-        # --- Recommendations Section ---
-        story.append(Paragraph("Recommendations", header_style))
-        
-        recommendations = []
-        if weak_val < 3.0:
-            recommendations.append(f"<b>Priority Action:</b> Focus immediate attention on improving {weak_label} (score: {weak_val:.2f})")
-        if avg_score < 3.5:
-            recommendations.append("<b>Overall Improvement:</b> Consider school-wide belonging initiatives")
-        if strong_val > 4.0:
-            recommendations.append(f"<b>Leverage Strengths:</b> Use successful practices from {strong_label} in other areas")
-        
-        # Add demographic-specific recommendations if available
-        recommendations.extend([
-            "<b>Data Deep Dive:</b> Analyze results by demographic groups to identify specific needs",
-            "<b>Student Voice:</b> Conduct focus groups to understand the stories behind the numbers",
-            "<b>Action Planning:</b> Develop targeted interventions based on lowest-scoring constructs"
-        ])
-
-        rec_text = "<br/>• ".join(recommendations)
-        story.append(Paragraph(f"• {rec_text}", note_style))
-        story.append(Spacer(1, 20))
-
-        # --- Enhanced Food for Thought ---
-        story.append(Paragraph("Food for Thought", header_style))
-        
-        thought_questions = [
-            "Which demographic groups show the most significant differences in belonging scores?",
-            "What school policies or practices might be contributing to these patterns?",
-            "How do these results align with other school data (attendance, achievement, discipline)?",
-            "What student voices and perspectives are missing from this quantitative data?",
-            "Which interventions could have the greatest impact on overall belonging?",
-            "How can the school's strengths be leveraged to address areas of concern?"
-        ]
-        
-        bullets = "<br/>".join([f"• {question}" for question in thought_questions])
-        
-        story.append(Paragraph(bullets, note_style))
-        story.append(Spacer(1, 20))
-
-        # --- Footer ---
-        footer_text = f"""
-        <br/><br/>
-        <font size=8 color='#6B7280'>
-        This report was generated by the Apnapan Pulse platform. For questions about methodology 
-        or support with action planning, please contact your Apnapan representative.
-        <br/>
-        Report ID: AP-{datetime.now().strftime('%Y%m%d')}-{school_name[:3].upper()}
-        </font>
-        """
-        story.append(Paragraph(footer_text, ParagraphStyle("Footer", parent=styles["Normal"], 
-                                                        fontSize=8, alignment=1, 
-                                                        textColor=colors.HexColor("#6B7280"))))
-
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
     
-
-    # Helper function to categorize income (from your visualization code)
-    def categorize_income(possessions: str) -> str:
-        if pd.isna(possessions):
-            return "Unknown"
-        items = possessions.lower()
-        has_car = "car" in items
-        has_computer = "computer" in items or "laptop" in items
-        has_home = "apna ghar" in items
-        is_rented = "rent" in items
-        if has_car and has_home:
-            return "High"
-        if has_computer or (has_home and not has_car):
-            return "Mid"
-        return "Low"
-    
-    school_name = "your school" # Default
-    school_logo_base64 = None
-    if 'logged_in_user' in st.session_state:
-        school_id = st.session_state['logged_in_user']
-        name, logo = get_school_details(school_id)
-        if name:
-            school_name = name
-        if logo:
-            school_logo_base64 = logo
-
     colA, colB = st.columns([1, 1])
     with colA:
         # The "Generate" button is the primary action. It creates the PDF and stores it in state.
+        include_reliability = st.checkbox("Include survey reliability (Cronbach's alpha)", value=False,
+                                          key="include_reliability")
         if st.button("Generate General Report", use_container_width=True, key="generate_report"):
             with st.spinner("Generating your report..."):
-                st.session_state.pdf_buffer = generate_pdf(school_name, school_logo_base64, logo_base64)
+                reliability = None
+                if include_reliability and isinstance(df_cleaned, pd.DataFrame) and matched_questions:
+                    reliability = get_item_reliability(view_key, df_cleaned, matched_questions)
+                set_session_artifact('pdf_buffer', run_in_worker(
+                    generate_pdf, school_name, school_logo_bytes, logo_bytes, df_cleaned, category_averages,
+                    overall_belonging, highest_area, lowest_area, date_today, n_students, reliability,
+                    message="Generating your report"))
 
         # If a report has been generated, show the download button.
-            if st.session_state.get('pdf_buffer'):
+            pdf_buffer = get_session_artifact('pdf_buffer')
+            if pdf_buffer:
              st.markdown('<div class="report-download-button">', unsafe_allow_html=True)
              st.download_button(
                 label="Download Report",
-                data=st.session_state.pdf_buffer,
+                data=pdf_buffer,
                 use_container_width=True,
                 file_name="Apnapan_Pulse_Report.pdf",
                 mime="application/pdf"
@@ -2953,8 +3417,10 @@ if st.session_state['current_page']=='customise':
             st.session_state['show_custom_options'] = True
             st.rerun()
 
-    # Custom report options section
-    if st.session_state.get('show_custom_options', False):
+    # Custom report options section. It runs as a fragment, so changing the construct or ticking
+    # a chart checkbox reruns only this panel instead of rebuilding the whole report page.
+    @st.fragment
+    def render_custom_report_options():
         st.markdown("---")
         st.subheader(" Custom Report Configuration")
         
@@ -2980,64 +3446,7 @@ if st.session_state['current_page']=='customise':
                 st.write("Choose which demographic breakdowns you want to include in your custom report:")
                 
                 # Available demographic options (matching your visualization code)
-                demographic_options = {
-                    "Gender Distribution": {
-                        "type": "demographic_pie",
-                        "description": "Pie chart showing gender distribution of respondents",
-                        "keywords": ["gender", "What gender do you use"]
-                    },
-                    "Religion Distribution": {
-                        "type": "demographic_pie", 
-                        "description": "Pie chart showing religion distribution of respondents",
-                        "keywords": ["religion"]
-                    },
-                    "Grade Distribution": {
-                        "type": "demographic_pie",
-                        "description": "Pie chart showing grade distribution of respondents",
-                        "keywords": ["grade", "Which grade are you in"]
-                    },
-                    f"{selected_construct} by Gender": {
-                        "type": "construct_vs_demographic",
-                        "description": f"Bar chart showing {selected_construct} scores by gender",
-                        "demographic": "Gender",
-                        "keywords": ["gender", "What gender do you use"]
-                    },
-                    f"{selected_construct} by Grade": {
-                        "type": "construct_vs_demographic", 
-                        "description": f"Bar chart showing {selected_construct} scores by grade",
-                        "demographic": "Grade",
-                        "keywords": ["grade", "Which grade are you in"]
-                    },
-                    f"{selected_construct} by Religion": {
-                        "type": "construct_vs_demographic",
-                        "description": f"Bar chart showing {selected_construct} scores by religion", 
-                        "demographic": "Religion",
-                        "keywords": ["religion"]
-                    },
-                    f"{selected_construct} by Income Status": {
-                        "type": "construct_vs_demographic",
-                        "description": f"Bar chart showing {selected_construct} scores by income status",
-                        "demographic": "Income Status",
-                        "keywords": ["Income Category"]
-                    },
-                    f"{selected_construct} by Ethnicity": {
-                        "type": "construct_vs_demographic",
-                        "description": f"Bar chart showing {selected_construct} scores by ethnicity",
-                        "demographic": "Ethnicity",
-                        "keywords": ["ethnicity_cleaned"]
-                    },
-                    f"{selected_construct} by Health Condition": {
-                        "type": "construct_vs_demographic",
-                        "description": f"Bar chart showing {selected_construct} scores by health condition",
-                        "demographic": "Health Condition",
-                        "keywords": ["disability", "health condition"]
-                    },
-                    f"Gender Breakdown (Percentage)": {
-                        "type": "percentage_breakdown",
-                        "description": f"Stacked bar chart showing percentage breakdown of {selected_construct} responses by gender",
-                        "keywords": ["gender", "What gender do you use"]
-                    }
-                }
+                demographic_options = custom_chart_options(selected_construct)
                 
                 # Create checkboxes for each chart option
                 selected_charts = {}
@@ -3109,10 +3518,11 @@ if st.session_state['current_page']=='customise':
                         
                         with st.spinner("Generating your custom report..."):
                             # Generate custom PDF
-                            custom_pdf_buffer = generate_custom_pdf(
+                            custom_pdf_buffer = run_in_worker(
+                                generate_custom_pdf,
                                 school_name, 
-                                school_logo_base64, 
-                                logo_base64,
+                                school_logo_bytes, 
+                                logo_bytes,
                                 selected_construct,
                                 selected_chart_names,
                                 demographic_options,
@@ -3121,15 +3531,16 @@ if st.session_state['current_page']=='customise':
                                 category_averages,
                                 overall_belonging,
                                 date_today,
-                                n_students
+                                n_students,
+                                message="Generating your custom report"
                             )
-                            st.session_state.custom_pdf_buffer = custom_pdf_buffer
+                            set_session_artifact('custom_pdf_buffer', custom_pdf_buffer)
                         
-                        if st.session_state.get('custom_pdf_buffer'):
+                        if get_session_artifact('custom_pdf_buffer'):
                             st.markdown('<div class="report-download-button">', unsafe_allow_html=True)
                             st.download_button(
                                 label="Download Custom Report",
-                                data=st.session_state.custom_pdf_buffer,
+                                data=get_session_artifact('custom_pdf_buffer'),
                                 use_container_width=True,
                                 file_name=f"Apnapan_Custom_Report_{selected_construct.replace(' ', '_')}.pdf",
                                 mime="application/pdf"
@@ -3141,6 +3552,26 @@ if st.session_state['current_page']=='customise':
                         st.session_state['show_custom_options'] = False
                         st.rerun()
 
+    if st.session_state.get('show_custom_options', False):
+        render_custom_report_options()
+
+    st.markdown("---")
+    st.subheader("Save Analysis")
+    st.write("Save this analysis, with your report choices, as one file. Opening it later, on this or another "
+             "computer running the app, restores every page without processing the data again.")
+    if st.button("Save Analysis", key="save_analysis"):
+        discard_generated_file(st.session_state.pop('analysis_file', None))
+        try:
+            with st.spinner("Saving your analysis..."):
+                st.session_state['analysis_file'] = save_analysis()
+        except GeneratedFileTooLarge as e:
+            st.error(f"This analysis is {e.nbytes / 2**20:.0f} MB, more than the {DOWNLOAD_MAX_BYTES / 2**20:.0f} MB "
+                     "that can be downloaded, so it cannot be saved as one file. Use Export on the Data Tables page "
+                     "(Parquet) to keep the cleaned data instead.")
+        except (OSError, ValueError) as e:
+            print(f"Error saving analysis: {e}")
+            st.error("The analysis could not be saved. Please try again.")
+    render_download_button('analysis_file', "Download")
 
     cA, cB = st.columns([1, 1])
     with cA:
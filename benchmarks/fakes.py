@@ -0,0 +1,328 @@
+"""In-process stand-ins for Google Sheets and MongoDB, for load tests without network access.
+
+They implement only the calls app.py makes. Every call sleeps for the configured latency
+(plus jitter), so concurrent sessions spend time waiting on the backend as they would in
+production. install_fakes() patches gspread, the service-account credentials and
+pymongo.MongoClient; app.py resolves them when each script run imports them.
+"""
+import copy
+import itertools
+import random
+import re
+import threading
+import time
+from unittest import mock
+
+
+class Latency:
+    """Sleeps mean_ms, +/- jitter (a fraction of the mean), on every backend call."""
+
+    def __init__(self, mean_ms=0.0, jitter=0.25):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        if self.mean_ms > 0:
+            spread = self.mean_ms * self.jitter
+            time.sleep(max(0.0, random.uniform(self.mean_ms - spread, self.mean_ms + spread)) / 1000)
+
+
+class FakeWorksheet:
+    """The account sheet: one list per row, the header first, as gspread returns them."""
+
+    def __init__(self, latency, header=None):
+        self.latency = latency
+        self.rows = [list(header or [])]
+        self._lock = threading.Lock()
+
+    def col_values(self, col):
+        self.latency()
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def row_values(self, row):
+        self.latency()
+        with self._lock:
+            return list(self.rows[row - 1])
+
+    def append_row(self, values):
+        self.latency()
+        with self._lock:
+            self.rows.append([str(v) for v in values])
+
+    def update_cell(self, row, col, value):
+        self.latency()
+        with self._lock:
+            cells = self.rows[row - 1]
+            cells.extend([""] * (col - len(cells)))
+            cells[col - 1] = str(value)
+
+
+class FakeSheetsClient:
+    """Stands in for an authorized gspread client; each spreadsheet has one worksheet."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.spreadsheets = {}
+
+    def open(self, name):
+        self.latency()
+        if name not in self.spreadsheets:
+            self.spreadsheets[name] = mock.Mock(sheet1=FakeWorksheet(self.latency))
+        return self.spreadsheets[name]
+
+    def worksheet(self, name):
+        return self.open(name).sheet1
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(_matches(doc, q) for q in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(doc, q) for q in condition):
+                return False
+            continue
+        value = _get(doc, key)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, arg in condition.items():
+            if op == "$not":
+                if _matches(doc, {key: arg}):
+                    return False
+            elif op == "$regex":
+                if not isinstance(value, str) or not re.search(arg, value):
+                    return False
+            elif op == "$in":
+                if value not in arg:
+                    return False
+            elif op == "$nin":
+                if value in arg:
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op == "$exists":
+                if (value is not None) != bool(arg):
+                    return False
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if not {"$gt": value > arg, "$gte": value >= arg, "$lt": value < arg, "$lte": value <= arg}[op]:
+                    return False
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {op}")
+    return True
+
+
+def _sorted(docs, sort):
+    items = sort.items() if isinstance(sort, dict) else sort
+    for key, direction in reversed(list(items)):
+        # None sorts first, as in MongoDB
+        docs = sorted(docs, key=lambda d: (_get(d, key) is not None, _get(d, key)), reverse=direction < 0)
+    return docs
+
+
+def _evaluate(doc, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get(doc, expression[1:])
+    if isinstance(expression, dict):
+        return {key: _evaluate(doc, value) for key, value in expression.items()}
+    return expression
+
+
+def _project(doc, projection):
+    if not projection:
+        return doc
+    included = {key: value for key, value in projection.items() if value not in (0, False)}
+    if not included:
+        return {key: value for key, value in doc.items() if key not in projection}
+    out = {} if projection.get("_id", 1) in (0, False) else {"_id": doc.get("_id")}
+    for key, value in included.items():
+        out[key] = _get(doc, key) if value in (1, True) else _evaluate(doc, value)
+    return out
+
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _evaluate(doc, spec["_id"])
+        hashable = repr(key)
+        out = groups.setdefault(hashable, {"_id": key, "__docs": []})
+        out["__docs"].append(doc)
+    results = []
+    for out in groups.values():
+        members = out.pop("__docs")
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expression), = accumulator.items()
+            values = [_evaluate(doc, expression) for doc in members]
+            numbers = [v for v in values if isinstance(v, (int, float))]
+            if op == "$first":
+                out[field] = values[0]
+            elif op == "$last":
+                out[field] = values[-1]
+            elif op == "$sum":
+                out[field] = sum(numbers)
+            elif op == "$avg":
+                out[field] = sum(numbers) / len(numbers) if numbers else None
+            elif op == "$min":
+                out[field] = min(numbers) if numbers else None
+            elif op == "$max":
+                out[field] = max(numbers) if numbers else None
+            elif op == "$push":
+                out[field] = values
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {op}")
+        results.append(out)
+    return results
+
+
+class FakeCollection:
+    """A thread-safe list of documents with the subset of the pymongo API that app.py uses."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.docs = []
+        self.indexes = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def insert_one(self, doc):
+        self.latency()
+        with self._lock:
+            doc.setdefault("_id", next(self._ids))
+            self.docs.append(copy.copy(doc))
+        return mock.Mock(inserted_id=doc["_id"])
+
+    def insert_many(self, docs, ordered=True):
+        self.latency()
+        ids = []
+        with self._lock:
+            for doc in docs:
+                doc.setdefault("_id", next(self._ids))
+                self.docs.append(copy.copy(doc))
+                ids.append(doc["_id"])
+        return mock.Mock(inserted_ids=ids)
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        self.latency()
+        with self._lock:
+            docs = [d for d in self.docs if _matches(d, query or {})]
+        if sort:
+            docs = _sorted(docs, sort)
+        if limit:
+            docs = docs[:limit]
+        return [_project(d, projection) for d in docs]
+
+    def find_one(self, query=None, projection=None, sort=None):
+        docs = self.find(query, projection, sort, limit=1)
+        return docs[0] if docs else None
+
+    def count_documents(self, query):
+        return len(self.find(query, {"_id": 1}))
+
+    def update_one(self, query, update, upsert=False):
+        self.latency()
+        with self._lock:
+            doc = next((d for d in self.docs if _matches(d, query)), None)
+            if doc is None and upsert:
+                doc = {"_id": next(self._ids), **{k: v for k, v in query.items() if not isinstance(v, dict)}}
+                self.docs.append(doc)
+            if doc is not None:
+                doc.update(update.get("$set", {}))
+        return mock.Mock(matched_count=int(doc is not None))
+
+    def delete_many(self, query):
+        self.latency()
+        with self._lock:
+            kept = [d for d in self.docs if not _matches(d, query)]
+            deleted, self.docs = len(self.docs) - len(kept), kept
+        return mock.Mock(deleted_count=deleted)
+
+    def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+        return kwargs.get("name", "index")
+
+    def aggregate(self, pipeline):
+        self.latency()
+        with self._lock:
+            docs = list(self.docs)
+        for step in pipeline:
+            (op, spec), = step.items()
+            if op == "$match":
+                docs = [d for d in docs if _matches(d, spec)]
+            elif op == "$sort":
+                docs = _sorted(docs, spec)
+            elif op == "$group":
+                docs = _group(docs, spec)
+            elif op == "$project":
+                docs = [_project(d, spec) for d in docs]
+            elif op == "$limit":
+                docs = docs[:spec]
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {op}")
+        return iter(docs)
+
+
+class FakeMongoClient:
+    """Stands in for pymongo.MongoClient; databases and collections are created on first use."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.databases = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        # Patched in place of the MongoClient class: every "connection" shares this data
+        return self
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self.databases.setdefault(name, FakeDatabase(self.latency))
+
+
+class FakeDatabase:
+    def __init__(self, latency):
+        self.latency = latency
+        self.collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self.collections.setdefault(name, FakeCollection(self.latency))
+
+
+def install_fakes(sheets_latency_ms=0.0, mongo_latency_ms=0.0, jitter=0.25):
+    """
+    Patches gspread, the Google service-account credentials and pymongo.MongoClient with
+    the fakes above. Returns (sheets_client, mongo_client, patches); stop the patches to undo.
+    """
+    sheets = FakeSheetsClient(Latency(sheets_latency_ms, jitter))
+    mongo = FakeMongoClient(Latency(mongo_latency_ms, jitter))
+    patches = [
+        mock.patch("gspread.authorize", lambda credentials: sheets),
+        mock.patch("oauth2client.service_account.ServiceAccountCredentials.from_json_keyfile_dict",
+                   lambda *args, **kwargs: None),
+        mock.patch("pymongo.MongoClient", mongo),
+    ]
+    for patch in patches:
+        patch.start()
+    return sheets, mongo, patches
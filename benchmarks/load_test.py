@@ -0,0 +1,334 @@
+"""Concurrent-session load test of the Apnapan Pulse app against in-process backends.
+
+Runs many headless sessions of app.py at once (Streamlit's AppTest, one thread per
+session, all in this process, so they share the caches, dataset store and worker pool
+the way browser sessions share one server). Each session goes through login -> upload
+-> analysis -> Key Metrics -> Visualisations -> Data Tables -> General Report -> logout.
+Google Sheets and MongoDB are replaced by the fakes in benchmarks/fakes.py with the
+given latency. For each concurrency level it reports throughput, p50/p95/p99 latency per
+page, and peak memory (this process plus the worker processes) per session.
+
+    python -m benchmarks.load_test --sessions 1,4,8,16 --rows 2000 --latency-ms 80
+
+AppTest cannot drive st.file_uploader, so "upload" stores the survey in the fake MongoDB
+(as the uploader does) and the session then opens it from its file history.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fakes import install_fakes
+from benchmarks.synthetic import make_survey, survey_bytes
+from telemetry import current_rss_bytes
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+ACCOUNTS_SHEET = "Apnapan User Accounts"
+PASSWORD = "load-test"
+SECRETS = {
+    "mongo": {"username": "load", "password": "test", "host": "localhost", "db_name": "apnapan",
+              "collection_name": "files"},
+    "connections": {"gsheets": {key: "load-test" for key in [
+        "type", "project_id", "private_key_id", "private_key", "client_email", "client_id", "auth_uri",
+        "token_uri", "auth_provider_x509_cert_url", "client_x509_cert_url"]}},
+    "admin": {"school_ids": []},
+}
+# Shown when the worker pool's queue is full (workers.WorkerPoolBusy); counted as a rejection
+BUSY_MESSAGE = "The server is busy"
+PAGES = ["login", "upload", "open_file", "metrics", "visualisations", "data_table", "report", "logout"]
+
+_session = threading.local()
+
+
+def share_streamlit_runtime():
+    """
+    Lets AppTest instances run concurrently in threads. AppTest swaps process-wide state
+    (the Runtime singleton, st.secrets, a patched config.get_option) in and out around
+    every run, compiles the script once per runner and gives every session the same id.
+    This installs that state once, shares one script cache as the server does (compiling
+    in several threads at once is not safe) and gives each thread its own session id.
+    """
+    import contextlib
+
+    import streamlit as st
+    from streamlit import config, logger
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+    secrets = Secrets()
+    secrets._secrets = SECRETS
+    st.secrets = secrets
+    config.get_config_options()
+    config._set_option("global.appTest", True, "load_test")
+    # Bare-mode warnings on every run would bury the report
+    config._set_option("logger.level", "error", "load_test")
+    logger.set_log_level("error")
+
+    class PerRunRuntime(Runtime):
+        """Absorbs AppTest's per-run Runtime._instance swaps."""
+
+    script_cache = ScriptCache()
+
+    class SessionScriptRunner(LocalScriptRunner):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._session_id = getattr(_session, "id", "load-test")
+            self._script_cache = script_cache
+
+    app_test.Runtime = PerRunRuntime
+    app_test.LocalScriptRunner = SessionScriptRunner
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+
+
+def add_account(sheets, school_id, school_name):
+    sheet = sheets.worksheet(ACCOUNTS_SHEET)
+    if not sheet.rows[0]:
+        sheet.rows[0] = ["School ID", "Password", "Salt", "Email", "School Name", "Logo", "Created"]
+    salt = hashlib.sha256(school_id.encode()).hexdigest()[:32]
+    hashed = hashlib.sha256(salt.encode() + PASSWORD.encode()).hexdigest()
+    sheet.rows.append([school_id, hashed, salt, f"{school_id}@example.org", school_name, "", ""])
+
+
+def click(at, label):
+    button = next((b for b in at.button if b.label.strip() == label), None)
+    if button is None:
+        raise RuntimeError(f"No '{label}' button on page {at.session_state['current_page']!r}")
+    button.click()
+
+
+def check(at, page, errors_expected=False):
+    if at.exception:
+        raise RuntimeError(f"{page}: {at.exception[0].message}")
+    errors = [e.value for e in at.error]
+    if errors and not errors_expected:
+        raise RuntimeError(f"{page}: {errors[0]}")
+
+
+def run_session(session_id, school_id, survey, collection, timeout):
+    """Runs one teacher's visit; returns (page timings as (page, seconds), error or None)."""
+    from streamlit.testing.v1 import AppTest
+
+    _session.id = session_id
+    timings = []
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def step(page, action, errors_expected=False):
+        started = time.perf_counter()
+        action()
+        at.run()
+        check(at, page, errors_expected)
+        timings.append((page, time.perf_counter() - started))
+
+    try:
+        at.run()  # Blank session on the login page; not timed
+        check(at, "start")
+
+        def login():
+            at.text_input(key="school_id").input(school_id)
+            at.text_input(key="password").input(PASSWORD)
+            click(at, "Find your school pulse!")
+
+        def upload():
+            # What the uploader does with the file, then the teacher moves on to the main page
+            collection.insert_one({"school_id": school_id, "filename": "survey.csv", "file_data": survey,
+                                   "timestamp": datetime.now()})
+            click(at, "Start Exploring ⮞")
+
+        def open_file():
+            history = at.selectbox[0]
+            history.select(history.options[1])
+
+        def logout():
+            at.session_state["current_page"] = "landing"
+
+        step("login", login)
+        # The main page asks for a file until one is chosen
+        step("upload", upload, errors_expected=True)
+        step("open_file", open_file)
+        step("metrics", lambda: click(at, "Go to Key Metrics  ⮞"))
+        step("visualisations", lambda: click(at, "Go to Visualisations  ⮞"))
+        step("data_table", lambda: click(at, "Go to Data Tables  ⮞"))
+        step("report", lambda: click(at, "Go to Report Generation  ⮞"))
+        step("report", lambda: click(at, "Generate General Report"))
+        step("logout", logout)
+        step("logout", lambda: click(at, "⮜ Back to Login"))
+        return timings, None
+    except Exception as e:
+        return timings, str(e)
+
+
+def worker_rss_bytes():
+    """Combined RSS of the worker processes (children started through multiprocessing)."""
+    total = 0
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+
+class MemorySampler(threading.Thread):
+    """Samples app and worker RSS every interval seconds and keeps the peaks."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_app = self.peak_total = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            app = current_rss_bytes() or 0
+            self.peak_app = max(self.peak_app, app)
+            self.peak_total = max(self.peak_total, app + worker_rss_bytes())
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def run_level(concurrency, level, args, mongo, sheets):
+    collection = mongo[SECRETS["mongo"]["db_name"]][SECRETS["mongo"]["collection_name"]]
+    sessions = []
+    for i in range(concurrency):
+        school_id = f"load-{level}-{i}"
+        add_account(sheets, school_id, f"Load Test School {level}-{i}")
+        # --shared-data gives every school the same file, so the dataset store and caches are shared
+        seed = 0 if args.shared_data else level * 1000 + i
+        survey = survey_bytes(make_survey(args.rows, args.cols, seed=seed), "csv")
+        sessions.append((f"load-session-{level}-{i}", school_id, survey))
+
+    baseline_app = current_rss_bytes() or 0
+    baseline_total = baseline_app + worker_rss_bytes()
+    sampler = MemorySampler()
+    sampler.start()
+    results = [None] * concurrency
+
+    def visit(index):
+        session_id, school_id, survey = sessions[index]
+        results[index] = run_session(session_id, school_id, survey, collection, args.timeout)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=visit, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    sampler.stop()
+
+    by_page = {page: [] for page in PAGES}
+    errors, rejected = [], 0
+    for timings, error in results:
+        for page, seconds in timings:
+            by_page[page].append(seconds)
+        if error and BUSY_MESSAGE in error:
+            rejected += 1
+        elif error:
+            errors.append(error)
+    all_pages = [seconds for timings in by_page.values() for seconds in timings]
+    completed = concurrency - len(errors) - rejected
+    return {
+        "concurrency": concurrency,
+        "completed": completed,
+        "rejected": rejected,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "sessions_per_min": round(completed / wall * 60, 2),
+        "pages_per_s": round(len(all_pages) / wall, 2),
+        "latency_s": {
+            page: {"p50": round(percentile(values, 50), 3), "p95": round(percentile(values, 95), 3),
+                   "p99": round(percentile(values, 99), 3), "n": len(values)}
+            for page, values in list(by_page.items()) + [("all", all_pages)] if values
+        },
+        "peak_app_mb": round(sampler.peak_app / 2**20, 1),
+        "peak_total_mb": round(sampler.peak_total / 2**20, 1),
+        "mb_per_session": round(max(0, sampler.peak_total - baseline_total) / 2**20 / concurrency, 1),
+    }
+
+
+def print_level(result):
+    print(f"\n{result['concurrency']} concurrent sessions: {result['completed']} completed, {result['rejected']} turned away "
+          f"by a full worker queue, {len(result['errors'])} failed in {result['wall_s']:.1f}s; "
+          f"{result['sessions_per_min']:.1f} sessions/min, {result['pages_per_s']:.2f} pages/s")
+    print(f"  memory: peak {result['peak_app_mb']:.0f} MB app, {result['peak_total_mb']:.0f} MB with workers, "
+          f"{result['mb_per_session']:.1f} MB per session above the starting level")
+    print(f"  {'page':<16} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'n':>5}")
+    for page, latency in result["latency_s"].items():
+        print(f"  {page:<16} {latency['p50']:>8.3f} {latency['p95']:>8.3f} {latency['p99']:>8.3f} {latency['n']:>5}")
+    for error in result["errors"][:5]:
+        print(f"  error: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test concurrent Apnapan Pulse sessions with fake backends.")
+    parser.add_argument("--sessions", default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows in each school's survey")
+    parser.add_argument("--cols", type=int, default=50, help="Columns in each school's survey")
+    parser.add_argument("--latency-ms", type=float, default=50.0,
+                        help="Mean latency of every Sheets and MongoDB call")
+    parser.add_argument("--sheets-latency-ms", type=float, help="Overrides --latency-ms for Google Sheets")
+    parser.add_argument("--mongo-latency-ms", type=float, help="Overrides --latency-ms for MongoDB")
+    parser.add_argument("--shared-data", action="store_true", help="Give every school the same survey file")
+    parser.add_argument("--workers", type=int, help="Worker processes (sets WORKER_PROCESSES)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed for a single page run")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.workers is not None:
+        os.environ["WORKER_PROCESSES"] = str(args.workers)
+    sheets_ms = args.latency_ms if args.sheets_latency_ms is None else args.sheets_latency_ms
+    mongo_ms = args.latency_ms if args.mongo_latency_ms is None else args.mongo_latency_ms
+    sheets, mongo, _ = install_fakes(sheets_ms, mongo_ms)
+    share_streamlit_runtime()
+    os.chdir(os.path.dirname(APP_PATH))  # app.py opens its images by relative path
+
+    print(f"Load test: {args.rows} x {args.cols} surveys, Sheets {sheets_ms:.0f} ms, MongoDB {mongo_ms:.0f} ms "
+          f"per call, {'shared' if args.shared_data else 'distinct'} data per school")
+    # One untimed visit first, so imports, static files and the worker pool are warm
+    warmup = run_level(1, 0, args, mongo, sheets)
+    if warmup["errors"]:
+        print(f"Warm-up session failed: {warmup['errors'][0]}")
+        return 1
+
+    results = []
+    for level, concurrency in enumerate((int(n) for n in args.sessions.split(",")), start=1):
+        results.append(run_level(concurrency, level, args, mongo, sheets))
+        print_level(results[-1])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": args.rows, "cols": args.cols, "sheets_latency_ms": sheets_ms,
+                       "mongo_latency_ms": mongo_ms, "levels": results}, f, indent=2)
+        print(f"Wrote {args.json}")
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
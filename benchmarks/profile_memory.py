@@ -0,0 +1,90 @@
+"""Per-stage memory profile of the upload and report pipeline on a synthetic survey.
+
+Runs the steps the app runs for one upload (reading the file, df.copy(), the stages inside
+process_data_and_calculate_metrics such as Likert mapping and the BelongingScore columns,
+then both PDF reports) under tracemalloc and prints each stage's peak and retained
+memory. With --lines, each stage also lists the lines of this project whose allocations
+grew most, with the pandas or library line underneath them (slower: deep tracebacks and
+one heap snapshot per stage).
+
+    python -m benchmarks.profile_memory --rows 100000 --cols 50 --lines
+"""
+import argparse
+import gc
+import json
+import resource
+import sys
+
+from benchmarks.run_benchmarks import LOGO_PATH, custom_pdf, general_pdf
+from benchmarks.synthetic import make_survey, survey_bytes
+from processing import process_data_and_calculate_metrics, read_survey_file
+from telemetry import collect, current_rss_bytes, enable_memory_profiling, stage
+
+
+def pipeline(csv_bytes, logo_bytes, reports):
+    with stage("read_file", nbytes=len(csv_bytes)) as record:
+        df = read_survey_file(csv_bytes, "csv")
+        record.update(rows=df.shape[0], cols=df.shape[1])
+    # Profiled explicitly: the app used to copy the frame before processing it
+    with stage("df_copy", rows=df.shape[0], cols=df.shape[1]):
+        df_copy = df.copy()
+    del df
+    with stage("process_data_and_calculate_metrics"):
+        results = process_data_and_calculate_metrics(df_copy, copy=False)
+    if reports:
+        with stage("report_general"):
+            general_pdf(results, logo_bytes)
+        with stage("report_custom"):
+            custom_pdf(results, logo_bytes)
+    return results
+
+
+def print_report(records, rows, cols, input_mb):
+    print(f"\nMemory by stage for {rows} rows x {cols} columns ({input_mb:.1f} MB CSV)")
+    print(f"{'stage':<44} {'seconds':>8} {'peak MB':>9} {'retained MB':>12} {'RSS MB':>8}")
+    for record in sorted(records, key=lambda r: r["order"]):
+        name = "  " * record["depth"] + record["stage"]
+        print(f"{name:<44} {record['seconds']:>8.3f} {record['peak_mb']:>9.1f} {record['retained_mb']:>12.1f} "
+              f"{record.get('rss_mb', float('nan')):>8.0f}")
+    for record in sorted(records, key=lambda r: r["order"]):
+        if record.get("top_allocations"):
+            print(f"\n{record['stage']}: largest allocations still held at the end of the stage")
+            for line in record["top_allocations"]:
+                print(f"  {line}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile per-stage memory of the Apnapan Pulse pipeline.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--cols", type=int, default=50)
+    parser.add_argument("--lines", action="store_true", help="Attribute allocations to source lines (slower)")
+    parser.add_argument("--top", type=int, default=5, help="Lines listed per stage with --lines")
+    parser.add_argument("--min-kb", type=int, default=256, help="Smallest line allocation listed with --lines")
+    parser.add_argument("--no-reports", action="store_true", help="Skip the two PDF reports")
+    parser.add_argument("--json", metavar="PATH", help="Also write the stage records as JSON")
+    args = parser.parse_args(argv)
+
+    # Build the input before tracing starts so it does not count towards any stage
+    csv_bytes = survey_bytes(make_survey(args.rows, args.cols), "csv")
+    with open(LOGO_PATH, "rb") as f:
+        logo_bytes = f.read()
+    gc.collect()
+    baseline_rss = current_rss_bytes()
+
+    enable_memory_profiling(trace_lines=args.lines, top_lines=args.top, min_line_kb=args.min_kb)
+    _, records = collect(pipeline, csv_bytes, logo_bytes, not args.no_reports)
+
+    print_report(records, args.rows, args.cols, len(csv_bytes) / 2**20)
+    # ru_maxrss is in kilobytes on Linux
+    print(f"\nProcess peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB "
+          f"(RSS before profiling: {(baseline_rss or 0) / 2**20:.0f} MB)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": args.rows, "cols": args.cols, "input_bytes": len(csv_bytes), "stages": records}, f,
+                      indent=2, default=str)
+        print(f"Wrote {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
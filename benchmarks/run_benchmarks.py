@@ -0,0 +1,211 @@
+"""Benchmarks for the Apnapan Pulse data pipeline on synthetic surveys.
+
+Times each stage the app runs for an upload (parsing, process_data_and_calculate_metrics,
+the Visualisation aggregates and both PDF builders) across survey sizes, and compares
+the medians against a recorded baseline so regressions show up.
+
+    python -m benchmarks.run_benchmarks                       # default sizes, compare to baseline
+    python -m benchmarks.run_benchmarks --sizes 100000x300 --repeat 1
+    python -m benchmarks.run_benchmarks --full --save-baseline benchmarks/baseline.json
+
+Baselines are machine specific: record one on the machine you compare on.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_survey, survey_bytes
+from processing import (group_averages, process_data_and_calculate_metrics, read_survey_file, response_breakdown,
+                        value_counts_table)
+from reports import custom_chart_options, generate_custom_pdf, generate_pdf
+
+DEFAULT_SIZES = [(1_000, 10), (1_000, 50), (10_000, 50), (10_000, 300), (100_000, 50)]
+FULL_SIZES = DEFAULT_SIZES + [(100_000, 300), (1_000_000, 50), (1_000_000, 300)]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images", "project_apnapan_logo.png")
+
+# Same lookups as the Visualisation page
+DEMOGRAPHIC_COLS = {
+    "Gender": ["gender", "What gender do you use"],
+    "Grade": ["grade", "Which grade are you in"],
+    "Religion": ["religion"],
+    "Ethnicity": ["ethnicity_cleaned"],
+}
+GROUP_COLUMNS = {
+    "Gender": ["gender", "What gender do you use"],
+    "Grade": ["grade", "Which grade are you in"],
+    "Income Status": ["Income Category"],
+    "Health Condition": ["disability", "health condition"],
+    "Ethnicity": ["ethnicity_cleaned"],
+    "Religion": ["religion"],
+}
+
+
+def find_col(df, keywords):
+    return next((col for col in df.columns if any(k.lower() in col.lower() for k in keywords)), None)
+
+
+def visualisation_aggregates(results):
+    """Every aggregate the Visualisation page computes for one dataset, uncached."""
+    df_cleaned = results["df_cleaned"]
+    for label, keywords in DEMOGRAPHIC_COLS.items():
+        col = find_col(df_cleaned, keywords)
+        if col:
+            value_counts_table(df_cleaned, col, label)
+    gender_col = find_col(df_cleaned, GROUP_COLUMNS["Gender"])
+    for keywords in results["belonging_questions"].values():
+        target_col = find_col(df_cleaned, keywords)
+        if not target_col:
+            continue
+        for label, group_keywords in GROUP_COLUMNS.items():
+            group_col = find_col(df_cleaned, group_keywords)
+            if group_col:
+                group_averages(df_cleaned, group_col, target_col, label)
+        if gender_col:
+            response_breakdown(df_cleaned, gender_col, target_col)
+
+
+def general_pdf(results, logo_bytes):
+    return generate_pdf(
+        "Benchmark School", logo_bytes, logo_bytes, results["df_cleaned"], results["category_averages"],
+        results["overall_belonging_score"], results["highest_area"], results["lowest_area"],
+        date.today().strftime("%d %B, %Y"), len(results["df_cleaned"]))
+
+
+def custom_pdf(results, logo_bytes):
+    construct = "Safety"
+    options = custom_chart_options(construct)
+    return generate_custom_pdf(
+        "Benchmark School", logo_bytes, logo_bytes, construct, list(options), options,
+        results["df_cleaned"], results["matched_questions"], results["category_averages"],
+        results["overall_belonging_score"], date.today().strftime("%d %B, %Y"), len(results["df_cleaned"]))
+
+
+def time_call(fn, repeat, setup=None):
+    """Runs fn repeat times (setup() output is passed in and not timed); returns the durations."""
+    durations = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        started = time.perf_counter()
+        fn(arg) if setup else fn()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def run_size(rows, cols, repeat, logo_bytes, stages):
+    survey = make_survey(rows, cols)
+    csv_bytes = survey_bytes(survey, "csv")
+    df = read_survey_file(csv_bytes, "csv")
+    results = process_data_and_calculate_metrics(df)
+    timings = {
+        "ingest_csv": lambda: time_call(lambda: read_survey_file(csv_bytes, "csv"), repeat),
+        # The copy is made outside the timer; the app processes the frame it just parsed
+        "process_metrics": lambda: time_call(lambda d: process_data_and_calculate_metrics(d, copy=False), repeat,
+                                             setup=df.copy),
+        "visualisation_aggregates": lambda: time_call(lambda: visualisation_aggregates(results), repeat),
+        "pdf_general": lambda: time_call(lambda: general_pdf(results, logo_bytes), repeat),
+        "pdf_custom": lambda: time_call(lambda: custom_pdf(results, logo_bytes), repeat),
+    }
+    rows_out = []
+    for stage_name, run in timings.items():
+        if stages and stage_name not in stages:
+            continue
+        durations = run()
+        rows_out.append({
+            "rows": rows, "cols": cols, "stage": stage_name, "input_mb": round(len(csv_bytes) / 2**20, 2),
+            "median_s": round(statistics.median(durations), 4), "min_s": round(min(durations), 4),
+            "repeat": len(durations),
+        })
+        print(f"{rows:>9} x {cols:<4} {stage_name:<26} median {rows_out[-1]['median_s']:.4f}s  "
+              f"min {rows_out[-1]['min_s']:.4f}s")
+    return rows_out
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "recorded": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold, noise_floor):
+    """Prints stages slower than baseline * threshold; returns how many regressed."""
+    reference = {(r["rows"], r["cols"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = 0
+    for r in results:
+        base = reference.get((r["rows"], r["cols"], r["stage"]))
+        if base is None:
+            continue
+        ratio = r["median_s"] / base["median_s"] if base["median_s"] else float("inf")
+        regressed = ratio > threshold and r["median_s"] - base["median_s"] > noise_floor
+        regressions += regressed
+        flag = "REGRESSION" if regressed else ("faster" if ratio < 1 / threshold else "")
+        print(f"{r['rows']:>9} x {r['cols']:<4} {r['stage']:<26} {base['median_s']:.4f}s -> {r['median_s']:.4f}s "
+              f"({ratio:.2f}x) {flag}")
+    return regressions
+
+
+def parse_sizes(text):
+    return [tuple(int(n) for n in size.lower().split("x")) for size in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Apnapan Pulse pipeline on synthetic surveys.")
+    parser.add_argument("--sizes", type=parse_sizes, help="Comma-separated ROWSxCOLS, e.g. 1000x10,100000x50")
+    parser.add_argument("--full", action="store_true", help="Include the 100k x 300 and 1M row sizes")
+    parser.add_argument("--stages", help="Comma-separated subset of stages to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; sizes over 100k rows run once")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write these results as the new baseline")
+    parser.add_argument("--output", metavar="PATH", help="Also write the results JSON here")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio counted as a regression")
+    parser.add_argument("--noise-floor", type=float, default=0.01,
+                        help="Ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (FULL_SIZES if args.full else DEFAULT_SIZES)
+    stages = set(args.stages.split(",")) if args.stages else None
+    with open(LOGO_PATH, "rb") as f:
+        logo_bytes = f.read()
+
+    results = []
+    for rows, cols in sizes:
+        repeat = 1 if rows > 100_000 else args.repeat
+        results += run_size(rows, cols, repeat, logo_bytes, stages)
+    report = {"environment": environment(), "results": results}
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {path}")
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with baseline from {baseline['environment'].get('recorded')} "
+              f"(commit {baseline['environment'].get('commit') or 'unknown'}):")
+        if compare(results, baseline, args.threshold, args.noise_floor):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
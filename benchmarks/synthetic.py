@@ -0,0 +1,129 @@
+"""Synthetic Apnapan survey exports for benchmarking and load testing.
+
+Column names follow the Google Form the schools use, so the keyword matching in
+processing.py finds the same demographics, constructs and kaash questions it would in
+a real upload. Answers are correlated through a per-student belonging level and carry
+a little of the noise real exports have (blank answers, stray case and whitespace).
+
+    python -m benchmarks.synthetic --rows 10000 --cols 50 --out survey.csv
+"""
+import argparse
+import io
+
+import numpy as np
+import pandas as pd
+
+LIKERT = ["Strongly Disagree", "Disagree", "Neutral", "Agree", "Strongly Agree"]
+# Same answers as they sometimes arrive from hand-edited sheets
+LIKERT_NOISY = ["strongly disagree", " Disagree", "neutral ", "AGREE", "Strongly agree"]
+
+# (column, values, weights); the order is the order columns are kept when cols is small
+DEMOGRAPHICS = [
+    ("What gender do you use?", ["Female", "Male", "male ", "Non-binary", "Prefer not to say"],
+     [0.47, 0.44, 0.03, 0.02, 0.04]),
+    ("Which grade are you in?", ["6", "7th", "Grade 8", "Class 9", "10", "11th", "12"],
+     [0.16, 0.16, 0.15, 0.15, 0.14, 0.12, 0.12]),
+    ("What is your religion?", ["Hindu", "Muslim", "Christian", "Sikh", "Buddhist", "Jain", "Other"],
+     [0.62, 0.2, 0.06, 0.04, 0.03, 0.02, 0.03]),
+    ("Which ethnicity (category) do you belong to?",
+     ["General", "SC", "ST", "Other Backward Class (OBC)", "Don't know"], [0.3, 0.2, 0.1, 0.3, 0.1]),
+    ("Do you have any disability or health condition?", ["No", "Yes", "Prefer not to say"], [0.88, 0.07, 0.05]),
+]
+POSSESSIONS_COLUMN = "What items among these do you have at home? (Ghar mein kya kya hai?)"
+POSSESSION_ITEMS = ["Car", "Computer", "Laptop", "Apna ghar (own house)", "Rented house", "TV", "Smartphone", "Bicycle"]
+
+# One or more questions per belonging construct, in the survey's bilingual wording
+CONSTRUCT_QUESTIONS = [
+    "Do you feel safe at school? (Kya aap school mein surakshit mehsoos karte hain?)",
+    "Do your classmates treat you with respect? (izzat)",
+    "Do you feel a sense of being welcomed when you come to school? (swagat)",
+    "Is there at least one teacher you can share your problem with?",
+    "Do you get opportunities to participate in school activities?",
+    "Do your teachers notice when you do something well?",
+    "Do your teachers give you as much respect as other students?",
+    "Do you feel close to your teachers?",
+    "Do your teachers listen to what I say?",
+    "Can you join in many activities at school?",
+    "Do you feel valued in your class?",
+    "Do your teachers care about your feelings?",
+]
+KAASH_QUESTIONS = [
+    "Kaash mere school mein log mujhe zyada samajhte (I wish people at school understood me more)",
+    "Kaash mere dost mere saath zyada time bitate (I wish my friends spent more time with me)",
+]
+FILLER_SUBJECTS = ["Maths", "Science", "Hindi", "English", "Social Studies", "Art", "Sports", "Music", "Computers"]
+
+
+def _pick(rng, values, weights, rows, missing_rate):
+    values = np.array(values + [np.nan], dtype=object)
+    weights = np.append(np.asarray(weights, dtype=float) * (1 - missing_rate), missing_rate)
+    return values[rng.choice(len(values), size=rows, p=weights / weights.sum())]
+
+
+def _likert(rng, belonging, rows, missing_rate, noise_rate, shift=0.0):
+    scores = np.clip(np.rint(3.4 + shift + 0.9 * belonging + rng.normal(0, 0.8, rows)), 1, 5).astype(int) - 1
+    answers = np.array(LIKERT, dtype=object)[scores]
+    noisy = rng.random(rows) < noise_rate
+    answers[noisy] = np.array(LIKERT_NOISY, dtype=object)[scores[noisy]]
+    answers[rng.random(rows) < missing_rate] = np.nan
+    return answers
+
+
+def make_survey(rows=1000, cols=40, seed=0, missing_rate=0.02, noise_rate=0.01):
+    """
+    Returns a raw survey export with the given shape (cols is clamped to 10..300).
+    Columns are kept in priority order: timestamp, demographics, possessions, the
+    construct questions, kaash questions, then generic Likert filler questions.
+    """
+    cols = max(10, min(300, int(cols)))
+    rng = np.random.default_rng(seed)
+    belonging = rng.normal(0, 1, rows)
+    data = {}
+
+    start = np.datetime64("2024-07-01T08:00:00")
+    data["Timestamp"] = pd.to_datetime(start + rng.integers(0, 90 * 24 * 3600, rows).astype("timedelta64[s]")) \
+        .strftime("%m/%d/%Y %H:%M:%S")
+    for name, values, weights in DEMOGRAPHICS:
+        data[name] = _pick(rng, values, weights, rows, missing_rate)
+
+    # A limited set of item combinations, as in real responses
+    combos = []
+    for _ in range(48):
+        mask = rng.random(len(POSSESSION_ITEMS)) < [0.25, 0.2, 0.2, 0.55, 0.3, 0.8, 0.75, 0.4]
+        combos.append(", ".join(item for item, keep in zip(POSSESSION_ITEMS, mask) if keep) or "None of these")
+    data[POSSESSIONS_COLUMN] = _pick(rng, combos, np.ones(len(combos)), rows, missing_rate)
+
+    for i, question in enumerate(CONSTRUCT_QUESTIONS):
+        data[question] = _likert(rng, belonging, rows, missing_rate, noise_rate, shift=0.15 * (i % 3 - 1))
+    for question in KAASH_QUESTIONS:
+        data[question] = _likert(rng, -belonging, rows, missing_rate, noise_rate)
+
+    n = 0
+    while len(data) < cols:
+        n += 1
+        subject = FILLER_SUBJECTS[n % len(FILLER_SUBJECTS)]
+        data[f"Q{n}. I enjoy my {subject} lessons ({n})"] = _likert(rng, belonging, rows, missing_rate, noise_rate, -0.3)
+
+    return pd.DataFrame({name: data[name] for name in list(data)[:cols]})
+
+
+def survey_bytes(df, file_type="csv"):
+    """Serialises a survey the way a school would upload it."""
+    if file_type in ["csv", "txt"]:
+        return df.to_csv(index=False).encode("utf-8")
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic Apnapan survey export.")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic_survey.csv", help=".csv or .xlsx")
+    args = parser.parse_args()
+    survey = make_survey(args.rows, args.cols, args.seed)
+    with open(args.out, "wb") as f:
+        f.write(survey_bytes(survey, args.out.rsplit(".", 1)[-1].lower()))
+    print(f"Wrote {args.out}: {survey.shape[0]} rows x {survey.shape[1]} columns")
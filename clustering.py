@@ -0,0 +1,107 @@
+"""Belonging profiles: groups of students with a similar pattern of construct scores.
+
+Each student is described by their mean score (1-5) on each belonging construct, and the
+students are clustered with MiniBatchKMeans on a float32 matrix, which stays fast and
+small at district scale. The number of profiles is chosen by fitting each candidate k
+on a sample and comparing silhouette scores on a smaller sample; only the chosen k is
+fitted on every student. Streamlit-free; the app caches the result per dataset.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+from processing import construct_scores
+from telemetry import stage
+
+MIN_STUDENTS = 30  # Fewer than this and the profiles say more about noise than about students
+K_RANGE = range(2, 7)
+FIT_SAMPLE = 20_000  # Students used to compare candidate k
+SILHOUETTE_SAMPLE = 2_000  # Silhouette is quadratic in the sample size
+
+
+# Function to build the students x constructs score matrix
+def construct_score_matrix(df_cleaned, matched_questions):
+    """
+    Mean score per construct for each student, as float32. Students who answered fewer
+    than half of the constructs are left out; other gaps take the construct's mean.
+    Returns (scores DataFrame indexed like df_cleaned, construct names).
+    """
+    scores = construct_scores(df_cleaned, matched_questions)
+    constructs = list(scores.columns)
+    if not constructs:
+        return scores, []
+    scores = scores[scores.notna().sum(axis=1) * 2 >= len(constructs)]
+    return scores.fillna(scores.mean()), constructs
+
+
+def _fit(X, k, seed):
+    return MiniBatchKMeans(n_clusters=k, batch_size=min(4096, len(X)), n_init=3, random_state=seed).fit(X)
+
+
+# Function to pick the number of profiles by sampled silhouette score
+def choose_k(X, k_range=K_RANGE, seed=0):
+    """Returns (best k, {k: silhouette}) from fits on a sample of the rows of X."""
+    rng = np.random.default_rng(seed)
+    if len(X) > FIT_SAMPLE:
+        X = X[rng.choice(len(X), FIT_SAMPLE, replace=False)]
+    silhouettes = {}
+    for k in k_range:
+        if k >= len(X):
+            break
+        labels = _fit(X, k, seed).labels_
+        if len(np.unique(labels)) < 2:
+            continue
+        silhouettes[k] = float(silhouette_score(X, labels, sample_size=min(len(X), SILHOUETTE_SAMPLE),
+                                                random_state=seed))
+    best_k = max(silhouettes, key=silhouettes.get) if silhouettes else None
+    return best_k, silhouettes
+
+
+# Function to cluster students into belonging profiles
+def fit_belonging_profiles(df_cleaned, matched_questions, k=None, seed=0):
+    """
+    Clusters students by construct scores. Returns None when there are too few students,
+    else a dict with:
+      labels     - categorical Series ("Profile 1".. ) indexed like the students clustered
+      centroids  - DataFrame of mean construct scores per profile, plus Students and Share (%)
+      k, silhouette ({k: score} for the candidates tried), constructs, model (the fitted model)
+    Profile 1 has the highest average score; numbering is stable for a given dataset.
+    """
+    scores, constructs = construct_score_matrix(df_cleaned, matched_questions)
+    if len(scores) < MIN_STUDENTS:
+        return None
+    X = scores.to_numpy(dtype=np.float32)
+    with stage("choose_k", rows=X.shape[0], cols=X.shape[1]):
+        best_k, silhouettes = choose_k(X, seed=seed)
+    k = k or best_k
+    if not k:
+        return None
+    with stage("fit_profiles", rows=X.shape[0], cols=X.shape[1]):
+        model = _fit(X, k, seed)
+
+    # Number profiles from the highest to the lowest mean centroid score
+    order = np.argsort(-model.cluster_centers_.mean(axis=1))
+    names = [f"Profile {rank + 1}" for rank in range(k)]
+    rank_of_cluster = np.empty(k, dtype=np.int8)
+    rank_of_cluster[order] = np.arange(k)
+    labels = pd.Series(pd.Categorical.from_codes(rank_of_cluster[model.labels_], categories=names),
+                       index=scores.index, name="Profile")
+
+    centroids = pd.DataFrame(model.cluster_centers_[order], index=names, columns=constructs).round(2)
+    counts = labels.value_counts().reindex(names)
+    centroids["Students"] = counts.to_numpy()
+    centroids["Share (%)"] = (counts / counts.sum() * 100).round(1).to_numpy()
+    return {"labels": labels, "centroids": centroids, "k": k, "silhouette": silhouettes,
+            "constructs": constructs, "model": model}
+
+
+# Function to count profile members within each demographic group
+def profile_sizes_by_group(df_cleaned, labels, group_col):
+    """Students per (group, profile) with the profile's share of the group, in long form."""
+    groups = df_cleaned.loc[labels.index, group_col].astype("string").fillna("Unknown")
+    counts = pd.crosstab(groups, labels)
+    percent = counts.div(counts.sum(axis=1), axis=0) * 100
+    sizes = counts.stack().rename("Count").to_frame()
+    sizes["Percent"] = percent.stack().round(1)
+    return sizes.reset_index()
@@ -0,0 +1,143 @@
+"""Export of the cleaned data and its derived tables as CSV, Parquet or an Excel workbook.
+
+Every writer walks the frames in slices of chunk_rows and writes straight to a file, so
+exporting a dataset of hundreds of thousands of students holds one slice in memory beyond
+the shared frame, never a second full copy (no to_excel / to_parquet of the whole frame).
+Several tables become a zip of files for CSV and Parquet, and one sheet each in Excel.
+Streamlit-free; the app publishes the written file for download.
+"""
+import io
+import os
+import re
+import tempfile
+import zipfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+EXPORT_CHUNK_ROWS = 50_000
+EXCEL_MAX_ROWS = 1_048_575  # Data rows per sheet, below the header
+# Format -> (label shown in the app, extension of a single-table file)
+EXPORT_FORMATS = {
+    "xlsx": ("Excel workbook (one sheet per table)", "xlsx"),
+    "csv": ("CSV (zip when several tables)", "csv"),
+    "parquet": ("Parquet (zip when several tables)", "parquet"),
+}
+
+
+# Function to collect the exportable tables of a processed dataset (or filtered view)
+def export_tables(results):
+    """Table name -> DataFrame. The cleaned data is the shared frame itself, not a copy."""
+    tables = {}
+    df_cleaned = results.get("df_cleaned")
+    if isinstance(df_cleaned, pd.DataFrame):
+        tables["Cleaned Data"] = df_cleaned
+    category_averages = results.get("category_averages") or {}
+    if category_averages:
+        tables["Category Averages"] = pd.DataFrame(
+            {"Construct": list(category_averages), "Average Score": list(category_averages.values())})
+    if isinstance(results.get("matched_questions_table"), pd.DataFrame):
+        tables["Matched Questions"] = results["matched_questions_table"]
+    if isinstance(results.get("summary_table"), pd.DataFrame):
+        tables["Summary Statistics"] = results["summary_table"].rename_axis("Statistic").reset_index()
+    return tables
+
+
+def _slug(name):
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def _chunks(df, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _write_csv(df, f, chunk_rows):
+    df.iloc[:0].to_csv(f, index=False)  # Header even for an empty table
+    for chunk in _chunks(df, chunk_rows):
+        chunk.to_csv(f, index=False, header=False)
+
+
+def _arrow_ready(chunk):
+    # Raw survey columns can mix numbers and text; as strings every slice gets the same schema
+    object_cols = chunk.columns[chunk.dtypes == object]
+    if len(object_cols):
+        chunk = chunk.astype({col: "string" for col in object_cols})
+    return chunk.rename(columns=str)
+
+
+def _write_parquet(df, path, chunk_rows):
+    schema = pa.Schema.from_pandas(_arrow_ready(df.iloc[:0]), preserve_index=False)
+    with pq.ParquetWriter(path, schema, compression="snappy") as writer:
+        for chunk in _chunks(df, chunk_rows):  # One row group per slice
+            writer.write_table(pa.Table.from_pandas(_arrow_ready(chunk), schema=schema, preserve_index=False))
+
+
+def _write_xlsx(tables, path, chunk_rows):
+    # constant_memory flushes each row to disk once the next one starts, so memory stays flat
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "nan_inf_to_errors": True,
+        "strings_to_formulas": False,  # Survey answers starting with "=" stay text
+        "strings_to_urls": False,
+        "remove_timezone": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+    })
+    try:
+        for name, df in tables.items():
+            for part, start in enumerate(range(0, max(len(df), 1), EXCEL_MAX_ROWS)):
+                # A table longer than a sheet continues on "Name (2)", "Name (3)", ...
+                sheet = workbook.add_worksheet((name if part == 0 else f"{name} ({part + 1})")[:31])
+                sheet.write_row(0, 0, [str(col) for col in df.columns])
+                row_number = 1
+                for chunk in _chunks(df.iloc[start:start + EXCEL_MAX_ROWS], chunk_rows):
+                    # Python objects, with missing values as None (written as empty cells)
+                    for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                        sheet.write_row(row_number, 0, row)
+                        row_number += 1
+    finally:
+        workbook.close()
+
+
+# Function to write the chosen tables to path in one of the EXPORT_FORMATS
+def write_export(tables, export_format, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Writes tables (name -> DataFrame) to path and returns the file's size in bytes. For CSV
+    and Parquet, one table is written as is and several are zipped, one file per table.
+    """
+    if export_format == "xlsx":
+        _write_xlsx(tables, path, chunk_rows)
+    elif len(tables) == 1 and export_format == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            _write_csv(next(iter(tables.values())), f, chunk_rows)
+    elif len(tables) == 1 and export_format == "parquet":
+        _write_parquet(next(iter(tables.values())), path, chunk_rows)
+    elif export_format == "csv":
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for name, df in tables.items():
+                with zf.open(f"{_slug(name)}.csv", "w") as raw, \
+                        io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                    _write_csv(df, f, chunk_rows)
+    elif export_format == "parquet":
+        # Parquet needs a seekable target, so each table goes to a temporary file first
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+            for name, df in tables.items():
+                fd, tmp_path = tempfile.mkstemp(suffix=".parquet")
+                os.close(fd)
+                try:
+                    _write_parquet(df, tmp_path, chunk_rows)
+                    zf.write(tmp_path, f"{_slug(name)}.parquet")
+                finally:
+                    os.remove(tmp_path)
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    return os.path.getsize(path)
+
+
+def export_filename(stem, tables, export_format):
+    """File name for an export: the format's extension for one table (or Excel), else .zip."""
+    if export_format == "xlsx" or len(tables) == 1:
+        return f"{stem}.{EXPORT_FORMATS[export_format][1]}"
+    return f"{stem}.zip"
@@ -0,0 +1,76 @@
+"""Network view: construct averages, rankings and percentiles across many schools.
+
+Works only on the stored upload summaries (see processing.summarize_results), one per
+school, never on raw files. Each summary carries the count, sum and sum of squares of
+every measure, so network-wide means and spreads pool exactly, and a network of a few
+hundred schools is a handful of array operations. Streamlit-free.
+"""
+import numpy as np
+import pandas as pd
+
+OVERALL = "Overall Belonging"
+
+
+# Function to turn the summaries' moments into school x measure arrays
+def moment_arrays(summaries):
+    """
+    Returns (school_ids, measures, n, total, total_sq), the last three being float arrays
+    of shape (schools, measures); a measure a school's summary lacks has n = 0.
+    """
+    school_ids = [doc["school_id"] for doc in summaries]
+    measures = list(dict.fromkeys(measure for doc in summaries for measure in (doc.get("stats") or {})))
+    # The overall score leads, constructs follow in the order they were first seen
+    measures.sort(key=lambda measure: measure != OVERALL)
+    n, total, total_sq = (np.zeros((len(summaries), len(measures))) for _ in range(3))
+    column = {measure: j for j, measure in enumerate(measures)}
+    for i, doc in enumerate(summaries):
+        for measure, moments in (doc.get("stats") or {}).items():
+            j = column[measure]
+            n[i, j], total[i, j], total_sq[i, j] = moments["n"], moments["sum"], moments["sum_sq"]
+    return school_ids, measures, n, total, total_sq
+
+
+# Function to aggregate the latest summary of each school into network-wide tables
+def network_aggregate(summaries, school_names=None):
+    """
+    summaries: the latest upload summary of each school. Returns None when there are none,
+    else a dict with:
+      network     - per measure: student-weighted network mean, mean of school means,
+                    pooled standard deviation, schools and students
+      schools     - per school: mean of each measure, students, rank and percentile on the
+                    overall score, sorted best first
+      percentiles - per school and measure: share of schools (%) scoring at or below it,
+                    in the same order as schools
+    """
+    if not summaries:
+        return None
+    school_ids, measures, n, total, total_sq = moment_arrays(summaries)
+    names = [(school_names or {}).get(school_id) or school_id for school_id in school_ids]
+    repeated = {name for name in names if names.count(name) > 1}
+    labels = [f"{name} ({school_id})" if name in repeated else name for name, school_id in zip(names, school_ids)]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        school_means = np.where(n > 0, total / n, np.nan)
+        students = n.sum(axis=0)
+        network_mean = total.sum(axis=0) / students
+        network_sd = np.sqrt(np.maximum(total_sq.sum(axis=0) / students - network_mean ** 2, 0))
+    means = pd.DataFrame(school_means, index=pd.Index(labels, name="School"), columns=measures)
+    network = pd.DataFrame({
+        "Network Average": network_mean,
+        "Average of Schools": means.mean().to_numpy(),
+        "Std. Deviation": network_sd,
+        "Schools": (n > 0).sum(axis=0),
+        "Students": students.astype(np.int64),
+    }, index=pd.Index(measures, name="Measure"))
+
+    percentiles = (means.rank(pct=True) * 100).round(0)
+    schools = means.copy()
+    schools["Students"] = [int(doc.get("n_students") or 0) for doc in summaries]
+    schools["Uploaded"] = [doc.get("timestamp") for doc in summaries]
+    if OVERALL in means:
+        schools["Rank"] = means[OVERALL].rank(ascending=False, method="min").astype("Int64")
+        schools["Percentile"] = percentiles[OVERALL]
+        # Best first; schools without an overall score go last
+        order = np.argsort(-means[OVERALL].to_numpy(), kind="stable")
+        schools, percentiles = schools.iloc[order], percentiles.iloc[order]
+    return {"network": network.round(3), "schools": schools.round(3), "percentiles": percentiles}
@@ -0,0 +1,687 @@
+"""Survey parsing and metric calculation for Apnapan Pulse.
+
+Kept free of Streamlit so the functions can run in the worker pool (see workers.py).
+"""
+import codecs
+import csv
+import io
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from telemetry import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pandas' parser is used instead
+    pa = pa_csv = None
+
+# Bootstrap settings for the group comparison charts. When scores are not a few discrete
+# values, resamples x students is capped so the cost stays bounded on large files; there,
+# fewer resamples are plenty for tight intervals.
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_MAX_DISTINCT = 64
+BOOTSTRAP_MIN_RESAMPLES = 100
+BOOTSTRAP_MAX_DRAWS = 20_000_000
+BOOTSTRAP_CHUNK_DRAWS = 2_000_000  # Draws held in memory at once
+# Groups smaller than this get no interval and are never flagged: resampling one or two
+# students gives a (near) zero-width interval that says nothing about the group
+BOOTSTRAP_MIN_GROUP = 5
+# Response levels of the percentage breakdown charts, in stacking order
+RESPONSE_LEVELS = ["Agree", "Neutral", "Disagree", "Unknown"]
+# Cross-tab cells with fewer students than this are not shown
+CROSSTAB_MIN_CELL = 10
+# Constructs with fewer students answering every item than this get no alpha
+RELIABILITY_MIN_STUDENTS = 10
+# Bump when summarize_results changes so stored upload summaries are recomputed
+SUMMARY_VERSION = 1
+# Likert answers and their scores
+LIKERT_LEVELS = {"Strongly Disagree": 1, "Disagree": 2, "Neutral": 3, "Agree": 4, "Strongly Agree": 5}
+# CSV parsing: bytes sniffed for encoding and delimiter, candidate delimiters, and the
+# demographic columns (by keyword) read as categoricals
+SNIFF_BYTES = 64 * 1024
+CSV_DELIMITERS = ",;\t|"
+CATEGORICAL_KEYWORDS = ["gender", "religion", "grade", "ethnicity"]
+# Income bands from the possessions question. Rules are tried in order and the first whose
+# keywords match a student's answer (case-insensitive substrings) gives the band: "all"
+# keywords must all appear, and at least one of "any". A deployment can replace these by
+# pointing APNAPAN_INCOME_RULES at a JSON file of the same shape.
+DEFAULT_INCOME_RULES = {
+    "rules": [
+        {"category": "High", "all": ["car", "apna ghar"]},
+        {"category": "Mid", "any": ["computer", "laptop", "apna ghar"]},
+    ],
+    "default": "Low",
+    "missing": "Unknown",
+}
+
+
+# Function to parse an uploaded survey file from its raw bytes
+def read_survey_file(file_bytes, file_type):
+    if file_type in ["csv", "txt"]:
+        return read_survey_csv(file_bytes)
+    # BytesIO over an existing bytes object shares its buffer until written to, so no copy is made
+    return pd.read_excel(io.BytesIO(file_bytes))
+
+
+# --- CSV parsing ---
+# Google Forms and Excel exports differ in encoding (UTF-8 with or without BOM, UTF-16,
+# Windows-1252) and delimiter (comma, semicolon in many locales, tab for .txt). Both are
+# sniffed from the first SNIFF_BYTES, and the file is read by pyarrow's multithreaded CSV
+# reader when it is installed, with pandas' C parser as the fallback. Demographic and Likert
+# columns, recognised in the sniffed rows, are read straight into categoricals.
+def sniff_encoding(prefix):
+    """The encoding of a file starting with prefix: from its BOM, else UTF-8 if it decodes."""
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        prefix.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        if e.start >= len(prefix) - 3 and e.reason == "unexpected end of data":
+            return "utf-8"  # The prefix cut a multi-byte character short
+    try:
+        prefix.decode("cp1252")
+        return "cp1252"
+    except UnicodeDecodeError:
+        return "latin-1"  # Decodes any bytes
+
+
+def sniff_delimiter(sample):
+    """The field delimiter of the CSV text sample (comma if it cannot tell)."""
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        # Long quoted answers can defeat the sniffer; the header line rarely does
+        first_line = sample.split("\n", 1)[0]
+        counts = {delimiter: first_line.count(delimiter) for delimiter in CSV_DELIMITERS}
+        best = max(counts, key=counts.get)
+        return best if counts[best] else ","
+
+
+def categorical_columns(header, rows):
+    """Columns of header to read as categoricals: known demographics, and Likert answers in rows."""
+    columns = [col for col in header if any(k in col.lower() for k in CATEGORICAL_KEYWORDS)]
+    for i, col in enumerate(header):
+        if col not in columns and any(len(row) > i and row[i].strip().title() in LIKERT_LEVELS for row in rows):
+            columns.append(col)
+    return columns
+
+
+def _sniff_csv(file_bytes):
+    """(encoding, delimiter, header, categorical columns) from the start of a CSV file."""
+    prefix = file_bytes[:SNIFF_BYTES]
+    encoding = sniff_encoding(prefix)
+    sample = prefix.decode(encoding, errors="ignore")
+    if len(file_bytes) > SNIFF_BYTES:
+        sample = sample[:sample.rfind("\n") + 1] or sample  # Only whole lines
+    delimiter = sniff_delimiter(sample)
+    rows = list(csv.reader(io.StringIO(sample), delimiter=delimiter))
+    header, rows = (rows[0], rows[1:]) if rows else ([], [])
+    return encoding, delimiter, header, categorical_columns(header, rows)
+
+
+def _read_csv_pyarrow(file_bytes, encoding, delimiter, categorical):
+    table = pa_csv.read_csv(
+        io.BytesIO(file_bytes),
+        # pyarrow skips a UTF-8 BOM itself and transcodes other encodings
+        read_options=pa_csv.ReadOptions(encoding="utf8" if encoding.startswith("utf-8") else encoding,
+                                        use_threads=True),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter, newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={col: pa.dictionary(pa.int32(), pa.string()) for col in categorical},
+            strings_can_be_null=True,  # Empty answers are missing, as with pandas
+        ),
+    )
+    # pandas keeps dates as text; so do we, since later stages parse answers as strings
+    for i, field in enumerate(table.schema):
+        if pa.types.is_date(field.type) or pa.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    # Missing text is None from Arrow but NaN from pandas, and str(None) would not read as "nan"
+    for col in df.columns[df.dtypes == object]:
+        if df[col].hasnans:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+
+# Function to parse a CSV (or tab-separated .txt) survey export
+def read_survey_csv(file_bytes):
+    encoding, delimiter, header, categorical = _sniff_csv(file_bytes)
+    with stage("parse_csv", nbytes=len(file_bytes)) as record:
+        record.update(encoding=encoding, delimiter=delimiter)
+        # pyarrow keeps repeated column names as they are; pandas numbers them (Q, Q.1, ...)
+        if pa_csv is not None and header and len(set(header)) == len(header):
+            try:
+                record["engine"] = "pyarrow"
+                return _read_csv_pyarrow(file_bytes, encoding, delimiter, categorical)
+            except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+                # Ragged rows or bytes the sniffed prefix did not predict; pandas is more lenient
+                print(f"pyarrow could not parse the CSV ({e}); falling back to pandas.")
+        record["engine"] = "pandas"
+        dtype = {col: "category" for col in categorical}
+        for attempt in dict.fromkeys([encoding, "cp1252", "latin-1"]):
+            try:
+                return pd.read_csv(io.BytesIO(file_bytes), sep=delimiter, encoding=attempt, dtype=dtype)
+            except UnicodeDecodeError:
+                if attempt == "latin-1":
+                    raise
+                print(f"CSV is not {attempt}; trying the next encoding.")
+
+
+def process_data_and_calculate_metrics(df, copy=True):
+    """
+    Takes a raw DataFrame, performs all cleaning, normalization, and metric calculations.
+    This centralized function is key to the app's performance.
+    Pass copy=False when the caller owns df and no longer needs the raw values.
+    """
+    with stage("copy_frame", rows=df.shape[0], cols=df.shape[1]):
+        df_cleaned = df.copy() if copy else df
+
+    questionnaire_mapping = LIKERT_LEVELS
+
+    with stage("normalize_demographics", rows=df_cleaned.shape[0]):
+        # --- General Demographic Data Normalization (Case-Insensitive) ---
+        demographic_keywords = ["gender", "religion"]
+        for col in df_cleaned.columns:
+            if any(keyword in col.lower() for keyword in demographic_keywords):
+                df_cleaned[col] = df_cleaned[col].astype(str).str.strip().str.title()
+                df_cleaned[col] = df_cleaned[col].replace('Nan', 'Unknown')
+
+        # --- Grade Column Normalization ---
+        grade_column = next((col for col in df_cleaned.columns if "grade" in col.lower()), None)
+        if grade_column:
+            def normalize_grade(value):
+                s_val = str(value).strip()
+                numbers = re.findall(r'\d+', s_val)
+                if numbers:
+                    return str(numbers[0])
+                return s_val.title() if s_val.lower() not in ['nan', ''] else 'Unknown'
+            # As objects: on a categorical, apply would skip missing answers instead of marking them Unknown
+            df_cleaned[grade_column] = df_cleaned[grade_column].astype(object).apply(normalize_grade)
+
+    with stage("likert_mapping", rows=df_cleaned.shape[0]) as likert_record:
+        # --- Questionnaire Mapping (convert to numeric) ---
+        questionnaire_cols = [
+            col for col in df_cleaned.columns
+            if any(str(val).strip().title() in questionnaire_mapping for val in df_cleaned[col].dropna())
+        ]
+        if questionnaire_cols:
+            for col in questionnaire_cols:
+                df_cleaned[col] = df_cleaned[col].astype(str).str.strip().str.title()
+                df_cleaned[col] = df_cleaned[col].map(questionnaire_mapping).fillna(df_cleaned[col])
+                df_cleaned[col] = pd.to_numeric(df_cleaned[col], errors="coerce")
+        likert_record["cols"] = len(questionnaire_cols)
+
+    with stage("clean_ethnicity", rows=df_cleaned.shape[0]):
+        # --- Improved, Case-Insensitive Ethnicity Cleaning ---
+        ethnicity_column = next((col for col in df_cleaned.columns if "ethnicity" in col.lower()), None)
+        if ethnicity_column:
+            def clean_ethnicity(value):
+                v_lower = str(value).lower().strip()
+                if "general" in v_lower:
+                    return "General"
+                if "sc" in v_lower:
+                    return "SC"
+                if "other" in v_lower: # For OBC
+                    return "OBC"
+                if "do" in v_lower: # For "Don't know"
+                    return "Don't Know"
+                if "st" in v_lower:
+                    return "ST"
+                return str(value).strip().title() # Default: clean and title-case unmatched values
+            df_cleaned["ethnicity_cleaned"] = df_cleaned[ethnicity_column].astype(object).apply(clean_ethnicity)
+
+    with stage("income_category", rows=df_cleaned.shape[0]):
+        # --- Income band from the possessions question, computed once for every page and report ---
+        possessions_col = find_possessions_column(df_cleaned)
+        if possessions_col:
+            df_cleaned["Income Category"] = income_categories(df_cleaned, possessions_col)
+
+    # --- Define Belonging Constructs ---
+    belonging_questions = {
+        "Safety": ["safe", "surakshit"],
+        "Respect": ["respected", "izzat", "as much respect"],
+        "Welcome": ["being welcomed", "welcome", "swagat"],
+        "Relationships with Teachers": ["one teacher", "share your problem", "care about your feelings", " care about how I feel", "feel close", "close to your teachers"],
+        "Participation": ["opportunities", "participate", "school activities", "take part", "join in many activities"],
+        "Acknowledgement": ["notice", "noticed", "listen to you", "dekhein", "acknowledge", "recognized", "listen to what I say", "valued", "heard", "seen", "like you", "like me", "do something well"]
+    }
+
+    # --- Match Constructs to Question Columns ---
+    matched_questions = {
+        cat: [col for col in df_cleaned.columns if any(k.lower() in col.lower() for k in keywords)]
+        for cat, keywords in belonging_questions.items()
+    }
+
+    with stage("belonging_scores", rows=df_cleaned.shape[0]):
+        # --- Special Handling: "Kaash" Questions ---
+        kaash_col = [
+            col for col in df_cleaned.columns if "kaash" in col.lower()]
+        df_cleaned["KaashScore"] = (
+            df_cleaned[kaash_col].apply(pd.to_numeric, errors="coerce").mean(axis=1) if kaash_col else 0
+        )
+
+        # --- Compute Belonging Scores ---
+        belonging_cols = [col for sublist in matched_questions.values() for col in sublist]
+        if belonging_cols:
+            df_cleaned["BelongingRaw"] = df_cleaned[belonging_cols].apply(pd.to_numeric, errors="coerce").sum(axis=1)
+            df_cleaned["BelongingCount"] = df_cleaned[belonging_cols].apply(pd.to_numeric, errors="coerce").notna().sum(axis=1)
+            df_cleaned["BelongingScore"] = df_cleaned.apply(
+                lambda row: (row["BelongingRaw"] - row["KaashScore"]) / row["BelongingCount"] if row["BelongingCount"] > 0 else 0,
+                axis=1
+            )
+        else:
+            df_cleaned["BelongingRaw"] = 0
+            df_cleaned["BelongingCount"] = 0
+            df_cleaned["BelongingScore"] = 0
+
+    # --- Package results into a dictionary for clean state management ---
+    results = {
+        'df_cleaned': df_cleaned,
+        'matched_questions': matched_questions,
+        'demographic_keywords' : demographic_keywords,
+        'belonging_questions': belonging_questions,
+        **aggregate_insights(df_cleaned, matched_questions),
+        'matched_questions_table': pd.DataFrame.from_dict(matched_questions, orient="index").T.fillna("")
+    }
+    return results
+
+
+# Function to compute the headline metrics of a cleaned frame (all students, or a filtered subset)
+def aggregate_insights(df_cleaned, matched_questions):
+    belonging_cols = [col for sublist in matched_questions.values() for col in sublist]
+    overall_belonging_score = df_cleaned["BelongingScore"].mean() if belonging_cols else None
+    category_averages = {
+        cat: df_cleaned[cols].apply(pd.to_numeric, errors='coerce').mean().mean() if cols else 0
+        for cat, cols in matched_questions.items()
+    }
+    highest_area = max(category_averages, key=category_averages.get) if category_averages else None
+    valid_categories = {k: v for k, v in category_averages.items() if v > 0.00}
+    lowest_area = min(valid_categories, key=valid_categories.get) if valid_categories else None
+    with stage("summary_table", rows=df_cleaned.shape[0], cols=df_cleaned.shape[1]):
+        # Computed once per dataset or filtered view; the Data Tables page only displays it
+        summary_table = df_cleaned.describe() if not df_cleaned.empty else None
+    return {
+        'overall_belonging_score': overall_belonging_score,
+        'category_averages': category_averages,
+        'highest_area': highest_area,
+        'lowest_area': lowest_area,
+        'summary_table': summary_table,
+    }
+
+
+# Function to parse and process one upload; this is the job the main page sends to the worker pool
+def build_dataset_results(file_bytes, file_type):
+    with stage("parse", nbytes=len(file_bytes)) as record:
+        df = read_survey_file(file_bytes, file_type)
+        record.update(rows=df.shape[0], cols=df.shape[1])
+
+    # Your existing data processing (timestamp removal, preview, etc.)
+    timestamp_keywords = ['timestamp', 'date', 'time', 'created', 'submitted', 'record', 'entry', 'logged']
+    timestamp_cols = [col for col in df.columns if any(keyword in col.lower() for keyword in timestamp_keywords)]
+    # if timestamp_cols:
+    #     df = df.drop(columns=timestamp_cols)
+
+    # Take the raw preview before processing cleans the frame in place
+    preview_table = df.head().copy()
+    with stage("process_metrics", rows=df.shape[0], cols=df.shape[1]):
+        results = process_data_and_calculate_metrics(df, copy=False)
+    results['preview_table'] = preview_table
+    return results
+
+
+# --- Upload summaries ---
+# A few numbers per upload, stored next to the file so trends across uploads never re-parse old files
+def _moments(values):
+    """Count, sum and sum of squares of the non-missing values: enough to pool means and variances."""
+    values = pd.to_numeric(values, errors="coerce").dropna().to_numpy(dtype=np.float64)
+    return {"n": int(values.size), "sum": float(values.sum()), "sum_sq": float(np.square(values).sum())}
+
+def summarize_results(results):
+    """
+    The headline metrics of one processed upload as a small, BSON-friendly dict: the numbers
+    the metrics page shows, plus per-student moments of each construct score and of the
+    overall BelongingScore so summaries of several uploads or schools can be pooled exactly.
+    """
+    df_cleaned = results["df_cleaned"]
+    scores = construct_scores(df_cleaned, results["matched_questions"])
+    stats = {construct: _moments(scores[construct]) for construct in scores.columns}
+    stats["Overall Belonging"] = _moments(df_cleaned["BelongingScore"])
+    overall = results.get("overall_belonging_score")
+    return {
+        "version": SUMMARY_VERSION,
+        "n_students": int(df_cleaned.shape[0]),
+        "overall_belonging": None if overall is None or pd.isna(overall) else float(overall),
+        "category_averages": {cat: None if pd.isna(avg) else float(avg)
+                              for cat, avg in results.get("category_averages", {}).items()},
+        "stats": stats,
+    }
+
+# Function to summarise a stored upload; runs in the worker pool and returns only the summary
+def build_upload_summary(file_bytes, file_type):
+    return summarize_results(build_dataset_results(file_bytes, file_type))
+
+
+# --- Visualisation aggregates ---
+# Plain functions over the cleaned frame; the app caches them per dataset (see get_group_averages
+# and friends in app.py) and the benchmarks call them directly.
+def find_possessions_column(df_cleaned):
+    """The 'What items among these do you have at home' column, or None."""
+    return next((col for col in df_cleaned.columns if "what items among these do you have at home".lower() in col.lower()), None)
+
+# Function to load this deployment's income rules (see DEFAULT_INCOME_RULES)
+def load_income_rules():
+    path = os.environ.get("APNAPAN_INCOME_RULES")
+    if not path:
+        return DEFAULT_INCOME_RULES
+    try:
+        with open(path) as f:
+            return {**DEFAULT_INCOME_RULES, **json.load(f)}
+    except (OSError, ValueError) as e:
+        print(f"Could not read income rules from {path}, using the defaults: {e}")
+        return DEFAULT_INCOME_RULES
+
+def income_categories(df_cleaned, possessions_col, rules=None):
+    """
+    Income band per student from the possessions question, as a categorical column ordered
+    from the default (lowest) band up. The rules are applied with vectorized substring
+    checks to the distinct answers only, which are few even in very large files.
+    """
+    rules = rules or load_income_rules()
+    codes, answers = pd.factorize(df_cleaned[possessions_col])
+    answers = pd.Series(answers, dtype="string").str.lower()
+
+    def contains(keyword):
+        return answers.str.contains(keyword.lower(), regex=False).fillna(False).to_numpy(dtype=bool)
+
+    conditions = []
+    for rule in rules["rules"]:
+        matched = np.ones(len(answers), dtype=bool)
+        for keyword in rule.get("all", []):
+            matched &= contains(keyword)
+        if rule.get("any"):
+            matched &= np.logical_or.reduce([contains(keyword) for keyword in rule["any"]])
+        conditions.append(matched)
+    bands = [rule["category"] for rule in rules["rules"]]
+    categories = list(dict.fromkeys([rules["default"], *reversed(bands), rules["missing"]]))
+    band_of_answer = np.select(conditions, [categories.index(band) for band in bands],
+                               default=categories.index(rules["default"]))
+    # Missing answers have code -1, which picks the appended "missing" band
+    band_codes = np.append(band_of_answer, categories.index(rules["missing"]))[codes]
+    income = pd.Categorical.from_codes(band_codes, categories=categories)
+    return pd.Series(income, index=df_cleaned.index, name="Income Category").cat.remove_unused_categories()
+
+def value_counts_table(df_cleaned, col_name, label):
+    """Count of each value of col_name (missing values included), as a two-column frame."""
+    return df_cleaned[col_name].value_counts(dropna=False).rename_axis(label).reset_index(name='Count')
+
+def bootstrap_group_means(values, codes, n_groups, resamples=BOOTSTRAP_RESAMPLES, confidence=0.95, seed=0):
+    """
+    Percentile bootstrap for the mean of each group, all groups at once. values are the
+    scores (no NaN) and codes their group numbers (0..n_groups-1, every group non-empty).
+    Each resample redraws every group from its own rows, so alongside each group's
+    interval there is one for the difference between the group and all other students.
+    Returns (ci_low, ci_high, significant) arrays; significant means that difference
+    interval, widened for the number of groups compared (Bonferroni), excludes zero,
+    so a chart with many small groups does not flag differences by chance. Groups below
+    BOOTSTRAP_MIN_GROUP students get NaN intervals and are never significant.
+
+    Likert scores take a handful of distinct values, so a group's resample is drawn as
+    multinomial counts of those values, at a cost independent of the number of students.
+    Other data falls back to resampling rows, with fewer resamples on large inputs
+    (see BOOTSTRAP_MAX_DRAWS).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.asarray(codes)
+    if n_groups == 0 or len(values) == 0:
+        return np.full(n_groups, np.nan), np.full(n_groups, np.nan), np.zeros(n_groups, dtype=bool)
+    counts = np.bincount(codes, minlength=n_groups)
+    n = len(values)
+    rng = np.random.default_rng(seed)
+    distinct, value_codes = np.unique(values, return_inverse=True)
+    if len(distinct) <= BOOTSTRAP_MAX_DISTINCT:
+        # frequencies[g, v]: how often group g gave answer v
+        frequencies = np.bincount(codes * len(distinct) + value_codes,
+                                  minlength=n_groups * len(distinct)).reshape(n_groups, len(distinct))
+        draws = rng.multinomial(counts, frequencies / counts[:, None], size=(resamples, n_groups))
+        means = draws @ distinct / counts
+    else:
+        means = _bootstrap_rows(values, codes, counts, resamples, rng)
+
+    alpha = (1 - confidence) / 2
+    ci_low, ci_high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    significant = np.zeros(n_groups, dtype=bool)
+    others = n - counts
+    large = counts >= BOOTSTRAP_MIN_GROUP
+    if n_groups > 1 and (others > 0).all() and large.any():
+        totals = means * counts  # Back to sums per resample
+        differences = means - (totals.sum(axis=1, keepdims=True) - totals) / others
+        diff_alpha = alpha / large.sum()  # Only groups large enough to flag are compared
+        diff_low, diff_high = np.quantile(differences, [diff_alpha, 1 - diff_alpha], axis=0)
+        significant = ((diff_low > 0) | (diff_high < 0)) & large
+    ci_low[~large], ci_high[~large] = np.nan, np.nan
+    return ci_low, ci_high, significant
+
+def _bootstrap_rows(values, codes, counts, resamples, rng):
+    """Resampled group means (resamples x groups) by drawing row positions within each group."""
+    order = np.argsort(codes, kind="stable")
+    sorted_values = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    n = len(sorted_values)
+    resamples = int(min(resamples, max(BOOTSTRAP_MIN_RESAMPLES, BOOTSTRAP_MAX_DRAWS // max(n, 1))))
+
+    # Every position draws uniformly from the rows of its own group
+    row_start = np.repeat(starts, counts)
+    row_count = np.repeat(counts, counts)
+    means = np.empty((resamples, len(counts)))
+    chunk = max(1, BOOTSTRAP_CHUNK_DRAWS // max(n, 1))
+    for first in range(0, resamples, chunk):
+        b = min(chunk, resamples - first)
+        draws = row_start + (rng.random((b, n)) * row_count).astype(np.int64)
+        means[first:first + b] = np.add.reduceat(sorted_values[draws], starts, axis=1) / counts
+    return means
+
+def group_averages(df_cleaned, group_col, target_col, label):
+    """
+    Mean and count of target_col for each value of group_col (grades sorted numerically),
+    with a 95% bootstrap interval (CI_Low, CI_High) and whether the group's mean differs
+    from the rest of the students (Significant).
+    """
+    if "ethnicity" in group_col.lower() and "ethnicity_cleaned" in df_cleaned.columns:
+        plot_df = df_cleaned[["ethnicity_cleaned", target_col]].dropna()
+        plot_df.rename(columns={"ethnicity_cleaned": group_col}, inplace=True)
+    else:
+        plot_df = df_cleaned[[group_col, target_col]].dropna()
+    plot_df[target_col] = pd.to_numeric(plot_df[target_col], errors="coerce")
+    group_avg = plot_df.groupby(group_col, observed=True)[target_col].agg(['mean', 'count']).reset_index()
+    group_avg.columns = [group_col, 'AvgScore', 'Count']
+    group_avg = group_avg[group_avg['Count'] > 0].reset_index(drop=True)
+
+    scored = plot_df[plot_df[target_col].notna()]
+    codes = pd.Categorical(scored[group_col], categories=group_avg[group_col]).codes
+    group_avg['CI_Low'], group_avg['CI_High'], group_avg['Significant'] = bootstrap_group_means(
+        scored[target_col].to_numpy(), codes, len(group_avg))
+
+    # Special handling for 'Grade' to ensure correct numeric sorting.
+    if label == "Grade":
+        # Convert grade to a numeric type for sorting, coercing errors for non-numeric grades
+        group_avg[group_col] = pd.to_numeric(group_avg[group_col], errors='coerce')
+        group_avg = group_avg.sort_values(by=group_col).dropna(subset=[group_col])
+        # Convert back to string for plotting, ensuring it's handled as a category
+        group_avg[group_col] = group_avg[group_col].astype(int).astype(str)
+    return group_avg
+
+def response_levels(values):
+    """Agree (4-5) / Neutral (3) / Disagree (1-2) per Likert answer; anything else is Unknown."""
+    values = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+    codes = np.select([values <= 2, values == 3, values >= 4], [2, 1, 0], default=3)  # NaN fails every test
+    return pd.Categorical.from_codes(codes, categories=RESPONSE_LEVELS, ordered=True)
+
+def response_breakdown(df_cleaned, breakdown_col, target_col, keep_unknown=True):
+    """
+    Percentage of Agree/Neutral/Disagree responses to target_col per breakdown_col group
+    (None if empty). keep_unknown=False leaves out answers that are not numbers.
+    """
+    breakdown_df = df_cleaned[[breakdown_col, target_col]].dropna()
+    levels = response_levels(breakdown_df[target_col])
+    if not keep_unknown:
+        breakdown_df, levels = breakdown_df[levels != "Unknown"], levels[levels != "Unknown"]
+    if breakdown_df.empty:
+        return None
+
+    percent_df = (breakdown_df.groupby([breakdown_df[breakdown_col], pd.Series(levels, index=breakdown_df.index,
+                                                                               name="ResponseLevel")],
+                                       observed=True).size().reset_index(name='Count'))
+    total_counts = percent_df.groupby(breakdown_col, observed=True)['Count'].transform('sum')
+    percent_df['Percent'] = (percent_df['Count'] / total_counts * 100).round(1)
+    percent_df["text"] = percent_df['Percent'].astype(str) + "% (" + percent_df['Count'].astype(str) + " students)"
+    return percent_df
+
+
+# --- Cross-tabs ---
+def construct_scores(df_cleaned, matched_questions):
+    """Mean answer per construct for each student (NaN where none was answered), as float32."""
+    return pd.DataFrame({
+        construct: df_cleaned[cols].apply(pd.to_numeric, errors="coerce").mean(axis=1)
+        for construct, cols in matched_questions.items() if cols
+    }, index=df_cleaned.index).astype(np.float32)
+
+def _category_codes(series):
+    """Integer codes and labels for a dimension column; missing values become "Unknown"."""
+    raw_codes, raw_values = pd.factorize(series)  # Hashes each row once; missing values get -1
+    names = [str(value).strip() for value in raw_values] + ["Unknown"]
+    # Numbers (grades) first in numeric order, then text, then Unknown
+    labels = sorted(set(names), key=lambda name: (name == "Unknown", not name.isdigit(),
+                                                   int(name) if name.isdigit() else 0, name))
+    position = {name: i for i, name in enumerate(labels)}
+    lookup = np.array([position[name] for name in names], dtype=np.int16)
+    return lookup[raw_codes], labels  # Code -1 picks the trailing "Unknown"
+
+def crosstab_cube(df_cleaned, dimension_cols, scores):
+    """
+    Sums and counts of every score column for each combination of the dimensions, from a
+    single groupby over their integer codes. dimension_cols is [(label, column), ...].
+    Any pair of dimensions is then a cheap roll-up of this cube (see crosstab), which
+    has one row per combination that occurs, far fewer than there are students.
+    Returns {"categories": {label: [category, ...]}, "cube": DataFrame indexed by the codes}.
+    """
+    frame = {}
+    categories = {}
+    for label, col in dimension_cols:
+        frame[label], categories[label] = _category_codes(df_cleaned[col])
+    frame = pd.DataFrame(frame, index=scores.index)
+    for construct in scores.columns:
+        frame[f"sum:{construct}"] = scores[construct].fillna(0).astype(np.float64)
+        frame[f"n:{construct}"] = scores[construct].notna().astype(np.int32)
+    cube = frame.groupby([label for label, _ in dimension_cols], sort=False).sum()
+    return {"categories": categories, "cube": cube}
+
+def crosstab(cube, row_label, col_label, construct, min_cell=CROSSTAB_MIN_CELL):
+    """
+    (means, counts) pivot tables of one construct for a pair of dimensions. Cells with
+    fewer than min_cell students have their mean suppressed (NaN) so that small groups
+    cannot be singled out or over-read.
+    """
+    totals = cube["cube"].groupby(level=[row_label, col_label])[[f"sum:{construct}", f"n:{construct}"]].sum()
+    counts = totals[f"n:{construct}"].unstack(fill_value=0)
+    means = (totals[f"sum:{construct}"] / totals[f"n:{construct}"].where(totals[f"n:{construct}"] > 0)).unstack()
+    means = means.where(counts >= min_cell)
+    # Codes back to labels, in category order
+    row_names, col_names = cube["categories"][row_label], cube["categories"][col_label]
+    counts, means = counts.sort_index().sort_index(axis=1), means.sort_index().sort_index(axis=1)
+    counts.index = means.index = [row_names[i] for i in counts.index]
+    counts.columns = means.columns = [col_names[i] for i in counts.columns]
+    counts.index.name = means.index.name = row_label
+    counts.columns.name = means.columns.name = col_label
+    return means, counts
+
+
+# --- Filters ---
+# One bitmap (np.packbits: a bit per student) per value of each demographic column, built
+# once per dataset. Any AND/OR combination of selected values is then a few bitwise
+# operations over n/8 bytes, unpacked into the row mask only at the end.
+def filter_index(df_cleaned, dimension_cols):
+    """dimension_cols is [(label, column), ...]. Returns {"n_rows", "bitmaps": {label: {value: bits}}}."""
+    bitmaps = {}
+    for label, col in dimension_cols:
+        codes, names = _category_codes(df_cleaned[col])
+        counts = np.bincount(codes, minlength=len(names))
+        bitmaps[label] = {name: np.packbits(codes == i) for i, name in enumerate(names) if counts[i]}
+    return {"n_rows": len(df_cleaned), "bitmaps": bitmaps}
+
+def filter_mask(index, selections, combine="and"):
+    """
+    Boolean row mask for selections {label: [values]}: the values chosen for one column
+    are OR-ed, and the columns are combined with combine ("and" or "or"). Columns with
+    nothing selected are ignored; returns None when nothing is selected at all.
+    """
+    parts = []
+    for label, values in selections.items():
+        if not values:
+            continue
+        column_bitmaps = index["bitmaps"].get(label, {})
+        bits = [column_bitmaps[value] for value in values if value in column_bitmaps]
+        parts.append(np.bitwise_or.reduce(bits) if bits else np.zeros((index["n_rows"] + 7) // 8, dtype=np.uint8))
+    if not parts:
+        return None
+    combined = (np.bitwise_and if combine == "and" else np.bitwise_or).reduce(parts)
+    return np.unpackbits(combined, count=index["n_rows"]).astype(bool)
+
+def filtered_results(results, mask):
+    """A copy of results restricted to the students in mask, with the headline metrics recomputed."""
+    df_cleaned = results["df_cleaned"][mask]
+    # A cross-tab cube restored from a saved analysis covers every student, so it is left out
+    shared = {name: value for name, value in results.items() if name != "crosstab_cube"}
+    return {**shared, "df_cleaned": df_cleaned, **aggregate_insights(df_cleaned, results["matched_questions"])}
+
+
+# --- Reliability ---
+def _alpha_from_covariance(cov):
+    """Cronbach's alpha, alpha with each item deleted, and corrected item-total r from one covariance matrix."""
+    k = cov.shape[0]
+    item_var = np.diag(cov)
+    total_var = cov.sum()
+    row_sums = cov.sum(axis=1)  # Covariance of each item with the total
+    alpha = k / (k - 1) * (1 - item_var.sum() / total_var) if k > 1 and total_var > 0 else np.nan
+    # Variance of the total without item i, for every i at once
+    rest_var = total_var - 2 * row_sums + item_var
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if k > 2:
+            alpha_deleted = (k - 1) / (k - 2) * (1 - (item_var.sum() - item_var) / rest_var)
+        else:
+            alpha_deleted = np.full(k, np.nan)
+        item_total_r = (row_sums - item_var) / np.sqrt(item_var * rest_var)
+    return alpha, alpha_deleted, item_total_r
+
+def item_reliability(df_cleaned, matched_questions, min_students=RELIABILITY_MIN_STUDENTS):
+    """
+    Item analysis per construct: Cronbach's alpha, alpha if each item were deleted and the
+    corrected item-total correlation (each item against the sum of the others). Uses the
+    students who answered every item of the construct.
+    Returns (summary with one row per construct, items with one row per question).
+    """
+    summary, items = [], []
+    for construct, cols in matched_questions.items():
+        cols = list(dict.fromkeys(cols))
+        if not cols:
+            continue
+        answers = df_cleaned[cols].apply(pd.to_numeric, errors="coerce").dropna().to_numpy(dtype=np.float64)
+        n = answers.shape[0]
+        if len(cols) < 2 or n < min_students:
+            alpha = np.nan
+            alpha_deleted = item_total_r = np.full(len(cols), np.nan)
+        else:
+            alpha, alpha_deleted, item_total_r = _alpha_from_covariance(np.cov(answers, rowvar=False))
+        summary.append({"Construct": construct, "Items": len(cols), "Students": n, "Alpha": alpha})
+        items.extend({"Construct": construct, "Question": col, "Alpha if deleted": deleted, "Item-total r": r}
+                     for col, deleted, r in zip(cols, alpha_deleted, item_total_r))
+    summary = pd.DataFrame(summary, columns=["Construct", "Items", "Students", "Alpha"])
+    items = pd.DataFrame(items, columns=["Construct", "Question", "Alpha if deleted", "Item-total r"])
+    return summary.round(3), items.round(3)
@@ -0,0 +1,1006 @@
+"""PDF report builders for Apnapan Pulse.
+
+These run in the worker pool (see workers.py), so they take everything they
+need as arguments and never touch Streamlit state.
+"""
+import io
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import matplotlib
+matplotlib.use("Agg")  # Worker processes are headless
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+
+from processing import group_averages, response_breakdown
+from telemetry import stage, timed
+
+
+# Helpers to draw pies with matplotlib and return BytesIO for ReportLab
+@timed("matplotlib_chart")
+def pie_image_from_series(series, title):
+    """
+    Generates a more readable pie chart PNG in a BytesIO buffer.
+    It avoids overlapping labels by using a legend for numerous categories.
+    series: pandas.Series of counts (value_counts)
+    title: The title for the chart.
+    returns: BytesIO PNG or None if data is empty.
+    """
+    buf = io.BytesIO()
+    labels = series.index.astype(str).tolist()
+    sizes = series.values.tolist()
+    if not sizes:
+        return None
+
+    # Use a legend if there are more than 4 categories to prevent label overlap
+    show_labels_on_pie = len(labels) <= 4
+
+    # Adjust figure size to accommodate legend if needed
+    figsize = (4.5, 3) if not show_labels_on_pie else (3, 3)
+    fig, ax = plt.subplots(figsize=figsize, dpi=200)
+
+    # Use the default Plotly color sequence to match the demographic overview charts
+    plotly_default_colors = [
+        '#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A',
+        '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52'
+    ]
+    # Cycle through the defined colors if there are more labels than colors
+    colors_map = [plotly_default_colors[i % len(plotly_default_colors)] for i in range(len(labels))]
+
+    wedges, texts, autotexts = ax.pie(
+        sizes,
+        autopct=lambda p: f'{p:.1f}%' if p > 1 else '',  # Only show percentage for slices > 1%
+        startangle=90,
+        colors=colors_map,
+        pctdistance=0.8,  # Move percentage inside the slice
+        labels=labels if show_labels_on_pie else None,
+        labeldistance=1.1,
+        textprops={'fontsize': 7}  # Smaller font for labels on pie
+    )
+
+    # Style the percentage text for better visibility
+    for autotext in autotexts:
+        autotext.set_color('black')
+        autotext.set_weight('bold')
+        autotext.set_fontsize(7)
+
+    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+    ax.set_title(title, fontsize=10, pad=15)
+
+    # If not showing labels on pie, add a legend outside the chart
+    if not show_labels_on_pie:
+        ax.legend(wedges, labels,
+                  title="Categories",
+                  loc="center left",
+                  bbox_to_anchor=(1, 0, 0.5, 1),
+                  fontsize='x-small')
+
+    fig.tight_layout()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    buf.seek(0)
+    return buf
+
+# Function to build the gender and religion pies for the general report (only if columns exist)
+def demographic_pie_buffers(df_cleaned):
+    gender_pie_buf = None
+    religion_pie_buf = None
+    if isinstance(df_cleaned, pd.DataFrame) and not df_cleaned.empty:
+        # Try to find likely columns
+        gender_col = next((c for c in df_cleaned.columns if "gender" in c.lower()), None)
+        religion_col = next((c for c in df_cleaned.columns if "relig" in c.lower()), None)
+
+        if gender_col:
+            gender_counts = df_cleaned[gender_col].astype(str).replace({"nan": "Unknown"}).value_counts(dropna=False)
+            gender_pie_buf = pie_image_from_series(gender_counts, "Gender Distribution")
+
+        if religion_col:
+            religion_counts = df_cleaned[religion_col].astype(str).replace({"nan": "Unknown"}).value_counts(dropna=False)
+            religion_pie_buf = pie_image_from_series(religion_counts, "Religion Distribution")
+    return gender_pie_buf, religion_pie_buf
+
+
+def generate_custom_pdf(school_name, school_logo_bytes, apnapan_logo_bytes, 
+                   selected_construct, selected_charts, chart_options,
+                   df_cleaned, matched_questions, category_averages, 
+                   overall_belonging, date_today, n_students):
+    """Generate a custom PDF report based on user selections with enhanced styling"""
+
+    # The Income Category column is added by processing (see processing.income_categories)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=28, rightMargin=28, topMargin=28, bottomMargin=28)
+    styles = getSampleStyleSheet()
+    
+    # Enhanced custom styles (matching general report)
+    title_style = ParagraphStyle("TitleStyle", parent=styles["Title"], fontSize=20, alignment=1, 
+                                textColor=colors.HexColor("#2E3440"), spaceAfter=8, spaceBefore=0,
+                                fontName="Helvetica-Bold")
+    subtitle_style = ParagraphStyle("SubtitleStyle", parent=styles["Title"], fontSize=16, alignment=1, 
+                                textColor=colors.HexColor("#5E81AC"), spaceAfter=6)
+    small_grey = ParagraphStyle("SmallGrey", parent=styles["Normal"], fontSize=9, alignment=2, 
+                            textColor=colors.HexColor("#666"))
+    header_style = ParagraphStyle("HeaderStyle", parent=styles["Heading2"], fontSize=14, alignment=0, 
+                                textColor=colors.HexColor("#2E3440"), spaceBefore=20, spaceAfter=10,
+                                fontName="Helvetica-Bold", borderWidth=1, borderColor=colors.HexColor("#E5E7EB"),
+                                borderPadding=5, backColor=colors.HexColor("#F9FAFB"))
+    subheader_style = ParagraphStyle("SubHeaderStyle", parent=styles["Heading3"], fontSize=12, alignment=0, 
+                                    textColor=colors.HexColor("#374151"), spaceBefore=12, spaceAfter=8,
+                                    fontName="Helvetica-Bold")
+    note_style = ParagraphStyle("NoteStyle", parent=styles["Normal"], fontSize=10, textColor=colors.HexColor("#4B5563"))
+    highlight_style = ParagraphStyle("HighlightStyle", parent=styles["Normal"], fontSize=10, 
+                                    textColor=colors.HexColor("#1F2937"), backColor=colors.HexColor("#F3F4F6"),
+                                    borderWidth=1, borderColor=colors.HexColor("#D1D5DB"), borderPadding=8,
+                                    spaceAfter=10, spaceBefore=10)
+    
+    story = []
+    
+    # --- Enhanced PDF Header ---
+    apnapan_logo_img = Paragraph(" ", styles['Normal'])
+    if apnapan_logo_bytes:
+        try:
+            apnapan_logo_img = Image(io.BytesIO(apnapan_logo_bytes), width=1*inch, height=1*inch)
+        except Exception:
+            pass
+
+    school_logo_img = Paragraph(" ", styles['Normal'])
+    if school_logo_bytes:
+        try:
+            school_logo_img = Image(io.BytesIO(school_logo_bytes), width=1*inch, height=1*inch)
+        except Exception:
+            pass
+
+    # Enhanced center content for custom report
+    center_content = [
+        Paragraph("Apnapan Custom Report", title_style),
+        Paragraph(f"Focus Area: {selected_construct}", subtitle_style),
+        Paragraph(school_name, header_style)
+    ]
+
+    header_table = Table([[apnapan_logo_img, center_content, school_logo_img]], colWidths=[1.2*inch, 5.6*inch, 1.2*inch])
+    header_table.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+        ('ALIGN', (1, 0), (1, 0), 'CENTER'),
+        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
+        ('LINEBELOW', (0, 0), (-1, -1), 2, colors.HexColor("#E5E7EB")),
+        ('TOPPADDING', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+    ]))
+    story.append(header_table)
+    
+    # Date and report info
+    report_info = f"Generated on: {date_today} | Focus: {selected_construct} Analysis"
+    story.append(Paragraph(report_info, small_grey))
+    story.append(Spacer(1, 20))
+
+    # --- Executive Summary for Custom Report ---
+    story.append(Paragraph("Executive Summary", header_style))
+    
+    # Get construct-specific data
+    construct_score = category_averages.get(selected_construct, 0)
+    construct_questions = matched_questions.get(selected_construct, [])
+    
+    # Determine performance level for selected construct
+    if construct_score >= 4.0:
+        performance_level = "Excellent"
+        performance_color = "#10B981"
+    elif construct_score >= 3.5:
+        performance_level = "Good"
+        performance_color = "#3B82F6"
+    elif construct_score >= 3.0:
+        performance_level = "Fair"
+        performance_color = "#F59E0B"
+    else:
+        performance_level = "Needs Attention"
+        performance_color = "#EF4444"
+
+    summary_text = f"""
+    This custom report provides an in-depth analysis of <b>{selected_construct}</b> at {school_name}. 
+    The report includes {len(selected_charts)} selected visualizations to understand how this 
+    aspect of belonging varies across different student groups.
+    <br/><br/>
+    <b>Key Findings for {selected_construct}:</b><br/>
+    • Current score: <b>{construct_score:.2f}/5.0</b> ({performance_level})<br/>
+    • Based on responses from <b>{n_students}</b> students<br/>
+    • Analysis includes {len(construct_questions)} related survey questions<br/>
+    • Selected {len(selected_charts)} chart(s) for demographic breakdown analysis
+    """
+    story.append(Paragraph(summary_text, highlight_style))
+    story.append(Spacer(1, 15))
+
+    # --- Enhanced Key Metrics for Selected Construct ---
+    story.append(Paragraph(f"{selected_construct} - Key Metrics", header_style))
+    
+    # Enhanced bubble function (same as general report)
+    def enhanced_bubble(text, bg_hex, text_color="#FFFFFF"):
+        return Table(
+            [[Paragraph(text, ParagraphStyle("bub", fontSize=12, alignment=1, 
+                                        textColor=colors.HexColor(text_color),
+                                        leading=16))]],
+            colWidths=[2.4*inch], 
+            rowHeights=[1.1*inch],
+            style=TableStyle([
+                ("BACKGROUND", (0,0), (-1,-1), colors.HexColor(bg_hex)),
+                ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+                ("ALIGN", (0,0), (-1,-1), "CENTER"),
+                ("ROUNDEDCORNERS", [5, 5, 5, 5]),
+                ("LINEWIDTH", (0,0), (-1,-1), 2),
+                ("LINECOLOR", (0,0), (-1,-1), colors.HexColor("#E5E7EB")),
+            ])
+        )
+
+    # Key metrics for selected construct
+    construct_txt = f"<b>{selected_construct} Score</b><br/><br/><font size=20 color='{performance_color}'>{construct_score:.2f}</font><br/><font size=10>out of 5.0 ({performance_level})</font>"
+    n_txt = f"<b>Students Surveyed</b><br/><br/><font size=20>{n_students}</font><br/><font size=10>participants</font>"
+    
+    # Compare to overall belonging
+    comparison = "above" if construct_score > overall_belonging else "below" if construct_score < overall_belonging else "equal to"
+    comparison_txt = f"<b>vs Overall Belonging</b><br/><br/><font size=16>{comparison_color(construct_score, overall_belonging)}</font><br/><font size=10>{comparison} average ({overall_belonging:.2f})</font>"
+    
+    metrics_row = Table([[enhanced_bubble(construct_txt, "#F8FAFC", "#1F2937"), 
+                        enhanced_bubble(n_txt, "#F0F9FF", "#1F2937")]],
+                    colWidths=[3.2*inch, 3.2*inch])
+    story.append(metrics_row)
+    story.append(Spacer(1, 15))
+    
+    # Survey questions for this construct
+    if construct_questions:
+        story.append(Paragraph("Survey Questions Analyzed", subheader_style))
+        questions_text = ""
+        for i, question in enumerate(construct_questions[:5], 1):  # Limit to first 5 questions
+            questions_text += f"{i}. {question}<br/>"
+        if len(construct_questions) > 5:
+            questions_text += f"<i>... and {len(construct_questions) - 5} more questions</i>"
+        
+        story.append(Paragraph(questions_text, note_style))
+        story.append(Spacer(1, 20))
+
+    # --- Charts Section ---
+    story.append(Paragraph("Demographic Analysis Charts", header_style))
+    story.append(Paragraph(f"The following {len(selected_charts)} chart(s) show how {selected_construct} varies across different student groups:", note_style))
+    story.append(Spacer(1, 15))
+    
+    # Add selected charts with enhanced presentation
+    chart_count = 0
+    for i, chart_name in enumerate(selected_charts, 1):
+        chart_info = chart_options[chart_name]
+        chart_img = None
+        
+        # Generate chart based on type
+        if chart_info["type"] == "demographic_pie":
+            chart_img = generate_demographic_pie_for_pdf(df_cleaned, chart_info["keywords"], chart_name)
+        
+        elif chart_info["type"] == "construct_vs_demographic":
+            chart_img = generate_bar_chart_for_pdf(
+                df_cleaned, construct_questions, chart_info["keywords"], 
+                chart_name, chart_info["demographic"]
+            )
+        
+        elif chart_info["type"] == "percentage_breakdown":
+            chart_img = generate_percentage_breakdown_for_pdf(
+                df_cleaned, construct_questions, chart_info["keywords"], chart_name
+            )
+        
+        # Add chart to PDF with enhanced styling
+        if chart_img:
+            # Chart number and title
+            chart_header = f"Chart {i}: {chart_name}"
+            story.append(Paragraph(chart_header, subheader_style))
+            story.append(Spacer(1, 6))
+            
+            try:
+                # Adjust image size and add border
+                if chart_info["type"] == "demographic_pie":
+                    chart_image = Image(chart_img, width=3.5*inch, height=3*inch)
+                else:
+                    chart_image = Image(chart_img, width=6.5*inch, height=4.2*inch)
+                
+                # Create bordered chart container
+                chart_container = Table([[chart_image]], colWidths=[7*inch])
+                chart_container.setStyle(TableStyle([
+                    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+                    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+                    ('BOX', (0,0), (-1,-1), 1, colors.HexColor("#E5E7EB")),
+                    ('TOPPADDING', (0,0), (-1,-1), 10),
+                    ('BOTTOMPADDING', (0,0), (-1,-1), 10),
+                    ('LEFTPADDING', (0,0), (-1,-1), 10),
+                    ('RIGHTPADDING', (0,0), (-1,-1), 10),
+                ]))
+                story.append(chart_container)
+                
+                # Add chart description
+                story.append(Spacer(1, 8))
+                story.append(Paragraph(chart_info["description"], note_style))
+                story.append(Spacer(1, 20))
+                chart_count += 1
+                
+            except Exception as e:
+                error_msg = f"Chart could not be generated: {chart_name}"
+                story.append(Paragraph(error_msg, ParagraphStyle("Error", parent=note_style, 
+                                                                textColor=colors.HexColor("#EF4444"))))
+                story.append(Spacer(1, 15))
+
+    # --- Enhanced Insights Section ---
+    if chart_count > 0:
+        story.append(Paragraph("Key Insights & Observations", header_style))
+        
+        # Performance context
+        performance_context = ""
+        if construct_score >= 4.0:
+            performance_context = f"{selected_construct} shows excellent performance, indicating strong student experiences in this area."
+        elif construct_score >= 3.5:
+            performance_context = f"{selected_construct} shows good performance with room for targeted improvements."
+        elif construct_score >= 3.0:
+            performance_context = f"{selected_construct} shows fair performance and would benefit from focused interventions."
+        else:
+            performance_context = f"{selected_construct} requires immediate attention with comprehensive improvement strategies."
+        
+        insights_text = f"""
+        <b>Performance Analysis:</b><br/>
+        {performance_context}
+        <br/><br/>
+        <b>Chart Analysis:</b><br/>
+        • This report includes {chart_count} visualization(s) focusing on {selected_construct}<br/>
+        • Charts reveal how different demographic groups experience this aspect of belonging<br/>
+        • Look for patterns in scores across gender, grade level, and other demographic factors
+        <br/><br/>
+        <b>Survey Coverage:</b><br/>
+        • Analysis based on {len(construct_questions)} survey question(s)<br/>
+        • {n_students} student responses analyzed<br/>
+        • Current score: {construct_score:.2f}/5.0 compared to overall belonging score of {overall_belonging:.2f}/5.0
+        """
+        
+        story.append(Paragraph(insights_text, highlight_style))
+        story.append(Spacer(1, 20))
+
+    # --- Enhanced Recommendations ---
+    story.append(Paragraph("Targeted Recommendations", header_style))
+    
+    recommendations = []
+    
+    # Performance-based recommendations
+    if construct_score < 3.0:
+        recommendations.append(f"<b>Urgent Priority:</b> {selected_construct} requires immediate intervention (score: {construct_score:.2f})")
+        recommendations.append(f"<b>Root Cause Analysis:</b> Conduct focus groups to understand why {selected_construct} scores are low")
+    elif construct_score < 3.5:
+        recommendations.append(f"<b>Improvement Focus:</b> Develop targeted strategies to enhance {selected_construct}")
+        recommendations.append(f"<b>Best Practice Research:</b> Study schools with higher {selected_construct} scores")
+    else:
+        recommendations.append(f"<b>Maintain Excellence:</b> Continue successful practices that support {selected_construct}")
+        recommendations.append(f"<b>Share Success:</b> Document and share what's working well in {selected_construct}")
+    
+    # Chart-specific recommendations
+    recommendations.extend([
+        "<b>Demographic Analysis:</b> Use the charts to identify which student groups need additional support",
+        f"<b>Targeted Interventions:</b> Design specific programs addressing {selected_construct} gaps",
+        "<b>Progress Monitoring:</b> Resurvey in 6 months to measure improvement in this focus area",
+        "<b>Staff Development:</b> Train educators on strategies that enhance student " + selected_construct.lower()
+    ])
+
+    rec_text = "<br/>• ".join(recommendations)
+    story.append(Paragraph(f"• {rec_text}", note_style))
+    story.append(Spacer(1, 20))
+
+    # --- Customized Food for Thought ---
+    story.append(Paragraph("Reflection Questions", header_style))
+    
+    custom_questions = [
+        f"Which demographic groups show the strongest/weakest {selected_construct} scores?",
+        f"What specific school practices might be influencing {selected_construct} outcomes?",
+        f"How does {selected_construct} connect to other aspects of student belonging?",
+        f"What barriers might prevent students from experiencing strong {selected_construct}?",
+        f"Which interventions could most effectively improve {selected_construct} scores?",
+        f"How can high-performing groups in {selected_construct} mentor others?"
+    ]
+    
+    bullets = "<br/>".join([f"• {question}" for question in custom_questions])
+    story.append(Paragraph(bullets, note_style))
+    story.append(Spacer(1, 20))
+
+    # --- Enhanced Footer ---
+    footer_text = f"""
+    <br/><br/>
+    <font size=8 color='#6B7280'>
+    This custom report was generated by the Apnapan Pulse platform focusing on {selected_construct}. 
+    For additional analysis or support with action planning, please contact your Apnapan representative.
+    <br/>
+    Custom Report ID: AP-CUSTOM-{datetime.now().strftime('%Y%m%d')}-{selected_construct[:3].upper()}-{school_name[:3].upper()}
+    </font>
+    """
+    story.append(Paragraph(footer_text, ParagraphStyle("Footer", parent=styles["Normal"], 
+                                                    fontSize=8, alignment=1, 
+                                                    textColor=colors.HexColor("#6B7280"))))
+
+    with stage("pdf_build") as record:
+        doc.build(story)
+        record["nbytes"] = buffer.tell()
+    buffer.seek(0)
+    return buffer
+
+# Function to list the charts a custom report can include for the selected construct
+def custom_chart_options(selected_construct):
+    return {
+        "Gender Distribution": {
+            "type": "demographic_pie",
+            "description": "Pie chart showing gender distribution of respondents",
+            "keywords": ["gender", "What gender do you use"]
+        },
+        "Religion Distribution": {
+            "type": "demographic_pie", 
+            "description": "Pie chart showing religion distribution of respondents",
+            "keywords": ["religion"]
+        },
+        "Grade Distribution": {
+            "type": "demographic_pie",
+            "description": "Pie chart showing grade distribution of respondents",
+            "keywords": ["grade", "Which grade are you in"]
+        },
+        f"{selected_construct} by Gender": {
+            "type": "construct_vs_demographic",
+            "description": f"Bar chart showing {selected_construct} scores by gender",
+            "demographic": "Gender",
+            "keywords": ["gender", "What gender do you use"]
+        },
+        f"{selected_construct} by Grade": {
+            "type": "construct_vs_demographic", 
+            "description": f"Bar chart showing {selected_construct} scores by grade",
+            "demographic": "Grade",
+            "keywords": ["grade", "Which grade are you in"]
+        },
+        f"{selected_construct} by Religion": {
+            "type": "construct_vs_demographic",
+            "description": f"Bar chart showing {selected_construct} scores by religion", 
+            "demographic": "Religion",
+            "keywords": ["religion"]
+        },
+        f"{selected_construct} by Income Status": {
+            "type": "construct_vs_demographic",
+            "description": f"Bar chart showing {selected_construct} scores by income status",
+            "demographic": "Income Status",
+            "keywords": ["Income Category"]
+        },
+        f"{selected_construct} by Ethnicity": {
+            "type": "construct_vs_demographic",
+            "description": f"Bar chart showing {selected_construct} scores by ethnicity",
+            "demographic": "Ethnicity",
+            "keywords": ["ethnicity_cleaned"]
+        },
+        f"{selected_construct} by Health Condition": {
+            "type": "construct_vs_demographic",
+            "description": f"Bar chart showing {selected_construct} scores by health condition",
+            "demographic": "Health Condition",
+            "keywords": ["disability", "health condition"]
+        },
+        f"Gender Breakdown (Percentage)": {
+            "type": "percentage_breakdown",
+            "description": f"Stacked bar chart showing percentage breakdown of {selected_construct} responses by gender",
+            "keywords": ["gender", "What gender do you use"]
+        }
+    }
+
+# Helper function for comparison color
+def comparison_color(construct_score, overall_score):
+    """Return colored text showing comparison to overall score"""
+    if construct_score > overall_score:
+        return f"<font color='#10B981'>+{(construct_score - overall_score):.2f}</font>"
+    elif construct_score < overall_score:
+        return f"<font color='#EF4444'>{(construct_score - overall_score):.2f}</font>"
+    else:
+        return f"<font color='#6B7280'>±0.00</font>"
+    
+@timed("matplotlib_chart")
+def generate_demographic_pie_for_pdf(df_cleaned, keywords, title):
+    """Generate demographic pie chart as BytesIO for PDF"""
+    if df_cleaned is None or df_cleaned.empty:
+        return None
+    
+    # Find matching column
+    matched_col = next((col for col in df_cleaned.columns 
+                    if any(k.lower() in col.lower() for k in keywords)), None)
+    
+    if not matched_col:
+        return None
+    
+    # Create pie chart data
+    counts = df_cleaned[matched_col].astype(str).replace({"nan": "Unknown"}).value_counts(dropna=False)
+    
+    if counts.empty:
+        return None
+    
+    # Generate pie chart using matplotlib
+    buf = io.BytesIO()
+    labels = counts.index.astype(str).tolist()
+    sizes = counts.values.tolist()
+    
+    # Use Plotly color sequence
+    plotly_colors = ['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A',
+                    '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52']
+    colors_map = [plotly_colors[i % len(plotly_colors)] for i in range(len(labels))]
+    
+    fig, ax = plt.subplots(figsize=(4, 3), dpi=200)
+    wedges, texts, autotexts = ax.pie(
+        sizes,
+        labels=labels if len(labels) <= 4 else None,
+        autopct=lambda p: f'{p:.1f}%' if p > 1 else '',
+        startangle=90,
+        colors=colors_map,
+        textprops={'fontsize': 8}
+    )
+    
+    # Add legend if too many categories
+    if len(labels) > 4:
+        ax.legend(wedges, labels, title="Categories", loc="center left", 
+                bbox_to_anchor=(1, 0, 0.5, 1), fontsize='x-small')
+    
+    ax.set_title(title, fontsize=10, pad=15)
+    ax.axis('equal')
+    
+    fig.tight_layout()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    buf.seek(0)
+    return buf
+
+@timed("matplotlib_chart")
+def generate_bar_chart_for_pdf(df_cleaned, construct_keywords, demo_keywords, title, demo_label):
+    """Generate bar chart showing construct scores by demographic"""
+    if df_cleaned is None or df_cleaned.empty:
+        return None
+    
+    # Find construct column
+    construct_col = None
+    for col in df_cleaned.columns:
+        if any(k.lower() in col.lower() for k in construct_keywords):
+            construct_col = col
+            break
+    
+    # Find demographic column
+    demo_col = None
+    for col in df_cleaned.columns:
+        if any(k.lower() in col.lower() for k in demo_keywords):
+            demo_col = col
+            break
+    
+    if not construct_col or not demo_col:
+        return None
+    
+    # Calculate averages with their bootstrap intervals (same as the Visualisation charts)
+    group_avg = group_averages(df_cleaned, demo_col, construct_col, demo_label)
+    if group_avg.empty:
+        return None
+    group_avg[demo_col] = group_avg[demo_col].astype(str)
+    
+    # Generate bar chart
+    buf = io.BytesIO()
+    fig, ax = plt.subplots(figsize=(6, 4), dpi=200)
+    
+    # Groups too small for an interval (NaN) get no error bar; their labels sit on the bar
+    label_y = group_avg['CI_High'].fillna(group_avg['AvgScore'])
+    errors = [(group_avg['AvgScore'] - group_avg['CI_Low']).fillna(0).to_numpy(), (label_y - group_avg['AvgScore']).to_numpy()]
+    bars = ax.bar(group_avg[demo_col], group_avg['AvgScore'], yerr=errors, capsize=4,
+                error_kw={'elinewidth': 1, 'ecolor': '#333333'},
+                color=['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A'][:len(group_avg)])
+    
+    # Add value labels above the error bars; * marks a group that differs from the other students
+    for i, (bar, row, top) in enumerate(zip(bars, group_avg.itertuples(), label_y)):
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., top + 0.05,
+                f'{height:.2f}{" *" if row.Significant else ""}\n(N={row.Count})',
+                ha='center', va='bottom', fontsize=8, weight='bold')
+    
+    ax.set_xlabel(demo_label, fontsize=10)
+    ax.set_ylabel('Average Score', fontsize=10)
+    ax.set_title(title, fontsize=11, pad=15)
+    ax.set_ylim(0, label_y.max() + 0.6)
+    
+    plt.xticks(rotation=45 if len(group_avg) > 3 else 0)
+    fig.text(0.01, 0.01, "Error bars: 95% confidence interval. * differs from the other students.",
+             fontsize=6, color='#555555')
+    fig.tight_layout()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    buf.seek(0)
+    return buf
+
+@timed("matplotlib_chart")
+def generate_percentage_breakdown_for_pdf(df_cleaned, construct_keywords, demo_keywords, title):
+    """Generate percentage breakdown stacked bar chart"""
+    if df_cleaned is None or df_cleaned.empty:
+        return None
+    
+    # Find columns
+    construct_col = None
+    for col in df_cleaned.columns:
+        if any(k.lower() in col.lower() for k in construct_keywords):
+            construct_col = col
+            break
+    
+    demo_col = None
+    for col in df_cleaned.columns:
+        if any(k.lower() in col.lower() for k in demo_keywords):
+            demo_col = col
+            break
+    
+    if not construct_col or not demo_col:
+        return None
+    
+    # Calculate percentages (bucketed on the numeric answers, same as the Visualisation chart)
+    percent_df = response_breakdown(df_cleaned, demo_col, construct_col, keep_unknown=False)
+    if percent_df is None:
+        return None
+    
+    # Create stacked bar chart
+    buf = io.BytesIO()
+    fig, ax = plt.subplots(figsize=(6, 4), dpi=200)
+    
+    # Pivot data for stacked bar
+    pivot_df = percent_df.pivot(index=demo_col, columns='ResponseLevel', values='Percent').fillna(0)
+    pivot_df.index = pivot_df.index.astype(str)
+    
+    # Define colors for response levels
+    color_map = {
+        "Agree": "#4CAF50",
+        "Neutral": "#FFC107", 
+        "Disagree": "#F44336",
+        "Unknown": "#9E9E9E"
+    }
+    
+    # Plot stacked bars
+    bottom = None
+    for response_level in ["Agree", "Neutral", "Disagree", "Unknown"]:
+        if response_level in pivot_df.columns:
+            values = pivot_df[response_level].to_numpy()
+            bars = ax.bar(pivot_df.index, values, 
+                        bottom=bottom, label=response_level, 
+                        color=color_map[response_level])
+            
+            # Percentage labels on the segments over 5%, all bars of the level in one call
+            ax.bar_label(bars, labels=np.where(values > 5, np.char.mod('%.1f%%', values), ''),
+                         label_type='center', fontsize=7, weight='bold')
+            
+            bottom = values if bottom is None else bottom + values
+    
+    ax.set_xlabel(demo_col.replace('_', ' ').title(), fontsize=10)
+    ax.set_ylabel('Percentage (%)', fontsize=10)
+    ax.set_title(title, fontsize=11, pad=15)
+    ax.legend(title="Response Level", bbox_to_anchor=(1.05, 1), loc='upper left')
+    ax.set_ylim(0, 100)
+    
+    fig.tight_layout()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    buf.seek(0)
+    return buf
+def generate_pdf(school_name, school_logo_bytes, apnapan_logo_bytes, df_cleaned, category_averages,
+                 overall_belonging, highest_area, lowest_area, date_today, n_students, reliability=None):
+    # reliability: optional (summary, items) from processing.item_reliability, adds a reliability section
+    gender_pie_buf, religion_pie_buf = demographic_pie_buffers(df_cleaned)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=28, rightMargin=28, topMargin=28, bottomMargin=28)
+    styles = getSampleStyleSheet()
+
+    # Enhanced custom styles
+    title_style = ParagraphStyle("TitleStyle", parent=styles["Title"], fontSize=20, alignment=1, 
+                                textColor=colors.HexColor("#2E3440"), spaceAfter=8, spaceBefore=0,
+                                fontName="Helvetica-Bold")
+    subtitle_style = ParagraphStyle("SubtitleStyle", parent=styles["Title"], fontSize=16, alignment=1, 
+                                textColor=colors.HexColor("#5E81AC"), spaceAfter=6)
+    small_grey = ParagraphStyle("SmallGrey", parent=styles["Normal"], fontSize=9, alignment=2, 
+                            textColor=colors.HexColor("#666"))
+    header_style = ParagraphStyle("HeaderStyle", parent=styles["Heading2"], fontSize=14, alignment=0, 
+                                textColor=colors.HexColor("#2E3440"), spaceBefore=20, spaceAfter=10,
+                                fontName="Helvetica-Bold", borderWidth=1, borderColor=colors.HexColor("#E5E7EB"),
+                                borderPadding=5, backColor=colors.HexColor("#F9FAFB"))
+    subheader_style = ParagraphStyle("SubHeaderStyle", parent=styles["Heading3"], fontSize=12, alignment=0, 
+                                    textColor=colors.HexColor("#374151"), spaceBefore=12, spaceAfter=8,
+                                    fontName="Helvetica-Bold")
+    note_style = ParagraphStyle("NoteStyle", parent=styles["Normal"], fontSize=10, textColor=colors.HexColor("#4B5563"))
+    highlight_style = ParagraphStyle("HighlightStyle", parent=styles["Normal"], fontSize=10, 
+                                    textColor=colors.HexColor("#1F2937"), backColor=colors.HexColor("#F3F4F6"),
+                                    borderWidth=1, borderColor=colors.HexColor("#D1D5DB"), borderPadding=8,
+                                    spaceAfter=10, spaceBefore=10)
+
+    story = []
+
+    # --- Enhanced PDF Header ---
+    apnapan_logo_img = Paragraph(" ", styles['Normal'])
+    if apnapan_logo_bytes:
+        try:
+            apnapan_logo_img = Image(io.BytesIO(apnapan_logo_bytes), width=1*inch, height=1*inch)
+        except Exception:
+            pass
+
+    school_logo_img = Paragraph(" ", styles['Normal'])
+    if school_logo_bytes:
+        try:
+            school_logo_img = Image(io.BytesIO(school_logo_bytes), width=1*inch, height=1*inch)
+        except Exception:
+            pass
+
+    # Enhanced center content
+    center_content = [
+        Paragraph("Apnapan Pulse Report", title_style),
+        Paragraph("School Belonging Assessment", subtitle_style),
+        Paragraph(school_name, header_style)
+    ]
+
+    header_table = Table([[apnapan_logo_img, center_content, school_logo_img]], colWidths=[1.2*inch, 5.6*inch, 1.2*inch])
+    header_table.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+        ('ALIGN', (1, 0), (1, 0), 'CENTER'),
+        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
+        ('LINEBELOW', (0, 0), (-1, -1), 2, colors.HexColor("#E5E7EB")),
+        ('TOPPADDING', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+    ]))
+    story.append(header_table)
+    
+    # Date and report info
+    report_info = f"Generated on: {date_today} | Academic Year: {datetime.now().year}-{datetime.now().year + 1}"
+    story.append(Paragraph(report_info, small_grey))
+    story.append(Spacer(1, 20))
+
+    # --- Executive Summary Section ---
+    story.append(Paragraph("Executive Summary", header_style))
+    
+    # Calculate additional metrics for summary
+    response_rate = (n_students / n_students * 100) if n_students > 0 else 0  # Placeholder - replace with actual invited vs responded
+    avg_score = overall_belonging or 0
+    
+    # Determine performance level
+    if avg_score >= 4.0:
+        performance_level = "Excellent"
+        performance_color = "#10B981"
+    elif avg_score >= 3.5:
+        performance_level = "Good"
+        performance_color = "#3B82F6"
+    elif avg_score >= 3.0:
+        performance_level = "Fair"
+        performance_color = "#F59E0B"
+    else:
+        performance_level = "Needs Attention"
+        performance_color = "#EF4444"
+
+    summary_text = f"""
+    This report presents the results of the Apnapan Pulse survey conducted at {school_name}. 
+    The survey assessed students' sense of belonging across multiple dimensions. 
+    <br/><br/>
+    <b>Key Findings:</b><br/>
+    • <b>{n_students}</b> students participated in the survey<br/>
+    • Overall belonging score: <b>{avg_score:.2f}/5.0</b> ({performance_level})<br/>
+    • Strongest area: <b>{highest_area if isinstance(highest_area, str) else 'Not determined'}</b><br/>
+    • Area for improvement: <b>{lowest_area if isinstance(lowest_area, str) else 'Not determined'}</b>
+    """
+    story.append(Paragraph(summary_text, highlight_style))
+    story.append(Spacer(1, 15))
+
+    # --- Enhanced Key Metrics Section ---
+    story.append(Paragraph("Key Metrics Overview", header_style))
+    
+    # Enhanced bubble function with better styling
+    def enhanced_bubble(text, bg_hex, text_color="#FFFFFF"):
+        return Table(
+            [[Paragraph(text, ParagraphStyle("bub", fontSize=12, alignment=1, 
+                                        textColor=colors.HexColor(text_color),
+                                        leading=16))]],
+            colWidths=[2.4*inch], 
+            rowHeights=[1.1*inch],
+            style=TableStyle([
+                ("BACKGROUND", (0,0), (-1,-1), colors.HexColor(bg_hex)),
+                ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+                ("ALIGN", (0,0), (-1,-1), "CENTER"),
+                ("ROUNDEDCORNERS", [5, 5, 5, 5]),
+                ("LINEWIDTH", (0,0), (-1,-1), 2),
+                ("LINECOLOR", (0,0), (-1,-1), colors.HexColor("#E5E7EB")),
+            ])
+        )
+
+    # Row 1: Overall metrics
+    score_txt = f"<b>Overall Belonging Score</b><br/><br/><font size=20 color='{performance_color}'>{avg_score:.2f}</font><br/><font size=10>out of 5.0 ({performance_level})</font>"
+    n_txt = f"<b>Students Surveyed</b><br/><br/><font size=20>{n_students}</font><br/><font size=10>participants</font>"
+
+    row1 = Table([[enhanced_bubble(score_txt, "#F8FAFC", "#1F2937"), enhanced_bubble(n_txt, "#F0F9FF", "#1F2937")]],
+                colWidths=[3.2*inch, 3.2*inch])
+    story.append(row1)
+    story.append(Spacer(1, 12))
+
+    # Row 2: Strongest/Weakest areas
+    strong_label = (highest_area if isinstance(highest_area, str) else "Not determined")
+    strong_val = float(category_averages.get(strong_label, 0)) if strong_label in category_averages else 0.0
+    weak_label = (lowest_area if isinstance(lowest_area, str) else "Not determined")
+    weak_val = float(category_averages.get(weak_label, 0)) if weak_label in category_averages else 0.0
+
+    strong_txt = f"<b>Strongest Area</b><br/><br/><font size=14>{strong_label}</font><br/><font size=16 color='#10B981'>{strong_val:.2f}</font>"
+    weak_txt = f"<b>Area for Improvement</b><br/><br/><font size=14>{weak_label}</font><br/><font size=16 color='#EF4444'>{weak_val:.2f}</font>"
+    
+    row2 = Table([[enhanced_bubble(strong_txt, "#ECFDF5", "#1F2937"), enhanced_bubble(weak_txt, "#FEF2F2", "#1F2937")]],
+                colWidths=[3.2*inch, 3.2*inch])
+    story.append(row2)
+    story.append(Spacer(1, 20))
+
+    # --- Enhanced Demographics and Constructs Section ---
+    story.append(Paragraph("Demographics & Construct Analysis", header_style))
+
+    # Left side: Demographics with improved layout
+    left_content = []
+    left_content.append(Paragraph("Student Demographics", subheader_style))
+    
+    demographic_charts = []
+    if gender_pie_buf:
+        demographic_charts.append(Image(gender_pie_buf, width=2.6*inch, height=2.3*inch))
+    if religion_pie_buf:
+        demographic_charts.append(Image(religion_pie_buf, width=2.6*inch, height=2.3*inch))
+    
+    if demographic_charts:
+        for chart in demographic_charts:
+            left_content.append(chart)
+            left_content.append(Spacer(1, 8))
+    else:
+        left_content.append(Paragraph("Demographic charts will be displayed when data is available.", 
+                                    note_style))
+
+    # Right side: Enhanced constructs table
+    constructs_data = [["Construct", "Score", "Level"]]
+    if category_averages:
+        for construct, score in category_averages.items():
+            score_val = float(score)
+            if score_val >= 4.0:
+                level = "Strong"
+            elif score_val >= 3.5:
+                level = "Good"
+            elif score_val >= 3.0:
+                level = "Fair"
+            else:
+                level = "Needs Work"
+            constructs_data.append([construct, f"{score_val:.2f}", level])
+    else:
+        constructs_data.append(["-", "-", "-"])
+
+    constructs_tbl = Table(constructs_data, colWidths=[1.8*inch, 0.7*inch, 0.8*inch])
+    constructs_tbl.setStyle(TableStyle([
+        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#374151")),
+        ("TEXTCOLOR", (0,0), (-1,0), colors.white),
+        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+        ("FONTSIZE", (0,0), (-1,0), 10),
+        ("ALIGN", (0,0), (-1,-1), "CENTER"),
+        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+        ("GRID", (0,0), (-1,-1), 1, colors.HexColor("#E5E7EB")),
+        ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, colors.HexColor("#F9FAFB")]),
+        ("FONTSIZE", (0,1), (-1,-1), 9),
+        ("TOPPADDING", (0,0), (-1,-1), 8),
+        ("BOTTOMPADDING", (0,0), (-1,-1), 8),
+    ]))
+
+    right_content = []
+    right_content.append(Paragraph("Construct Scores Summary", subheader_style))
+    right_content.append(Spacer(1, 8))
+    right_content.append(constructs_tbl)
+
+    # Legend for score levels
+    legend_text = """
+    <b>Score Interpretation:</b><br/>
+    4.0+ : Strong | 3.5-3.9 : Good<br/>
+    3.0-3.4 : Fair | &lt;3.0 : Needs Work
+    """
+    right_content.append(Spacer(1, 10))
+    right_content.append(Paragraph(legend_text, ParagraphStyle("Legend", parent=note_style, 
+                                                            fontSize=8, textColor=colors.HexColor("#6B7280"))))
+
+    # Two-column layout with better spacing
+    demographics_layout = Table([[left_content, right_content]], colWidths=[3.8*inch, 2.6*inch])
+    demographics_layout.setStyle(TableStyle([
+        ("VALIGN", (0,0), (-1,-1), "TOP"),
+        ("LEFTPADDING", (0,0), (-1,-1), 5),
+        ("RIGHTPADDING", (0,0), (-1,-1), 5),
+    ]))
+    story.append(demographics_layout)
+    story.append(Spacer(1, 25))
+
+    # --- Reliability Section (optional) ---
+    if reliability is not None:
+        summary, items = reliability
+        story.append(Paragraph("Survey Reliability", header_style))
+        reliability_data = [["Construct", "Questions", "Students", "Alpha", "Reliability"]]
+        for row in summary.itertuples(index=False):
+            if pd.isna(row.Alpha):
+                alpha_text, level = "-", "Not enough data"
+            else:
+                alpha_text = f"{row.Alpha:.2f}"
+                level = ("Good" if row.Alpha >= 0.8 else "Acceptable" if row.Alpha >= 0.7
+                         else "Questionable" if row.Alpha >= 0.6 else "Poor")
+            reliability_data.append([row.Construct, str(row.Items), str(row.Students), alpha_text, level])
+        reliability_tbl = Table(reliability_data, colWidths=[2.2*inch, 0.9*inch, 0.9*inch, 0.8*inch, 1.3*inch])
+        reliability_tbl.setStyle(TableStyle([
+            ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#374151")),
+            ("TEXTCOLOR", (0,0), (-1,0), colors.white),
+            ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+            ("FONTSIZE", (0,0), (-1,0), 10),
+            ("ALIGN", (0,0), (-1,-1), "CENTER"),
+            ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+            ("GRID", (0,0), (-1,-1), 1, colors.HexColor("#E5E7EB")),
+            ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, colors.HexColor("#F9FAFB")]),
+            ("FONTSIZE", (0,1), (-1,-1), 9),
+        ]))
+        story.append(reliability_tbl)
+        story.append(Spacer(1, 8))
+
+        # Questions that pull their construct's alpha down
+        alphas = summary.set_index("Construct")["Alpha"]
+        weak_items = items[(items["Item-total r"] < 0.3) |
+                           (items["Alpha if deleted"] > items["Construct"].map(alphas))]
+        notes = ["Cronbach's alpha measures how consistently the questions of a construct are answered; "
+                 "0.7 or more is usually considered acceptable."]
+        if not weak_items.empty:
+            notes.append("These questions fit their construct poorly (item-total correlation below 0.3, "
+                         "or alpha would rise without them):")
+            notes.extend(f"• {escape(str(question))} ({escape(str(construct))}, r = {r:.2f})"
+                         for question, construct, r in zip(weak_items["Question"], weak_items["Construct"],
+                                                           weak_items["Item-total r"]))
+        story.append(Paragraph("<br/>".join(notes), note_style))
+        story.append(Spacer(1, 20))
+
+    # --- Recommendations Section ---
+    story.append(Paragraph("Recommendations", header_style))
+    
+    recommendations = []
+    if weak_val < 3.0:
+        recommendations.append(f"<b>Priority Action:</b> Focus immediate attention on improving {weak_label} (score: {weak_val:.2f})")
+    if avg_score < 3.5:
+        recommendations.append("<b>Overall Improvement:</b> Consider school-wide belonging initiatives")
+    if strong_val > 4.0:
+        recommendations.append(f"<b>Leverage Strengths:</b> Use successful practices from {strong_label} in other areas")
+    
+    # Add demographic-specific recommendations if available
+    recommendations.extend([
+        "<b>Data Deep Dive:</b> Analyze results by demographic groups to identify specific needs",
+        "<b>Student Voice:</b> Conduct focus groups to understand the stories behind the numbers",
+        "<b>Action Planning:</b> Develop targeted interventions based on lowest-scoring constructs"
+    ])
+
+    rec_text = "<br/>• ".join(recommendations)
+    story.append(Paragraph(f"• {rec_text}", note_style))
+    story.append(Spacer(1, 20))
+
+    # --- Enhanced Food for Thought ---
+    story.append(Paragraph("Food for Thought", header_style))
+    
+    thought_questions = [
+        "Which demographic groups show the most significant differences in belonging scores?",
+        "What school policies or practices might be contributing to these patterns?",
+        "How do these results align with other school data (attendance, achievement, discipline)?",
+        "What student voices and perspectives are missing from this quantitative data?",
+        "Which interventions could have the greatest impact on overall belonging?",
+        "How can the school's strengths be leveraged to address areas of concern?"
+    ]
+    
+    bullets = "<br/>".join([f"• {question}" for question in thought_questions])
+    
+    story.append(Paragraph(bullets, note_style))
+    story.append(Spacer(1, 20))
+
+    # --- Footer ---
+    footer_text = f"""
+    <br/><br/>
+    <font size=8 color='#6B7280'>
+    This report was generated by the Apnapan Pulse platform. For questions about methodology 
+    or support with action planning, please contact your Apnapan representative.
+    <br/>
+    Report ID: AP-{datetime.now().strftime('%Y%m%d')}-{school_name[:3].upper()}
+    </font>
+    """
+    story.append(Paragraph(footer_text, ParagraphStyle("Footer", parent=styles["Normal"], 
+                                                    fontSize=8, alignment=1, 
+                                                    textColor=colors.HexColor("#6B7280"))))
+
+    with stage("pdf_build") as record:
+        doc.build(story)
+        record["nbytes"] = buffer.tell()
+    buffer.seek(0)
+    return buffer
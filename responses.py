@@ -0,0 +1,96 @@
+"""Row-level storage of cleaned survey responses in MongoDB, for aggregation on the server.
+
+When enabled, every student of a processed upload becomes one small document:
+
+    {"s": school_id, "u": upload id, "g": {"gender": "Female", "grade": "8", ...},
+     "c": {"Safety": 4.0, ...}, "b": 3.9, "q": [4, 5, 0, ...]}
+
+g holds the demographic groups, c the construct scores, b the overall BelongingScore and
+q the Likert code (1-5, 0 if unanswered) of every construct question, in the order of
+question_order(). Construct x group averages are then $group pipelines, so a query over
+many schools returns only the aggregated rows. Streamlit-free; app.py owns the collection.
+"""
+import numpy as np
+import pandas as pd
+
+from processing import construct_scores
+
+# Stored group field -> (label shown in the app, column keywords as in the app's group_columns)
+GROUP_FIELDS = {
+    "gender": ("Gender", ["gender", "What gender do you use"]),
+    "grade": ("Grade", ["grade", "Which grade are you in"]),
+    "income": ("Income Status", ["Income Category"]),
+    "health": ("Health Condition", ["disability", "health condition"]),
+    "ethnicity": ("Ethnicity", ["ethnicity_cleaned"]),
+    "religion": ("Religion", ["religion"]),
+}
+INSERT_BATCH = 5_000
+
+
+# Function to list the indexes the responses collection needs
+def response_indexes():
+    """(keys, name) pairs: one per school and upload, and one per group field within an upload."""
+    indexes = [([("s", 1), ("u", 1)], "school_upload")]
+    indexes += [([("u", 1), (f"g.{field}", 1)], f"upload_{field}") for field in GROUP_FIELDS]
+    return indexes
+
+
+def question_order(matched_questions):
+    """The construct questions in the order their codes are stored in q."""
+    return list(dict.fromkeys(col for cols in matched_questions.values() for col in cols))
+
+
+# Function to turn a processed upload into compact response documents
+def response_documents(results, school_id, upload_id):
+    """Yields one document per student of results (see the module docstring)."""
+    df_cleaned = results["df_cleaned"]
+    groups = {}
+    for field, (_, keywords) in GROUP_FIELDS.items():
+        col = next((col for col in df_cleaned.columns if any(k.lower() in col.lower() for k in keywords)), None)
+        if col:
+            groups[field] = df_cleaned[col].astype("string").fillna("Unknown").str.strip().tolist()
+
+    # Plain Python lists: indexing them per student is far cheaper than indexing NumPy arrays
+    scores = construct_scores(df_cleaned, results["matched_questions"]).astype(np.float64).round(3)
+    score_columns = {construct: scores[construct].tolist() for construct in scores.columns}
+    belonging = pd.to_numeric(df_cleaned["BelongingScore"], errors="coerce").round(3).tolist()
+    questions = question_order(results["matched_questions"])
+    codes = (df_cleaned[questions].apply(pd.to_numeric, errors="coerce").round().clip(1, 5)
+             .fillna(0).to_numpy(dtype=np.int8).tolist())
+
+    for i, student_codes in enumerate(codes):
+        yield {
+            "s": school_id,
+            "u": upload_id,
+            "g": {field: values[i] for field, values in groups.items()},
+            # NaN != NaN: unanswered constructs are left out
+            "c": {construct: values[i] for construct, values in score_columns.items() if values[i] == values[i]},
+            "b": belonging[i] if belonging[i] == belonging[i] else None,
+            "q": student_codes,
+        }
+
+
+# Function to build the $group pipeline for construct averages by one demographic group
+def construct_group_pipeline(match, group_field, constructs):
+    """
+    Averages of every construct and of the overall score, with student counts, per value
+    of group_field ("gender", "grade", ...) among the responses matching match.
+    $avg skips students without a score for that construct.
+    """
+    group = {"_id": f"$g.{group_field}", "Count": {"$sum": 1}, "Overall Belonging": {"$avg": "$b"}}
+    group.update({construct: {"$avg": f"$c.{construct}"} for construct in constructs})
+    return [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+# Function to turn the pipeline's output into the app's group-averages table
+def pipeline_frame(docs, group_label):
+    frame = pd.DataFrame(list(docs))
+    if frame.empty:
+        return frame
+    frame = frame.rename(columns={"_id": group_label})
+    frame[group_label] = frame[group_label].fillna("Unknown")
+    return frame.round(3)
@@ -0,0 +1,185 @@
+"""Saved analyses: one portable file holding a processed dataset, reloaded without re-parsing.
+
+A bundle is an uncompressed zip whose entries are
+  manifest.json        - format and version, the dataset key, every non-table result
+                         (matched questions, category averages, ...) and saved app options
+  tables/<name>.arrow  - each DataFrame of the results (the cleaned data, the summary and
+                         matched-questions tables, the cross-tab cube), as an Arrow IPC file
+                         with zstd-compressed column buffers, written in slices of rows
+Because the zip stores its entries as is, a loader memory-maps the bundle and opens each
+table straight from its byte range, without first reading the file into memory. The
+tables are compressed, so each one is still decompressed into a full in-memory copy;
+compression keeps bundles of large surveys small enough to download.
+Bundles contain no pickles, so opening one from another machine runs no code from it.
+Streamlit-free.
+"""
+import json
+import os
+import struct
+import tempfile
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+BUNDLE_FORMAT = "apnapan-analysis"
+BUNDLE_VERSION = 1
+BUNDLE_EXTENSION = "apnapan"
+SECTION_BATCH_ROWS = 65_536
+SECTION_OPTIONS = pa.ipc.IpcWriteOptions(compression="zstd")
+_INDEX_PREFIX = "__index_"
+
+
+class BundleError(ValueError):
+    """Raised when a file is not a saved analysis this version of the app can open."""
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _write_section(df, path):
+    """Writes df as an Arrow IPC file and returns how to restore its index and column types."""
+    section = {}
+    if not (isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1):
+        section["index"] = list(df.index.names)
+        df = df.reset_index(names=[f"{_INDEX_PREFIX}{i}__" for i in range(df.index.nlevels)])
+    df = df.set_axis([str(col) for col in df.columns], axis=1)
+    # Each text column is typed from all its values, so every slice of rows shares one schema.
+    # Columns mixing numbers and text cannot be one Arrow type; they are stored as strings.
+    text_types, stringified = {}, []
+    for col in df.columns[df.dtypes == object]:
+        try:
+            text_types[col] = pa.array(df[col], from_pandas=True).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            stringified.append(col)
+            text_types[col] = pa.string()
+    section["stringified"] = stringified
+
+    def arrow_ready(chunk):
+        return chunk.astype({col: "string" for col in stringified}) if stringified else chunk
+
+    schema = pa.Schema.from_pandas(arrow_ready(df.iloc[:0]), preserve_index=False)
+    for col, arrow_type in text_types.items():
+        schema = schema.set(schema.get_field_index(col), pa.field(col, arrow_type))
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema, options=SECTION_OPTIONS) as writer:
+        for start in range(0, len(df), SECTION_BATCH_ROWS):
+            chunk = arrow_ready(df.iloc[start:start + SECTION_BATCH_ROWS])
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    return section
+
+
+def _read_section(source, section):
+    table = pa.ipc.open_file(source).read_all()
+    df = table.to_pandas()
+    for col in section["stringified"]:
+        df[col] = df[col].astype(object)
+    # Missing text is None from Arrow but NaN in the frame that was saved, and str(None) would not read as "nan"
+    for col in df.columns[df.dtypes == object]:
+        if df[col].hasnans:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    if "index" in section:
+        index_cols = [col for col in df.columns if col.startswith(_INDEX_PREFIX)]
+        df = df.set_index(index_cols)
+        df.index.names = section["index"]
+    return df
+
+
+# Function to save a processed dataset (and app options) as a bundle file
+def save_bundle(path, results, dataset_key, options=None, crosstab=None):
+    """
+    Writes results (as kept in the dataset store) to path. options is any JSON-friendly
+    dict the app wants back on load (report choices); crosstab is an optional cube from
+    processing.crosstab_cube with its "dimension_cols". Returns the bundle's size in bytes.
+    """
+    # A cube restored from an earlier bundle is saved again as it is
+    crosstab = crosstab or results.get("crosstab_cube")
+    results = {name: value for name, value in results.items() if name != "crosstab_cube"}
+    tables = {name: value for name, value in results.items() if isinstance(value, pd.DataFrame)}
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "dataset_key": dataset_key,
+        "n_students": int(len(results["df_cleaned"])) if "df_cleaned" in tables else 0,
+        "values": {name: value for name, value in results.items() if name not in tables},
+        "options": options or {},
+        "tables": {},
+    }
+    if crosstab is not None:
+        tables["crosstab_cube"] = crosstab["cube"]
+        manifest["crosstab"] = {"dimension_cols": [list(pair) for pair in crosstab["dimension_cols"]],
+                                "categories": crosstab["categories"]}
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, df in tables.items():
+            # Sections go through a temporary file: the IPC writer needs a seekable sink
+            fd, tmp_path = tempfile.mkstemp(suffix=".arrow")
+            os.close(fd)
+            try:
+                section = _write_section(df, tmp_path)
+                section["entry"] = f"tables/{name}.arrow"
+                zf.write(tmp_path, section["entry"])
+            finally:
+                os.remove(tmp_path)
+            manifest["tables"][name] = section
+        zf.writestr("manifest.json", json.dumps(manifest, default=_json_default))
+    return os.path.getsize(path)
+
+
+def _entry_offset(mapped, info):
+    """Byte offset of a stored zip entry's data: past its local header, name and extra field."""
+    mapped.seek(info.header_offset)
+    header = mapped.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise BundleError("The saved analysis is damaged.")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def read_manifest(path):
+    """The bundle's manifest; raises BundleError if path is not a bundle this app can open."""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            manifest = json.loads(zf.read("manifest.json"))
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise BundleError("This file is not a saved analysis.") from e
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise BundleError("This file is not a saved analysis.")
+    if manifest.get("version", 0) > BUNDLE_VERSION:
+        raise BundleError("This analysis was saved by a newer version of the app. Please update the app to open it.")
+    return manifest
+
+
+# Function to load a bundle back into the results dict the app works with
+def load_bundle(path):
+    """
+    Returns (manifest, results). results has the same entries as when it was saved, plus
+    "crosstab_cube" ({"dimension_cols", "categories", "cube"}) if a cube was saved.
+    """
+    manifest = read_manifest(path)
+    results = dict(manifest["values"])
+    with zipfile.ZipFile(path) as zf:
+        infos = {info.filename: info for info in zf.infolist()}
+    with pa.memory_map(path, "r") as mapped:
+        for name, section in manifest["tables"].items():
+            info = infos.get(section["entry"])
+            if info is None or info.compress_type != zipfile.ZIP_STORED:
+                raise BundleError("The saved analysis is damaged.")
+            mapped.seek(_entry_offset(mapped, info))
+            try:
+                # A view of the mapped file, not a copy; the tables are decompressed from it
+                results[name] = _read_section(mapped.read_buffer(info.file_size), section)
+            except pa.ArrowInvalid as e:
+                raise BundleError("The saved analysis is damaged.") from e
+    if "crosstab" in manifest and "crosstab_cube" in results:
+        results["crosstab_cube"] = {
+            "dimension_cols": [tuple(pair) for pair in manifest["crosstab"]["dimension_cols"]],
+            "categories": manifest["crosstab"]["categories"],
+            "cube": results["crosstab_cube"],
+        }
+    return manifest, results
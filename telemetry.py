@@ -0,0 +1,332 @@
+"""Stage timing for Apnapan Pulse: per-stage latency histograms and a local Prometheus endpoint.
+
+Code marks a stage with `with stage("parse", nbytes=...) as record:` or the `@timed(...)`
+decorator. Finished records go to the sink the app registers (set_sink), or, inside
+collect(), to a list that a worker process returns along with its job's result.
+
+With APNAPAN_MEMORY_PROFILE=1 in the environment (inherited by worker processes), every
+stage also records its tracemalloc peak and retained memory; see MemoryProfiler.
+"""
+import functools
+import linecache
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_local = threading.local()
+_sink = None
+_profiler = None
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def set_sink(sink):
+    """Registers the callable that receives each finished stage record in this process."""
+    global _sink
+    _sink = sink
+
+
+@contextmanager
+def stage(name, **sizes):
+    """
+    Times the enclosed block as one stage. sizes (rows, cols, nbytes, ...) are stored on
+    the yielded record dict, which the block may update once the sizes are known.
+    """
+    record = {"stage": name, **sizes}
+    open_stages = _local.__dict__.setdefault("open", [])
+    open_stages.append(record)
+    profiler = _profiler
+    if profiler is not None:
+        profiler.enter(record, open_stages)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - started
+        if profiler is not None:
+            profiler.exit(record, open_stages)
+        open_stages.pop()
+        collected = getattr(_local, "collected", None)
+        if collected is not None:
+            collected.append(record)
+        elif _sink is not None:
+            _sink(record)
+
+
+def timed(name, cache=False):
+    """
+    Decorator form of stage(). The result's size is recorded when it has one. With
+    cache=True the call counts as a cache hit unless the body calls mark_cache_miss(),
+    so put it outside st.cache_data and the mark inside the cached function.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                if cache:
+                    record["cache"] = "hit"
+                result = fn(*args, **kwargs)
+                record.update(result_sizes(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def mark_cache_miss():
+    """Marks the innermost open stage as a cache miss (call it from inside a cached function)."""
+    open_stages = getattr(_local, "open", None)
+    if open_stages:
+        open_stages[-1]["cache"] = "miss"
+
+
+def result_sizes(result):
+    """Rows/cols of frames and arrays, rows of lists, nbytes of bytes; {} for anything else."""
+    shape = getattr(result, "shape", None)
+    if isinstance(shape, tuple) and shape:
+        return {"rows": shape[0], **({"cols": shape[1]} if len(shape) > 1 else {})}
+    if isinstance(result, (bytes, bytearray)):
+        return {"nbytes": len(result)}
+    if isinstance(result, list):
+        return {"rows": len(result)}
+    return {}
+
+
+def collect(fn, *args):
+    """Runs fn(*args) and returns (result, stage records made meanwhile). Used for worker jobs."""
+    previous = getattr(_local, "collected", None)
+    _local.collected = []
+    try:
+        result = fn(*args)
+        return result, _local.collected
+    finally:
+        _local.collected = previous
+
+
+def current_rss_bytes():
+    """Resident set size of this process from /proc (Linux), or None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryProfiler:
+    """
+    Adds peak_mb and retained_mb (tracemalloc, relative to the stage's start) and rss_mb to
+    every stage record. A nested stage's peak also counts towards its parents. With
+    trace_lines, it also lists the lines of this project whose allocations grew most
+    during the stage (top_allocations), each with the library line that did the
+    allocating; that keeps deep tracebacks and snapshots the heap per stage, so it is slow.
+    tracemalloc is process-wide, so stages running concurrently on other threads (other
+    Streamlit sessions) inflate each other's numbers; profile on a quiet server.
+    """
+
+    def __init__(self, trace_lines=False, top_lines=5, min_line_kb=64):
+        self.trace_lines = trace_lines
+        self.top_lines = top_lines
+        self.min_line_bytes = min_line_kb * 1024
+        self._order = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25 if trace_lines else 1)
+
+    def enter(self, record, open_stages):
+        current, peak = tracemalloc.get_traced_memory()
+        # reset_peak() is global: fold the peak so far into every enclosing stage first
+        for parent in open_stages[:-1]:
+            parent["_memory"]["peak"] = max(parent["_memory"]["peak"], peak)
+        snapshot = self._snapshot() if self.trace_lines else None
+        if snapshot is not None:
+            current = tracemalloc.get_traced_memory()[0]  # Leave the snapshot itself out
+        tracemalloc.reset_peak()
+        self._order += 1
+        record["depth"] = len(open_stages) - 1
+        record["order"] = self._order
+        record["_memory"] = {"start": current, "peak": current, "snapshot": snapshot}
+
+    def exit(self, record, open_stages):
+        current, peak = tracemalloc.get_traced_memory()
+        memory = record.pop("_memory")
+        peak = max(memory["peak"], peak)
+        for parent in open_stages[:-1]:
+            parent["_memory"]["peak"] = max(parent["_memory"]["peak"], peak)
+        record["peak_mb"] = round((peak - memory["start"]) / 2**20, 2)
+        record["retained_mb"] = round((current - memory["start"]) / 2**20, 2)
+        rss = current_rss_bytes()
+        if rss is not None:
+            record["rss_mb"] = round(rss / 2**20, 1)
+        if memory["snapshot"] is not None:
+            record["top_allocations"] = self._top_lines(memory["snapshot"])
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+
+    def _top_lines(self, before):
+        # Group growth by the innermost frame in this project, so the line is ours, not pandas'
+        grown = {}
+        for stat in self._snapshot().compare_to(before, "traceback"):
+            if stat.size_diff <= 0:
+                continue
+            frames = list(stat.traceback)  # Oldest call first
+            ours = next((f for f in reversed(frames) if f.filename.startswith(PROJECT_DIR)), None)
+            key = (ours or frames[-1], frames[-1])
+            grown[key] = grown.get(key, 0) + stat.size_diff
+        lines = []
+        for (ours, allocator), size in sorted(grown.items(), key=lambda item: item[1], reverse=True)[:self.top_lines]:
+            if size < self.min_line_bytes:
+                break
+            line = f"{size / 2**20:+.1f} MB  {self._describe(ours)}"
+            if allocator is not ours:
+                line += f"  (via {os.path.basename(allocator.filename)}:{allocator.lineno})"
+            lines.append(line)
+        return lines
+
+    @staticmethod
+    def _describe(frame):
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        return f"{os.path.relpath(frame.filename, PROJECT_DIR) if frame.filename.startswith(PROJECT_DIR) else os.path.basename(frame.filename)}:{frame.lineno}  {source}"
+
+
+def enable_memory_profiling(trace_lines=False, top_lines=5, min_line_kb=64):
+    """Turns on per-stage memory tracking for this process (see MemoryProfiler)."""
+    global _profiler
+    _profiler = MemoryProfiler(trace_lines=trace_lines, top_lines=top_lines, min_line_kb=min_line_kb)
+    return _profiler
+
+
+class StageMetrics:
+    """Process-wide latency histograms and size/cache counters per stage."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._stages = {}  # name -> {"buckets": [...], "count", "sum", "max", "rows", "nbytes", "hit", "miss", "errors"}
+        self._gauges = []  # (name, help, callable returning a number)
+        self._lock = threading.Lock()
+
+    def observe(self, record):
+        seconds = record["seconds"]
+        with self._lock:
+            entry = self._stages.get(record["stage"])
+            if entry is None:
+                entry = self._stages[record["stage"]] = {
+                    "buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0, "max": 0.0,
+                    "rows": 0, "nbytes": 0, "hit": 0, "miss": 0, "errors": 0, "peak_mb": None,
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["rows"] += record.get("rows") or 0
+            entry["nbytes"] += record.get("nbytes") or 0
+            if record.get("cache") in ("hit", "miss"):
+                entry[record["cache"]] += 1
+            if "error" in record:
+                entry["errors"] += 1
+            if "peak_mb" in record:
+                entry["peak_mb"] = max(entry["peak_mb"] or 0.0, record["peak_mb"])
+
+    def add_gauge(self, name, help_text, read):
+        """Adds a gauge read at scrape time, e.g. the dataset store's size."""
+        self._gauges.append((name, help_text, read))
+
+    def summary(self):
+        """One row per stage for the operator page."""
+        with self._lock:
+            rows = []
+            for name, entry in sorted(self._stages.items()):
+                lookups = entry["hit"] + entry["miss"]
+                rows.append({
+                    "Stage": name,
+                    "Calls": entry["count"],
+                    "Mean (ms)": round(1000 * entry["sum"] / entry["count"], 1),
+                    "Max (ms)": round(1000 * entry["max"], 1),
+                    "Rows": entry["rows"],
+                    "MB": round(entry["nbytes"] / 2**20, 2),
+                    "Cache hit %": round(100 * entry["hit"] / lookups, 1) if lookups else None,
+                    "Peak MB (max)": entry["peak_mb"],
+                    "Errors": entry["errors"],
+                })
+            return rows
+
+    def render(self):
+        """The metrics in Prometheus text exposition format (version 0.0.4)."""
+        lines = [
+            "# HELP apnapan_stage_duration_seconds Time spent in each app stage.",
+            "# TYPE apnapan_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = {name: dict(entry, buckets=list(entry["buckets"])) for name, entry in self._stages.items()}
+        for name, entry in sorted(stages.items()):
+            label = f'stage="{name}"'
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                lines.append(f'apnapan_stage_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'apnapan_stage_duration_seconds_bucket{{{label},le="+Inf"}} {entry["count"]}')
+            lines.append(f'apnapan_stage_duration_seconds_sum{{{label}}} {entry["sum"]:.6f}')
+            lines.append(f'apnapan_stage_duration_seconds_count{{{label}}} {entry["count"]}')
+        for metric, key, help_text in (
+            ("apnapan_stage_rows_total", "rows", "Rows handled by each stage."),
+            ("apnapan_stage_bytes_total", "nbytes", "Bytes handled by each stage."),
+            ("apnapan_stage_errors_total", "errors", "Stage runs that ended in an exception."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{stage="{name}"}} {entry[key]}' for name, entry in sorted(stages.items())]
+        lines += ["# HELP apnapan_stage_cache_total Cache lookups by stage and result.",
+                  "# TYPE apnapan_stage_cache_total counter"]
+        for name, entry in sorted(stages.items()):
+            if entry["hit"] or entry["miss"]:
+                lines.append(f'apnapan_stage_cache_total{{stage="{name}",result="hit"}} {entry["hit"]}')
+                lines.append(f'apnapan_stage_cache_total{{stage="{name}",result="miss"}} {entry["miss"]}')
+        lines += ["# HELP apnapan_stage_peak_memory_bytes Largest traced peak seen per stage (memory profiling only).",
+                  "# TYPE apnapan_stage_peak_memory_bytes gauge"]
+        lines += [f'apnapan_stage_peak_memory_bytes{{stage="{name}"}} {int(entry["peak_mb"] * 2**20)}'
+                  for name, entry in sorted(stages.items()) if entry["peak_mb"] is not None]
+        for name, help_text, read in self._gauges:
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """Serves metrics.render() at http://host:port/metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would flood the Streamlit log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving stage metrics at http://{host}:{port}/metrics")
+    return server
+
+
+if os.environ.get("APNAPAN_MEMORY_PROFILE", "").lower() in ("1", "true", "yes"):
+    enable_memory_profiling()
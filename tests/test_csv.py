@@ -0,0 +1,64 @@
+"""read_survey_csv gives the same frame as a plain pd.read_csv of the file, whatever its dialect."""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from processing import read_survey_csv, sniff_delimiter, sniff_encoding
+
+SURVEY = pd.DataFrame({
+    "Timestamp": ["2024/05/01 10:00", "2024/05/01 10:05", "2024/05/01 10:09", "2024/05/01 10:12"],
+    "Gender": ["Female", "Male", None, "Female"],
+    "Grade": [6, 7, 8, 6],
+    "I feel safe at school": ["Agree", "Strongly Agree", "Neutral", None],
+    "Comments": ["Café is nice", "", "Teachers, friends", "Ça va"],
+})
+
+
+def as_strings(df):
+    """Values as text, with missing values as "nan", so categorical and object columns compare equal."""
+    return df.astype(object).where(df.notna(), np.nan).astype(str)
+
+
+def csv_bytes(df, sep=",", encoding="utf-8"):
+    return df.to_csv(index=False, sep=sep).encode(encoding)
+
+
+@pytest.mark.parametrize("sep, encoding", [
+    (",", "utf-8"), (";", "utf-8"), ("\t", "utf-8"), (",", "utf-8-sig"), (";", "cp1252"), (",", "utf-16"),
+])
+def test_matches_pandas(sep, encoding):
+    file_bytes = csv_bytes(SURVEY, sep, encoding)
+    expected = pd.read_csv(io.BytesIO(file_bytes), sep=sep, encoding=encoding)
+    df = read_survey_csv(file_bytes)
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(as_strings(df), as_strings(expected))
+
+
+def test_likert_and_demographic_columns_are_categorical():
+    df = read_survey_csv(csv_bytes(SURVEY))
+    assert isinstance(df["Gender"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["I feel safe at school"].dtype, pd.CategoricalDtype)
+    assert df["Gender"].isna().sum() == 1
+
+
+def test_repeated_headers_are_numbered_like_pandas():
+    file_bytes = b"Q,Q,Grade\n1,2,6\n3,4,7\n"
+    df = read_survey_csv(file_bytes)
+    assert list(df.columns) == list(pd.read_csv(io.BytesIO(file_bytes)).columns) == ["Q", "Q.1", "Grade"]
+
+
+def test_ragged_rows_fall_back_to_pandas():
+    file_bytes = b"A,B,C\n1,2,3\n4,5\n"
+    expected = pd.read_csv(io.BytesIO(file_bytes))
+    pd.testing.assert_frame_equal(as_strings(read_survey_csv(file_bytes)), as_strings(expected))
+
+
+def test_sniffing():
+    assert sniff_encoding("Grade".encode("utf-8-sig")) == "utf-8-sig"
+    assert sniff_encoding("Café au lait".encode("cp1252")) == "cp1252"
+    # A prefix that ends inside a multi-byte character is still UTF-8
+    assert sniff_encoding("Café".encode("utf-8")[:-1]) == "utf-8"
+    assert sniff_delimiter("a;b;c\n1;2;3\n") == ";"
+    assert sniff_delimiter("only one column\n") == ","
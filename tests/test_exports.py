@@ -0,0 +1,88 @@
+"""write_export in each format, for one table and for several, read back and compared."""
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from exports import EXPORT_FORMATS, export_filename, write_export
+
+CLEANED = pd.DataFrame({
+    "Grade": ["6", "7", None, "8", "6"],
+    "Score": [4.5, np.nan, 3.5, 2.25, 5.75],
+    "Answer": ["=1+1", "Agree", 3, None, "Disagree"],  # Mixed types, and text that looks like a formula
+})
+SUMMARY = pd.DataFrame({"Statistic": ["mean", "std"], "Score": [3.69, 1.2]})
+TABLES = {"Cleaned Data": CLEANED, "Summary Statistics": SUMMARY}
+
+
+def as_strings(df):
+    """Values as text (files read back with dtype=str), with missing values as "nan"."""
+    return df.astype(object).where(df.notna(), np.nan).astype(str).reset_index(drop=True)
+
+
+def assert_same(read_back, df):
+    assert list(read_back.columns) == list(df.columns)
+    pd.testing.assert_frame_equal(as_strings(read_back), as_strings(df), check_dtype=False)
+
+
+def read_members(path, reader):
+    with zipfile.ZipFile(path) as zf:
+        return {name: reader(io.BytesIO(zf.read(name))) for name in zf.namelist()}
+
+
+@pytest.mark.parametrize("export_format", list(EXPORT_FORMATS))
+def test_single_table(export_format, tmp_path):
+    tables = {"Cleaned Data": CLEANED}
+    path = tmp_path / export_filename("export", tables, export_format)
+    # A small chunk_rows so the table is written in several slices
+    assert write_export(tables, export_format, path, chunk_rows=2) == path.stat().st_size
+    if export_format == "csv":
+        read_back = pd.read_csv(path, dtype=str)
+    elif export_format == "parquet":
+        read_back = pd.read_parquet(path)
+    else:
+        read_back = pd.read_excel(path, sheet_name="Cleaned Data", dtype=str)
+    assert_same(read_back, CLEANED)
+
+
+def test_csv_zip(tmp_path):
+    path = tmp_path / export_filename("export", TABLES, "csv")
+    assert path.suffix == ".zip"
+    write_export(TABLES, "csv", path, chunk_rows=2)
+    members = read_members(path, lambda f: pd.read_csv(f, dtype=str))
+    assert sorted(members) == ["cleaned_data.csv", "summary_statistics.csv"]
+    assert_same(members["cleaned_data.csv"], CLEANED)
+    assert_same(members["summary_statistics.csv"], SUMMARY)
+
+
+def test_parquet_zip(tmp_path):
+    path = tmp_path / export_filename("export", TABLES, "parquet")
+    write_export(TABLES, "parquet", path, chunk_rows=2)
+    members = read_members(path, pd.read_parquet)
+    assert sorted(members) == ["cleaned_data.parquet", "summary_statistics.parquet"]
+    assert_same(members["cleaned_data.parquet"], CLEANED)
+    assert_same(members["summary_statistics.parquet"], SUMMARY)
+
+
+def test_xlsx_sheets(tmp_path):
+    path = tmp_path / export_filename("export", TABLES, "xlsx")
+    assert path.suffix == ".xlsx"
+    write_export(TABLES, "xlsx", path, chunk_rows=2)
+    sheets = pd.read_excel(path, sheet_name=None, dtype=str)
+    assert list(sheets) == list(TABLES)
+    assert_same(sheets["Summary Statistics"], SUMMARY)
+    # Written as text, not as a formula
+    assert sheets["Cleaned Data"].loc[0, "Answer"] == "=1+1"
+
+
+def test_empty_table_keeps_its_header(tmp_path):
+    path = tmp_path / "empty.csv"
+    write_export({"Cleaned Data": CLEANED.iloc[:0]}, "csv", path)
+    assert list(pd.read_csv(path).columns) == list(CLEANED.columns)
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        write_export(TABLES, "json", tmp_path / "export.json")
@@ -0,0 +1,55 @@
+"""Cross-tab suppression of small cells, and the bitmap filters against plain pandas masks."""
+import numpy as np
+import pandas as pd
+
+from processing import crosstab, crosstab_cube, filter_index, filter_mask
+
+DIMENSIONS = [("Gender", "gender"), ("Grade", "grade")]
+
+
+def survey(rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "gender": rng.choice(["Female", "Male", "Other"], rows, p=[0.49, 0.49, 0.02]),
+        "grade": rng.choice(["6", "7", "10"], rows).astype(object),
+        "Safety": rng.integers(1, 6, rows).astype(float),
+    })
+    df.loc[rng.random(rows) < 0.05, "grade"] = np.nan
+    df.loc[rng.random(rows) < 0.1, "Safety"] = np.nan
+    return df
+
+
+def test_crosstab_matches_groupby_and_suppresses_small_cells():
+    df = survey()
+    means, counts = crosstab(crosstab_cube(df, DIMENSIONS, df[["Safety"]]), "Gender", "Grade", "Safety", min_cell=10)
+    assert list(counts.columns) == ["6", "7", "10", "Unknown"]  # Grades in numeric order, missing last
+    grouped = df.fillna({"grade": "Unknown"}).groupby(["gender", "grade"])["Safety"].agg(["mean", "count"])
+    for (gender, grade), row in grouped.iterrows():
+        assert counts.loc[gender, grade] == row["count"]
+        if row["count"] >= 10:
+            assert np.isclose(means.loc[gender, grade], row["mean"])
+        else:
+            assert np.isnan(means.loc[gender, grade])
+    # The rare gender is in every grade, but each cell is too small to show
+    assert means.loc["Other"].isna().all()
+
+
+def test_filter_mask_matches_pandas():
+    df = survey(rows=1003)  # Not a multiple of 8, so the last packed byte is partial
+    index = filter_index(df, DIMENSIONS)
+    grade = df["grade"].fillna("Unknown")
+    selections = {"Gender": ["Female", "Other"], "Grade": ["7", "Unknown"]}
+    either_gender = df["gender"].isin(["Female", "Other"])
+    either_grade = grade.isin(["7", "Unknown"])
+    assert np.array_equal(filter_mask(index, selections, "and"), (either_gender & either_grade).to_numpy())
+    assert np.array_equal(filter_mask(index, selections, "or"), (either_gender | either_grade).to_numpy())
+
+
+def test_filter_mask_edge_cases():
+    df = survey(rows=13)
+    index = filter_index(df, DIMENSIONS)
+    assert filter_mask(index, {}) is None
+    assert filter_mask(index, {"Gender": []}) is None
+    # A value that does not occur selects nobody
+    assert not filter_mask(index, {"Gender": ["Nobody"]}).any()
+    assert len(filter_mask(index, {"Gender": ["Male"]})) == 13
@@ -0,0 +1,32 @@
+"""Regression tests for the bootstrap intervals of the group comparison charts."""
+import numpy as np
+import pandas as pd
+
+from processing import BOOTSTRAP_MIN_GROUP, bootstrap_group_means, group_averages
+from reports import generate_bar_chart_for_pdf
+
+
+def test_no_numeric_scores_gives_empty_table():
+    df = pd.DataFrame({"Grade": ["6", "7", "8"], "S": ["x", "y", "z"]})
+    assert group_averages(df, "Grade", "S", "Grade").empty
+
+
+def test_no_values_gives_nan_intervals():
+    ci_low, ci_high, significant = bootstrap_group_means(np.array([]), np.array([], dtype=np.int8), 0)
+    assert len(ci_low) == len(ci_high) == len(significant) == 0
+
+
+def test_pdf_chart_skipped_without_scores():
+    df = pd.DataFrame({"Grade": ["6", "7", "8"], "I feel safe": ["x", "y", "z"]})
+    assert generate_bar_chart_for_pdf(df, ["safe"], ["grade"], "Safety by Grade", "Grade") is None
+
+
+def test_small_groups_are_never_significant():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"G": ["a"] * 40 + ["b"] + ["c"] * 40,
+                       "S": list(rng.integers(1, 6, 40)) + [1] + [5] * 40})
+    group_avg = group_averages(df, "G", "S", "Group").set_index("G")
+    assert group_avg.loc["b", "Count"] < BOOTSTRAP_MIN_GROUP
+    assert not group_avg.loc["b", "Significant"]
+    assert group_avg.loc["b", ["CI_Low", "CI_High"]].isna().all()
+    assert group_avg.loc["c", "Significant"]
@@ -0,0 +1,101 @@
+"""Saved analyses survive a save_bundle / load_bundle round trip, and bad files are refused."""
+import io
+import json
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_survey
+from processing import build_dataset_results, construct_scores, crosstab, crosstab_cube
+from snapshots import BUNDLE_VERSION, BundleError, load_bundle, read_manifest, save_bundle
+
+
+@pytest.fixture(scope="module")
+def results():
+    buf = io.BytesIO()
+    make_survey(rows=300, cols=40, seed=3).to_csv(buf, index=False)
+    return build_dataset_results(buf.getvalue(), "csv")
+
+
+def test_round_trip(results, tmp_path):
+    path = str(tmp_path / "analysis.apnapan")
+    options = {"include_reliability": True, "chart_Safety": False}
+    assert save_bundle(path, results, "key-1", options=options) == os.path.getsize(path)
+
+    manifest, loaded = load_bundle(path)
+    assert manifest["dataset_key"] == "key-1"
+    assert manifest["options"] == options
+    assert manifest["n_students"] == len(results["df_cleaned"])
+    assert set(loaded) == set(results)
+    for name, value in results.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(loaded[name], value, check_dtype=False, check_categorical=False)
+        else:
+            assert loaded[name] == value
+    # Missing answers come back as NaN, as from a fresh parse, not as None
+    assert not any(value is None for value in loaded["df_cleaned"].select_dtypes(object).to_numpy().ravel())
+
+
+def test_round_trip_with_crosstab(results, tmp_path):
+    df_cleaned = results["df_cleaned"]
+    dimension_cols = [("Gender", "What gender do you use?"), ("Grade", "Which grade are you in?")]
+    cube = crosstab_cube(df_cleaned, dimension_cols, construct_scores(df_cleaned, results["matched_questions"]))
+    path = str(tmp_path / "analysis.apnapan")
+    save_bundle(path, results, "key-1", crosstab={**cube, "dimension_cols": dimension_cols})
+
+    _, loaded = load_bundle(path)
+    restored = loaded["crosstab_cube"]
+    assert restored["dimension_cols"] == dimension_cols
+    assert restored["categories"] == cube["categories"]
+    construct = next(iter(results["matched_questions"]))
+    for expected, actual in zip(crosstab(cube, "Gender", "Grade", construct),
+                                crosstab(restored, "Gender", "Grade", construct)):
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    # Saving the loaded results again keeps the restored cube
+    save_bundle(path, loaded, "key-1")
+    assert load_bundle(path)[1]["crosstab_cube"]["dimension_cols"] == dimension_cols
+
+
+def test_not_a_bundle(tmp_path):
+    path = tmp_path / "survey.csv"
+    path.write_bytes(b"Grade,Score\n6,4\n")
+    with pytest.raises(BundleError):
+        read_manifest(path)
+    other = tmp_path / "other.zip"
+    with zipfile.ZipFile(other, "w") as zf:
+        zf.writestr("manifest.json", '{"format": "something-else"}')
+    with pytest.raises(BundleError):
+        load_bundle(other)
+
+
+def test_newer_version_is_refused(results, tmp_path):
+    path = str(tmp_path / "analysis.apnapan")
+    save_bundle(path, results, "key-1")
+    manifest = read_manifest(path)
+    manifest["version"] = BUNDLE_VERSION + 1
+    newer = str(tmp_path / "newer.apnapan")
+    with zipfile.ZipFile(path) as src, zipfile.ZipFile(newer, "w") as dst:
+        for info in src.infolist():
+            if info.filename != "manifest.json":
+                dst.writestr(info, src.read(info))
+        dst.writestr("manifest.json", json.dumps(manifest))
+    with pytest.raises(BundleError, match="newer version"):
+        load_bundle(newer)
+
+
+def test_damaged_table(results, tmp_path):
+    path = str(tmp_path / "analysis.apnapan")
+    save_bundle(path, results, "key-1")
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo("tables/df_cleaned.arrow")
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    start = info.header_offset + 30 + len(info.filename) + len(info.extra)
+    data[start:start + info.file_size] = bytes(info.file_size)
+    with open(path, "wb") as f:
+        f.write(data)
+    with pytest.raises(BundleError, match="damaged"):
+        load_bundle(path)
@@ -0,0 +1,116 @@
+"""Behaviour of the shared worker pool: inline mode, limits, cancellation and restarts."""
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from workers import JobTimeout, WorkerPool, WorkerPoolBusy
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def exit_worker():
+    os._exit(1)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        options = {"max_workers": 1, "max_pending": 4, "job_timeout": 30, "poll_interval": 0.05}
+        options.update(kwargs)
+        pool = WorkerPool(**options)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_inline_pool_runs_on_the_calling_thread(make_pool):
+    pool = make_pool(max_workers=0)
+    assert pool.run("a", sum, [1, 2]) == 3
+    results = pool.run_many("a", fail, [("x",)])
+    assert isinstance(results[0], ValueError)
+    with pytest.raises(ValueError):
+        pool.run("a", fail, "y")
+
+
+def test_runs_jobs_in_a_worker_process(make_pool):
+    pool = make_pool()
+    assert pool.run("a", os.getpid) != os.getpid()
+    assert pool.run_many("a", pow, [(2, 3), (3, 2)]) == [8, 9]
+    assert pool.stats()["completed"] == 3
+
+
+def test_rejects_jobs_past_max_pending(make_pool):
+    pool = make_pool(max_pending=1)
+    pool.submit("a", time.sleep, 1)
+    with pytest.raises(WorkerPoolBusy):
+        pool.submit("b", sum, [1])
+    assert pool.stats()["rejected"] == 1
+
+
+def test_cancel_stops_queued_jobs(make_pool):
+    pool = make_pool()
+    running = pool.submit("a", time.sleep, 1)
+    queued = pool.submit("a", sum, [1])
+    assert pool.cancel("a") == 1
+    assert queued.cancelled() and not running.cancelled()
+    assert pool.stats()["abandoned"] == 1
+
+
+def test_owner_with_abandoned_jobs_is_refused(make_pool):
+    pool = make_pool(max_abandoned=0)
+    with pytest.raises(JobTimeout):
+        pool.run("a", time.sleep, 2, timeout=0.2)
+    assert pool.stats()["abandoned"] == 1
+    with pytest.raises(WorkerPoolBusy):
+        pool.submit("a", sum, [1])
+    assert pool.run("b", sum, [1, 2]) == 3  # Waits for the abandoned job, then runs
+    assert pool.run("a", sum, [1, 2]) == 3
+
+
+def test_broken_pool_is_restarted(make_pool):
+    pool = make_pool()
+    with pytest.raises(BrokenProcessPool):
+        pool.run("a", exit_worker)
+    assert pool.run("a", sum, [1, 2]) == 3
+    assert pool.stats()["restarted"] == 1
+
+
+def test_stuck_job_is_killed(make_pool):
+    pool = make_pool(job_timeout=0.3, kill_after=2)
+    stuck = pool.submit("a", time.sleep, 60)
+    wait_until(lambda: pool.stats()["restarted"] == 1)
+    assert isinstance(stuck.exception(), JobTimeout)
+    assert pool.run("b", sum, [1, 2]) == 3
+    assert pool.stats()["in_flight"] == 0
+
+
+def test_job_fails_when_the_executor_cannot_take_it(make_pool, monkeypatch):
+    pool = make_pool()
+
+    class Broken:
+        def submit(self, fn, *args):
+            raise BrokenProcessPool("still broken")
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            pass
+
+    monkeypatch.setattr(pool, "_get_executor", Broken)
+    future = pool.submit("a", sum, [1])
+    assert isinstance(future.exception(timeout=5), BrokenProcessPool)
+    assert pool.stats()["in_flight"] == 0
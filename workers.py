@@ -0,0 +1,316 @@
+"""Shared process pool for the CPU-heavy stages of Apnapan Pulse (parsing, metrics, PDF builds).
+
+Streamlit runs every session's script in a thread of one process, so a large upload
+holding the GIL slows every other school on the server. Jobs submitted here run in
+separate worker processes instead; the script thread only waits on the result.
+"""
+import multiprocessing
+import sys
+import threading
+import time
+import types
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import stage
+
+WARM_UP_SECONDS = 0.1  # Long enough that no worker is idle before every one has been started
+
+
+class WorkerPoolBusy(RuntimeError):
+    """Raised when the pool already has max_pending jobs queued or running."""
+
+
+class JobTimeout(RuntimeError):
+    """Raised when a job does not finish within the pool's job timeout."""
+
+
+class WorkerPoolRestarted(RuntimeError):
+    """Raised for a running job whose worker was stopped because the pool had to be restarted."""
+
+
+@contextmanager
+def _hidden_main_module():
+    """
+    Spawned workers first re-run the parent's __main__ module. Under Streamlit that is the
+    app script itself, so an empty module stands in for it while workers are started.
+    """
+    main = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class WorkerPool:
+    """
+    Bounded front end for a ProcessPoolExecutor shared by all sessions.
+
+    At most max_pending jobs may be queued or running at once; further submissions are
+    rejected with WorkerPoolBusy rather than growing an unbounded backlog. Jobs are
+    tracked per owner (the session id) so a session's queued work can be cancelled
+    when it reruns or logs out. A job that is already running cannot be interrupted;
+    its result is discarded and its slot is freed when the worker finishes. Until then
+    it still occupies a worker, so an owner with more than max_abandoned such jobs is
+    refused new ones: a session rerunning a slow upload over and over cannot fill the pool.
+
+    A job still running kill_after x job_timeout after it started is stuck: the next
+    time the pool is used, its worker processes are killed and a fresh set is started.
+    The stuck job fails with JobTimeout and any other job that was running with
+    WorkerPoolRestarted; queued jobs are unaffected. All workers are started together
+    when the executor is created, so the __main__ module is swapped only then and never
+    while jobs are being handed out. With max_workers=0 jobs run inline on the calling
+    thread (useful for debugging).
+    """
+
+    def __init__(self, max_workers, max_pending, job_timeout, poll_interval=0.25, max_abandoned=1, kill_after=3):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_abandoned = max_abandoned
+        self.job_timeout = job_timeout
+        self.kill_after = kill_after
+        self.poll_interval = poll_interval
+        self._executor = None
+        # Jobs wait here rather than in the executor, whose internal call queue cannot be cancelled
+        self._queue = deque()  # (future, fn, args) not yet handed to a worker
+        self._started = {}  # future -> time.monotonic() when it was handed to a worker
+        self._owned = {}  # owner -> set of futures still queued or running
+        self._abandoned = {}  # owner -> set of its running futures nobody waits for any more
+        self._lock = threading.Lock()
+        self.counts = {"completed": 0, "failed": 0, "cancelled": 0, "timed_out": 0, "rejected": 0,
+                       "restarted": 0}
+
+    def _get_executor(self):
+        # Caller holds the lock
+        if self._executor is None:
+            # spawn, not fork: forking the multi-threaded Streamlit server can copy held locks
+            executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            # The executor starts a worker per submit() while none is idle; these short jobs
+            # outlast the submits, so every worker starts here, with __main__ hidden once
+            with _hidden_main_module():
+                for _ in range(self.max_workers):
+                    executor.submit(time.sleep, WARM_UP_SECONDS)
+            self._executor = executor
+        return self._executor
+
+    def _restart_executor(self, reason):
+        # Caller holds the lock. Kills the workers; returns the running futures, now orphaned.
+        executor, self._executor = self._executor, None
+        running, self._started = list(self._started), {}
+        self.counts["restarted"] += 1
+        with stage("worker_pool_restart", reason=reason, jobs=len(running)):
+            if executor is not None:
+                # Running jobs cannot be cancelled, so their processes are killed
+                for process in list(getattr(executor, "_processes", {}).values()):
+                    process.kill()
+                executor.shutdown(wait=False, cancel_futures=True)
+        return running
+
+    def _recycle_stuck(self):
+        """Restarts the workers if a job has run for kill_after x job_timeout."""
+        cutoff = time.monotonic() - self.kill_after * self.job_timeout
+        with self._lock:
+            stuck = {future for future, started in self._started.items() if started < cutoff}
+            if not stuck:
+                return
+            running = self._restart_executor("stuck job")
+        for future in running:
+            if future in stuck:
+                future.set_exception(JobTimeout("The job was stopped because it ran far longer than expected."))
+            else:
+                future.set_exception(WorkerPoolRestarted("The server had to restart its workers. Please try again."))
+        self._dispatch()
+
+    def submit(self, owner, fn, *args):
+        """Queues fn(*args) for owner and returns its Future; raises WorkerPoolBusy when full."""
+        self._recycle_stuck()
+        future = Future()
+        with self._lock:
+            in_flight = sum(len(v) for v in self._owned.values())
+            if in_flight >= self.max_pending:
+                self.counts["rejected"] += 1
+                raise WorkerPoolBusy("The server is busy processing other requests. Please try again in a moment.")
+            if len(self._abandoned.get(owner, ())) > self.max_abandoned:
+                self.counts["rejected"] += 1
+                raise WorkerPoolBusy("Your previous request is still finishing on the server. "
+                                     "Please try again in a moment.")
+            self._owned.setdefault(owner, set()).add(future)
+            self._queue.append((future, fn, args))
+        future.add_done_callback(lambda f: self._on_done(owner, f))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Hands queued jobs to the executor while a worker is free."""
+        started, failed = [], []
+        with self._lock:
+            while self._queue and len(self._started) < self.max_workers:
+                future, fn, args = self._queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue  # Cancelled while queued
+                try:
+                    try:
+                        inner = self._get_executor().submit(fn, *args)
+                    except BrokenProcessPool:
+                        # A worker died (e.g. out of memory); start a fresh pool and try once more
+                        failed += [(orphan, WorkerPoolRestarted("The server had to restart its workers. "
+                                                                "Please try again."))
+                                   for orphan in self._restart_executor("broken pool")]
+                        inner = self._get_executor().submit(fn, *args)
+                except Exception as e:
+                    # The job is already marked running, so it must be failed here or it would hold
+                    # its max_pending slot forever
+                    failed.append((future, e))
+                    continue
+                self._started[future] = time.monotonic()
+                started.append((inner, future))
+        for future, error in failed:
+            future.set_exception(error)
+        # Attached outside the lock: a job that already finished runs its callback immediately
+        for inner, outer in started:
+            inner.add_done_callback(lambda f, outer=outer: self._on_worker_done(f, outer))
+
+    def _on_worker_done(self, inner, outer):
+        with self._lock:
+            # Gone when the pool was restarted meanwhile; the outer future has already failed
+            current = self._started.pop(outer, None) is not None
+        if current:
+            error = inner.exception()
+            if error is not None:
+                outer.set_exception(error)
+            else:
+                outer.set_result(inner.result())
+        self._dispatch()
+
+    def _on_done(self, owner, future):
+        if future.cancelled():
+            outcome = "cancelled"
+        elif future.exception() is not None:
+            outcome = "failed"
+        else:
+            outcome = "completed"
+        with self._lock:
+            self.counts[outcome] += 1
+            for jobs in (self._owned, self._abandoned):
+                owned = jobs.get(owner)
+                if owned is not None:
+                    owned.discard(future)
+                    if not owned:
+                        del jobs[owner]
+
+    def wait(self, future, on_poll=None, timeout=None):
+        """
+        Blocks until future finishes and returns its result. on_poll is called between
+        checks; the app uses it to update a status element, which gives Streamlit a point
+        to raise its rerun/stop exception. Leaving early for any reason cancels the job if
+        it is still queued; if it is already running it is marked abandoned (see the class
+        docstring) and keeps its worker until it finishes or is found stuck.
+        """
+        deadline = time.monotonic() + (timeout or self.job_timeout)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.counts["timed_out"] += 1
+                    raise JobTimeout("This is taking longer than expected. Please try again, or upload a smaller file.")
+                try:
+                    return future.result(timeout=min(self.poll_interval, remaining))
+                except FutureTimeoutError:
+                    self._recycle_stuck()
+                    if on_poll is not None:
+                        on_poll()
+        finally:
+            if not future.done():
+                self._abandon(future)
+
+    def _abandon(self, future):
+        """Cancels a queued job, or records a running one as abandoned by its owner."""
+        if future.cancel():
+            return
+        with self._lock:
+            owner = next((owner for owner, futures in self._owned.items() if future in futures), None)
+            if owner is not None and not future.done():
+                self._abandoned.setdefault(owner, set()).add(future)
+
+    def run(self, owner, fn, *args, on_poll=None, timeout=None):
+        """Submits fn(*args) and waits for it. Runs inline when the pool has no workers."""
+        if self.max_workers == 0:
+            return fn(*args)
+        return self.wait(self.submit(owner, fn, *args), on_poll=on_poll, timeout=timeout)
+
+    def run_many(self, owner, fn, args_iter, on_poll=None, timeout=None):
+        """
+        Runs fn(*args) for each args tuple, several at a time, and returns the results in
+        order. A job that fails contributes its exception instead of a result. owner keeps
+        at most max_workers jobs in flight, and args_iter is consumed only as jobs start,
+        so a generator can load each job's input on demand. Raises WorkerPoolBusy only
+        when none of the jobs could start, and JobTimeout when one of them times out.
+        """
+        results = []
+        args_iter = iter(args_iter)
+        if self.max_workers == 0:
+            for args in args_iter:
+                try:
+                    results.append(fn(*args))
+                except Exception as e:
+                    results.append(e)
+            return results
+        in_flight = deque()  # (index into results, future), oldest first
+        next_args = next(args_iter, None)
+        try:
+            while next_args is not None or in_flight:
+                while next_args is not None and len(in_flight) < self.max_workers:
+                    try:
+                        future = self.submit(owner, fn, *next_args)
+                    except WorkerPoolBusy:
+                        if not in_flight:
+                            raise
+                        break  # Other sessions hold the remaining slots; wait for one of ours
+                    results.append(None)
+                    in_flight.append((len(results) - 1, future))
+                    next_args = next(args_iter, None)
+                index, future = in_flight.popleft()
+                try:
+                    results[index] = self.wait(future, on_poll=on_poll, timeout=timeout)
+                except JobTimeout:
+                    raise
+                except Exception as e:
+                    results[index] = e
+        finally:
+            for _, future in in_flight:
+                self._abandon(future)
+        return results
+
+    def cancel(self, owner):
+        """Cancels owner's queued jobs and abandons its running ones. Returns how many were cancelled."""
+        with self._lock:
+            futures = list(self._owned.get(owner, ()))
+        cancelled = 0
+        for future in futures:
+            if future.cancel():
+                cancelled += 1
+            elif not future.done():
+                self._abandon(future)
+        return cancelled
+
+    def shutdown(self):
+        """Stops the worker processes (queued jobs are cancelled)."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        self._recycle_stuck()
+        with self._lock:
+            in_flight = sum(len(v) for v in self._owned.values())
+            abandoned = sum(len(v) for v in self._abandoned.values())
+            counts = dict(self.counts)
+            running = len(self._started)
+        return {"workers": self.max_workers, "max_pending": self.max_pending, "in_flight": in_flight,
+                "running": running, "abandoned": abandoned, **counts}